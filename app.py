@@ -22,55 +22,295 @@ Requirements
 3) A (DELETE NOTAM) button shall:
    * remove the related NOTAM from the displayed list of NOTAMS,
    * update the SELECTED DAY's yaml file, and
-   * add emphasis to the the (PLOT) button.
+   * re-plot the SELECTED DAY once edits stop for a few seconds.
 
 4) The (ADD NOTAM) button shall:
    * validate the input fields,
    * add a NOTAM to the displayed list of NOTAMS,
    * update the SELECTED DAY's yaml file, and
-   * cause add emphasis to the (PLOT) button.
+   * re-plot the SELECTED DAY once edits stop for a few seconds.
 
 5) The (PLOT) button shall:
-   * Cause a new plot to be generated for the SELECTED DAY, and
-   * remove emphasis from the (PLOT) button.
+   * Cause a new plot to be generated for the SELECTED DAY right away.
 
 """
 # Stantard Imports
 import datetime
-from flask import Flask, render_template, request, send_from_directory, jsonify
+import glob
+from flask import Flask, Response, abort, g, make_response, render_template, request, send_from_directory, jsonify
+import hashlib
+import math
 import os
+import re
+import struct
+import time
 
 
 # Custom Imports
+import lib_notam_events
+import lib_notam_metrics
 import lib_notam_yaml as lny
-import plot_notams
+import lib_plot_queue
+import render_worker
 
 
 # Constants
 DATA_DIR = [os.path.dirname(__file__), 'static_notams', 'data']
+IMAGE_DIR = [os.path.dirname(__file__), 'static_notams', 'images']
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60  # seconds
+IMAGE_TYPES = {'jpeg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp'}
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+TEMPLATE_DIR = [os.path.dirname(__file__), 'templates']
+IS_VARIANT = re.compile(r'_notams_(?P<width>[0-9]+)w\.(?P<extension>[a-z]+)$')
 
 
 # Setup
 app = Flask(__name__, static_url_path='')
+# responses change when the app or its templates are redeployed
+app_version = '%d' % max(os.stat(filename).st_mtime_ns for filename in
+                         [__file__] + glob.glob(os.path.join(*TEMPLATE_DIR, '*.html')))
+image_versions = {}  # image file -> (mtime_ns, size, version)
+
+
+# Functions
+def image_sources(day):
+    """
+    Return a dictionary mapping each image extension to the `srcset` string
+    listing the saved sizes of the plot for `day`, addressed by content
+    version (see `image_url`).
+
+    """
+    sources = {}
+    for variant in glob.glob(os.path.join(*IMAGE_DIR, '_'.join([day, 'notams_*w.*']))):
+        m = IS_VARIANT.search(variant)
+        if m and m.group('extension') in IMAGE_TYPES:
+            sources.setdefault(m.group('extension'), []).append((int(m.group('width')), variant))
+    if 'png' in sources:
+        full_size = os.path.join(*IMAGE_DIR, '_'.join([day, 'notams.png']))
+        width = png_width(full_size)
+        if width:
+            sources['png'].append((width, full_size))
+    return {extension: ', '.join('%s %dw' % (image_url(filename), width)
+                                 for width, filename in sorted(variants))
+            for extension, variants in sources.items()}
+
+
+def image_url(filename):
+    """
+    Return the URL for image FILE `filename`, with its content version as the
+    `v` query parameter so that it can be cached forever.
+
+    """
+    url = '/static_notams/images/%s' % os.path.basename(filename)
+    version = image_version(filename)
+    if version is None:
+        return url
+    return '%s?v=%s' % (url, version)
+
+
+def image_version(filename):
+    """
+    Return a short hash of the content of image FILE `filename`, or None if
+    it does not exist.  Hashes are cached until the file changes.
+
+    """
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return
+    cached = image_versions.get(filename)
+    hit = bool(cached) and cached[:2] == (stat.st_mtime_ns, stat.st_size)
+    lib_notam_metrics.count_cache(cache='image_version', hit=hit)
+    if hit:
+        return cached[2]
+    with open(filename, 'rb') as fd:
+        version = hashlib.sha1(fd.read()).hexdigest()[:16]
+    image_versions[filename] = (stat.st_mtime_ns, stat.st_size, version)
+    return version
+
+
+def file_validators(filenames, dated=True):
+    """
+    Return (etag, last_modified) for a response built from `filenames`,
+    derived from each file's modification time and size without reading it.
+    Missing files are part of the ETag too.  `last_modified` is None if no
+    file exists.
+
+    Pass `dated` False for a response whose day defaults to UTC today.  Its
+    `last_modified` is then None, since If-Modified-Since compares times only
+    and would answer 304 with yesterday's NOTAMs just after midnight; the
+    ETag includes the file names, so it tells the days apart.
+
+    """
+    state = [app_version]
+    last_modified = None
+    for filename in filenames:
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            state.append('%s:-' % os.path.basename(filename))
+            continue
+        state.append('%s:%d:%d' % (os.path.basename(filename), stat.st_mtime_ns, stat.st_size))
+        modified = datetime.datetime.fromtimestamp(int(stat.st_mtime), datetime.timezone.utc)
+        if last_modified is None or modified > last_modified:
+            last_modified = modified
+    return hashlib.sha1('|'.join(state).encode()).hexdigest(), last_modified if dated else None
+
+
+def is_not_modified(etag, last_modified):
+    """
+    Return True if the request's If-None-Match or If-Modified-Since headers
+    show that the client already has the response with these validators.
+
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    since = request.if_modified_since
+    if since is None or last_modified is None:
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=datetime.timezone.utc)
+    return last_modified <= since
+
+
+def with_validators(response, etag, last_modified):
+    """
+    Add ETag and Last-Modified headers to `response`, and require caches to
+    revalidate before reusing it.
+
+    """
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag, last_modified):
+    """
+    Return an empty 304 Not Modified response with the given validators.
+
+    """
+    return with_validators(Response(status=304), etag, last_modified)
+
+
+def notams_changed(day):
+    """
+    Publish a 'notams' event for the day file of `day` and schedule a new plot
+    of it, after a view has changed its NOTAMs.
+
+    """
+    lib_notam_events.publish_file(event_type='notams', filename=lny.day_file(os.path.join(*DATA_DIR), day))
+    lib_plot_queue.schedule(day=day)
+
+
+def parse_altitude(altitude):
+    """
+    Return `altitude` in feet as an int, None if it is None, or abort with
+    400 Bad Request if it is not a number.
+
+    """
+    if altitude is None:
+        return
+    try:
+        return int(altitude)
+    except (TypeError, ValueError):
+        abort(400)
+
+
+def png_width(filename):
+    """
+    Return the width in pixels of PNG FILE `filename` read from its header,
+    or None if it is missing or not a PNG.
+
+    """
+    try:
+        with open(filename, 'rb') as fd:
+            header = fd.read(24)
+    except FileNotFoundError:
+        return
+    if len(header) < 24 or header[:8] != PNG_SIGNATURE:
+        return
+    return struct.unpack('>I', header[16:20])[0]
 
 
 # Views
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_latency(response):
+    # streamed responses are timed up to the start of the stream
+    lib_notam_metrics.observe('notams_request_seconds',
+                              time.perf_counter() - g.request_start,
+                              endpoint=request.endpoint or 'unknown')
+    return response
+
+
+@app.route("/notams/metrics", methods=["GET"])
+def get_metrics():
+    return Response(lib_notam_metrics.exposition(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/notams/static_notams/images/<path:path>')
 def send_image(path):
-    return send_from_directory(os.path.join('static_notams', 'images'), path)
+    response = send_from_directory(os.path.join('static_notams', 'images'), path)
+    version = request.args.get('v')
+    if version and version == image_version(os.path.join(*IMAGE_DIR, path)):
+        # versioned URLs always name the same content
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMAGE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+@app.route('/notams/render/<day>.png', methods=["GET", "POST"])
+def render_image(day):
+    # Plot straight to memory.  GET plots the saved NOTAMs for day, POST
+    # previews a JSON list of (unsaved) NOTAMs.
+    map_type = request.args.get('map', lny.DEFAULT_MAP_TYPE)
+    if map_type not in lny.MAP_TYPES:
+        abort(400)
+    if request.method == 'POST':
+        raw_notams = request.get_json(force=True)
+        if not isinstance(raw_notams, list) or not all(isinstance(notam, dict) for notam in raw_notams):
+            abort(400)
+        notam_list = lny.validate_notams(raw_notams=raw_notams)
+    else:
+        input_file = os.path.join(*DATA_DIR, '_'.join([day, 'notams.yaml']))
+        notam_list = lny.import_notams(yaml_file=input_file)
+    png = render_worker.render_png(notam_list=notam_list, day=day, map_type=map_type)
+    return Response(png, mimetype='image/png')
 
 
 @app.route("/notams/", methods=["GET"])
 def home(day=None):
+    dated = day is not None
     if day is None:
-        day = plot_notams.utc_today()
+        day = lny.utc_today()
     input_file = os.path.join(*DATA_DIR, '_'.join([day, 'notams.yaml']))
+    if request.method == 'GET':
+        image_files = glob.glob(os.path.join(*IMAGE_DIR, '_'.join([day, 'notams*'])))
+        validators = file_validators([lny.source_file(input_file)] + sorted(image_files), dated=dated)
+        if is_not_modified(*validators):
+            return not_modified(*validators)
     notam_list = lny.import_notams(yaml_file=input_file)
-    # TODO: how to get plot emphasis?
-    return render_template("index.html",
-                           day=day,
-                           notam_list=notam_list,
-                           utc_timestamp=datetime.datetime.utcnow().isoformat())
+    utc_timestamp = datetime.datetime.utcnow().isoformat()
+    image_file = os.path.join(*IMAGE_DIR, '_'.join([day, 'notams.png']))
+    response = make_response(render_template("index.html",
+                                             day=day,
+                                             notam_list=notam_list,
+                                             image_url=image_url(image_file),
+                                             image_sources=image_sources(day),
+                                             utc_timestamp=utc_timestamp))
+    if request.method == 'GET':
+        with_validators(response, *validators)
+    return response
 
 
 @app.route("/notams/", methods=["POST"])
@@ -82,10 +322,11 @@ def home_post():
         print("Selecting new day,", day)
         return home(day)
     elif request.form['btn'] == 'plot':
-        day = request.form['day']
-        print("Plotting", day)
-        options = plot_notams.build_options(day=day)
-        plot_notams.main(options=options)
+        day = lny.normalize_day(request.form['day'])
+        if day is None:
+            abort(400)
+        print("Queueing plot", day)
+        lib_plot_queue.submit(day=day)
         return home(day)
     elif request.form['btn'] == 'del':
         print("Deleting NOTAM")
@@ -96,8 +337,8 @@ def home_post():
                   'lat': request.form['lat'],
                   'lon': request.form['lon'],
                   'rad': request.form['rad']}
-        lny.delete_notam(**kwargs)
-        # TODO: how to get plot emphasis in this case?
+        if lny.delete_notam(**kwargs):
+            notams_changed(day=day)
         return home(day)
     elif request.form['btn'] == 'upd':
         print("Updating NOTAM")
@@ -112,8 +353,8 @@ def home_post():
                   'lat': request.form['lat'],
                   'lon': request.form['lon'],
                   'rad': request.form['rad']}
-        lny.modify_notam(**kwargs)
-        # TODO: how to get plot emphasis in this case?
+        if lny.modify_notam(**kwargs):
+            notams_changed(day=day)
         return home(day)
     elif request.form['btn'] == 'add':
         print("Adding NOTAM")
@@ -125,8 +366,8 @@ def home_post():
                   'lat': request.form['lat'],
                   'lon': request.form['lon'],
                   'rad': request.form['rad']}
-        lny.add_notam(**kwargs)
-        # TODO: how to get plot emphasis in this case?
+        if lny.add_notam(**kwargs):
+            notams_changed(day=day)
         return home(day)
     else:
         print('found weird post')
@@ -138,11 +379,180 @@ def get_api(day=None):
     all_args = request.args.to_dict()
     if 'day' in all_args:
         day = all_args['day']
+    dated = day is not None
     if day is None:
-        day = plot_notams.utc_today()
+        day = lny.utc_today()
+    if {'start', 'end', 'bbox', 'cursor'} & set(all_args):
+        return get_api_range(all_args=all_args, day=day, dated=dated or bool(all_args.get('start')))
     input_file = os.path.join(*DATA_DIR, '_'.join([day, 'notams.yaml']))
+    validators = file_validators([lny.source_file(input_file)], dated=dated)
+    if is_not_modified(*validators):
+        return not_modified(*validators)
     notam_list = lny.import_notams(yaml_file=input_file)
-    return jsonify({'day': day, 'results': notam_list})
+    return with_validators(jsonify({'day': day, 'results': notam_list}), *validators)
+
+
+@app.route("/notams/api/events", methods=["GET"])
+def get_events():
+    # Server-sent events for changed day files ('notams'), regenerated plots
+    # ('plot'), and plot job status ('job'), see lib_notam_events.
+    event_id = request.headers.get('Last-Event-ID', request.args.get('since'))
+    try:
+        event_id = None if event_id is None else int(event_id)
+    except ValueError:
+        abort(400)
+    response = Response(lib_notam_events.stream(event_id=event_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+    return response
+
+
+@app.route("/notams/api/batch", methods=["POST"])
+def post_batch():
+    # Body: {"operations": [{"op": "add"|"upd"|"del", "day": ..., ...}, ...]},
+    # see lib_notam_yaml.apply_operations.
+    body = request.get_json(force=True)
+    if not isinstance(body, dict) or not isinstance(body.get('operations'), list):
+        abort(400)
+    results, changed_days = lny.apply_operations(data_dir=os.path.join(*DATA_DIR),
+                                                 operations=body['operations'])
+    for day in changed_days:
+        notams_changed(day=day)
+    return jsonify({'results': results, 'changed_days': changed_days})
+
+
+@app.route("/notams/api/plot", methods=["POST"])
+def post_plot():
+    # Queue a plot of day (form or JSON field) and return its job.
+    body = request.get_json(force=True, silent=True) or request.form.to_dict()
+    if not isinstance(body, dict):
+        abort(400)
+    day = lny.normalize_day(body.get('day') or lny.utc_today())
+    map_type = body.get('map', lny.DEFAULT_MAP_TYPE)
+    if day is None or map_type not in lny.MAP_TYPES:
+        abort(400)
+    return jsonify(lib_plot_queue.submit(day=day, map_type=map_type)), 202
+
+
+@app.route("/notams/api/plot/<job_id>", methods=["GET"])
+def get_plot(job_id):
+    job = lib_plot_queue.status(job_id=job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job)
+
+
+def get_api_range(all_args, day, dated=True):
+    # start/end (default: day), optional bbox=west,south,east,north, and
+    # cursor/limit pagination.  `dated` is False if the days default to UTC
+    # today, see `file_validators`.
+    start = all_args.get('start') or day
+    end = all_args.get('end') or start
+    try:
+        days = lny.days_in_range(start=start, end=end, limit=lny.MAX_QUERY_DAYS)
+        bbox = lny.parse_bbox(all_args['bbox']) if all_args.get('bbox') else None
+        # days compacted into one archive share its validators, so stat it once
+        input_files = dict.fromkeys(lny.source_file(os.path.join(*DATA_DIR, '_'.join([this_day, 'notams.yaml'])))
+                                    for this_day in days)
+        validators = file_validators(list(input_files), dated=dated)
+        if is_not_modified(*validators):
+            return not_modified(*validators)
+        results, next_cursor = lny.query_notams(data_dir=os.path.join(*DATA_DIR),
+                                                start=start,
+                                                end=end,
+                                                bbox=bbox,
+                                                cursor=all_args.get('cursor'),
+                                                limit=all_args.get('limit', lny.QUERY_LIMIT))
+    except (TypeError, ValueError) as err:
+        return jsonify({'error': str(err)}), 400
+    return with_validators(jsonify({'start': start,
+                                    'end': end,
+                                    'bbox': bbox,
+                                    'results': results,
+                                    'next_cursor': next_cursor}), *validators)
+
+
+@app.route("/notams/api/geojson", methods=["GET"])
+def get_geojson(day=None):
+    import lib_notam_geo as lng  # loads numpy, so only when geometry is needed
+    all_args = request.args.to_dict()
+    if 'day' in all_args:
+        day = all_args['day']
+    dated = day is not None
+    if day is None:
+        day = lny.utc_today()
+    try:
+        tolerance = float(all_args.get('simplify', 0))
+    except ValueError:
+        abort(400)
+    if not math.isfinite(tolerance) or tolerance < 0:
+        abort(400)  # nan would also be a cache key that never hits
+    input_file = os.path.join(*DATA_DIR, '_'.join([day, 'notams.yaml']))
+    validators = file_validators([lny.source_file(input_file)], dated=dated)
+    if is_not_modified(*validators):
+        return not_modified(*validators)
+    collection = lng.day_geojson(yaml_file=input_file, tolerance=tolerance)
+    response = jsonify(dict(collection, day=day))
+    response.mimetype = 'application/geo+json'
+    return with_validators(response, *validators)
+
+
+@app.route("/notams/api/point", methods=["GET"])
+def get_point(day=None):
+    # NOTE: NOTAMs are stored per UTC day, so lookups resolve to the day.
+    import lib_notam_geo as lng
+    all_args = request.args.to_dict()
+    if 'day' in all_args:
+        day = all_args['day']
+    if day is None:
+        day = lny.utc_today()
+    point = lng.decode_point(lat=all_args.get('lat', ''), lon=all_args.get('lon', ''))
+    if point is None:
+        abort(400)
+    altitude = parse_altitude(all_args.get('altitude'))
+    input_file = os.path.join(*DATA_DIR, '_'.join([day, 'notams.yaml']))
+    index = lng.day_index(yaml_file=input_file)
+    results = [dict(notam, distance_nm=round(distance, 1))
+               for notam, distance in lng.query_point(index=index, lat=point[0], lon=point[1], altitude=altitude)]
+    return jsonify({'day': day, 'lat': point[0], 'lon': point[1], 'results': results})
+
+
+@app.route("/notams/api/route", methods=["POST"])
+def post_route():
+    # Body: {"start": day, "end": day, "routes": [{"id": ..., "waypoints":
+    # [[lat, lon], ...]}, ...], "altitude": feet}.  start and end default to
+    # UTC today; without altitude, each NOTAM's largest radius is used.
+    import lib_notam_geo as lng
+    body = request.get_json(force=True)
+    if not isinstance(body, dict) or not isinstance(body.get('routes'), list):
+        abort(400)
+    altitude = parse_altitude(body.get('altitude'))
+    start = body.get('start') or lny.utc_today()
+    end = body.get('end') or start
+    try:
+        days = lny.days_in_range(start=start, end=end, limit=lny.MAX_QUERY_DAYS)
+    except (TypeError, ValueError):
+        abort(400)
+    routes = []
+    for route in body['routes']:
+        if not isinstance(route, dict) or not isinstance(route.get('waypoints'), list):
+            abort(400)
+        waypoints = [lng.decode_point(*point) if isinstance(point, list) and len(point) == 2 else None
+                     for point in route['waypoints']]
+        if not waypoints or None in waypoints:
+            abort(400)
+        routes.append((route.get('id'), waypoints))
+    results = [{'id': route_id, 'results': []} for route_id, _ in routes]
+    for day in days:
+        input_file = os.path.join(*DATA_DIR, '_'.join([day, 'notams.yaml']))
+        index = lng.day_index(yaml_file=input_file)
+        if not index['notams']:
+            continue
+        for result, (_, waypoints) in zip(results, routes):
+            for hit in lng.route_intersections(index=index, waypoints=waypoints, altitude=altitude):
+                result['results'].append(dict(hit['notam'], day=day, legs=hit['legs'],
+                                              distance_nm=round(hit['distance_nm'], 1)))
+    return jsonify({'start': start, 'end': end, 'routes': results})
 
 
 if __name__ == '__main__':
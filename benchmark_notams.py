@@ -0,0 +1,263 @@
+"""
+NOTAM Render Benchmark
+======================
+This module times the plot pipeline on synthetic day files and checks the
+rendered images against stored reference images, so that slowdowns and visual
+regressions show up when matplotlib, basemap, or this code changes.
+
+For each map type, the background is warped (`warp_map_image`), then for each
+size a day file with that many NOTAMs is loaded, its circles computed
+(`compute_circles`), and plotted (`make_plot`) on a reused background.  Each
+stage is timed over --repeat runs, and the peak RSS of the process after the
+stage is recorded.  The synthetic NOTAMs are random but seeded, so every run
+draws the same plots.
+
+Results are printed, and saved with the library versions as the file
+<benchmark.json> in the output directory.  The exit status is 1 if an image
+differs from its reference by more than the tolerance.  An image with no
+reference is reported as missing and skipped; run with --update-references
+to save one.
+
+Usage:
+    benchmark_notams.py -h
+    benchmark_notams.py [--sizes SIZES] [--maps TYPES] [--repeat N] [--outdir DIR] [--references DIR] [--tolerance RMS] [--update-references]
+
+Options:
+  -h --help             Show this screen.
+  --sizes SIZES         Comma separated numbers of NOTAMs per synthetic day
+                        [default: 10,100,1000].
+  --maps TYPES          Comma separated map types to render
+                        [default: basic,etopo,marble,shaded].
+  --repeat N            Number of timed runs of each stage [default: 3].
+  --outdir DIR          Directory for the synthetic day files, the rendered
+                        images, and the results [default: benchmark_output].
+  --references DIR      Directory of the reference images
+                        [default: tests/reference_images].
+  --tolerance RMS       Largest root mean square difference, in 8 bit color
+                        levels, between an image and its reference
+                        [default: 2.0].
+  --update-references   Save the rendered images as the new references
+                        instead of comparing them.
+
+"""
+# Standard Imports
+from docopt import docopt
+import json
+import matplotlib
+import numpy as np
+import os
+from PIL import Image
+import platform
+import shutil
+import sys
+import time
+
+
+# Custom Imports
+import lib_notam_metrics
+import lib_notam_yaml as lny
+import plot_notams
+
+
+# Constants
+BENCHMARK_DAY = '2000-01-01'
+LATITUDE_RANGE = (10.0, 70.0)  # keep the NOTAMs on the visible side of the globe
+LONGITUDE_RANGE = (-160.0, -40.0)
+RADIUS_RANGE = (20, 400)
+RESULTS_FILE = 'benchmark.json'
+SEED = 20181027
+
+
+# Functions
+def main(options):
+    """
+    Run the benchmark, compare or update the reference images, and exit with
+    status 1 if any image differs from its reference.
+
+    """
+    outdir = options['--outdir']
+    os.makedirs(os.path.join(outdir, 'data'), exist_ok=True)
+    os.makedirs(os.path.join(outdir, 'images'), exist_ok=True)
+    day_files = {size: write_day_file(outdir=outdir, size=size) for size in options['--sizes']}
+    results = {'versions': library_versions(), 'runs': []}
+    failed = False
+    for map_type in options['--maps']:
+        print("Warping %s background ..." % map_type)
+        seconds, warped = time_stage(lambda: plot_notams.warp_map_image(map_type=map_type),
+                                     repeat=options['--repeat'],
+                                     cleanup=plot_notams.close_background)
+        plot_notams.close_background(warped)
+        results['runs'].append(stage_result(map_type=map_type, size=None, stage='warp_map_image', seconds=seconds))
+        background = plot_notams.build_background(map_type=map_type)
+        for size, yaml_file in sorted(day_files.items()):
+            print("Plotting %d NOTAMs on %s ..." % (size, map_type))
+            run = benchmark_size(map_type=map_type, size=size, yaml_file=yaml_file, background=background,
+                                 outdir=outdir, repeat=options['--repeat'])
+            results['runs'].extend(run['stages'])
+            image = run['image']
+            reference = os.path.join(options['--references'], os.path.basename(image))
+            if options['--update-references']:
+                os.makedirs(options['--references'], exist_ok=True)
+                shutil.copyfile(image, reference)
+                comparison = {'image': image, 'reference': reference, 'status': 'updated', 'rms': None}
+            else:
+                comparison = compare_images(image=image, reference=reference, tolerance=options['--tolerance'])
+                failed = failed or comparison['status'] == 'different'
+            results.setdefault('images', []).append(comparison)
+        plot_notams.close_background(background)
+    print_results(results=results)
+    with open(os.path.join(outdir, RESULTS_FILE), 'w') as fd:
+        json.dump(results, fd, indent=2, sort_keys=True)
+    if failed:
+        sys.exit(1)
+
+
+def write_day_file(outdir, size):
+    """
+    Write a synthetic day file with `size` NOTAMs to directory `outdir`, and
+    return its name.
+
+    """
+    random = np.random.RandomState(SEED + size)
+    notam_list = []
+    for ii in range(size):
+        lat = random.uniform(*LATITUDE_RANGE)
+        lon = random.uniform(*LONGITUDE_RANGE)
+        notam_list.append({'ident': 'B/%d' % ii,
+                           'lat': format_dms(value=lat, positive='N', negative='S', degree_digits=2),
+                           'lon': format_dms(value=lon, positive='E', negative='W', degree_digits=3),
+                           'rad': '%dNM' % random.randint(*RADIUS_RANGE)})
+    yaml_file = os.path.join(outdir, 'data', '%d_notams.yaml' % size)
+    lny.export_notams(yaml_file=yaml_file, notam_list=notam_list)
+    return yaml_file
+
+
+def format_dms(value, positive, negative, degree_digits):
+    """
+    Return decimal degrees `value` formatted as [D]DDMMSS[positive|negative].
+
+    """
+    seconds = int(round(abs(value) * 3600))
+    degrees, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return '%0*d%02d%02d%s' % (degree_digits, degrees, minutes, seconds, positive if value >= 0 else negative)
+
+
+def benchmark_size(map_type, size, yaml_file, background, outdir, repeat):
+    """
+    Time loading, computing circles for, and plotting the day file
+    `yaml_file` with `size` NOTAMs on the warped `background` of `map_type`.
+    Return a dictionary with the list of 'stages' results and the rendered
+    'image' file.
+
+    """
+    stages = []
+    seconds, notam_list = time_stage(lambda: lny.import_notams(yaml_file=yaml_file), repeat=repeat)
+    stages.append(stage_result(map_type=map_type, size=size, stage='import_notams', seconds=seconds))
+    notams = plot_notams.create_plot_dictionary(notam_list=notam_list)
+    seconds, circles = time_stage(lambda: plot_notams.compute_circles(notams), repeat=repeat)
+    stages.append(stage_result(map_type=map_type, size=size, stage='compute_circles', seconds=seconds))
+    notams['circles'] = circles
+    image = os.path.join(outdir, 'images', '%s_%d.png' % (map_type, size))
+    seconds, _ = time_stage(lambda: plot_notams.make_plot(notams=notams, day=BENCHMARK_DAY, outfile=image,
+                                                          map_type=map_type, background=background),
+                            repeat=repeat)
+    stages.append(stage_result(map_type=map_type, size=size, stage='make_plot', seconds=seconds))
+    return {'stages': stages, 'image': image}
+
+
+def time_stage(function, repeat, cleanup=None):
+    """
+    Call `function` `repeat` times and return (list of seconds per call,
+    result of the last call).  `cleanup` is called with the result of every
+    call but the last.
+
+    """
+    seconds = []
+    result = None
+    for ii in range(repeat):
+        if result is not None and cleanup is not None:
+            cleanup(result)
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    return seconds, result
+
+
+def stage_result(map_type, size, stage, seconds):
+    """
+    Return the result dictionary of one timed stage.
+
+    """
+    return {'map_type': map_type,
+            'size': size,
+            'stage': stage,
+            'min_seconds': min(seconds),
+            'median_seconds': float(np.median(seconds)),
+            'peak_rss_mib': lib_notam_metrics.peak_rss() / 2 ** 20}
+
+
+def compare_images(image, reference, tolerance):
+    """
+    Return a dictionary with the 'status' ('ok', 'different', or 'missing')
+    and the root mean square difference 'rms' of FILE `image` against FILE
+    `reference`.
+
+    """
+    comparison = {'image': image, 'reference': reference, 'status': 'missing', 'rms': None}
+    if not os.path.exists(reference):
+        return comparison
+    with Image.open(image) as actual, Image.open(reference) as expected:
+        if actual.size != expected.size:
+            comparison['status'] = 'different'
+            return comparison
+        actual = np.asarray(actual.convert('RGB'), dtype=float)
+        expected = np.asarray(expected.convert('RGB'), dtype=float)
+    comparison['rms'] = float(np.sqrt(np.mean((actual - expected) ** 2)))
+    comparison['status'] = 'ok' if comparison['rms'] <= tolerance else 'different'
+    return comparison
+
+
+def library_versions():
+    """
+    Return the versions of the libraries that affect rendering.
+
+    """
+    import mpl_toolkits.basemap
+    import PIL
+    return {'python': platform.python_version(),
+            'matplotlib': matplotlib.__version__,
+            'basemap': mpl_toolkits.basemap.__version__,
+            'numpy': np.__version__,
+            'pillow': PIL.__version__}
+
+
+def print_results(results):
+    """
+    Print the stage timings and image comparisons in `results`.
+
+    """
+    print('%-8s %6s %-16s %12s %12s %14s' % ('map', 'size', 'stage', 'min s', 'median s', 'peak RSS MiB'))
+    for run in results['runs']:
+        print('%-8s %6s %-16s %12.3f %12.3f %14.1f' % (run['map_type'], run['size'] or '-', run['stage'],
+                                                       run['min_seconds'], run['median_seconds'],
+                                                       run['peak_rss_mib']))
+    for comparison in results.get('images', []):
+        rms = '-' if comparison['rms'] is None else '%.2f' % comparison['rms']
+        print('%-10s rms %6s  %s' % (comparison['status'], rms, comparison['image']))
+
+
+def build_options():
+    options = docopt(__doc__)
+    options['--sizes'] = [int(size) for size in options['--sizes'].split(',')]
+    options['--maps'] = options['--maps'].split(',')
+    for map_type in options['--maps']:
+        if map_type not in lny.MAP_TYPES:
+            raise ValueError('ERROR: unknown map type %s, expected one of %s' % (map_type, lny.MAP_TYPES))
+    options['--repeat'] = max(1, int(options['--repeat']))
+    options['--tolerance'] = float(options['--tolerance'])
+    return options
+
+
+if __name__ == '__main__':
+    main(options=build_options())
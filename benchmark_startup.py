@@ -0,0 +1,88 @@
+"""
+Startup Benchmark
+=================
+This module measures how long a fresh process takes to import the web app,
+and how much memory it holds afterwards, as every gunicorn worker does on
+boot.
+
+Each case is imported in a new Python process, --runs times.  The 'lazy' case
+imports the app as deployed; the 'eager' case also imports the plotting and
+geometry modules up front, as the app did before they were loaded on first
+use.  For each case the median import time, median process time, peak RSS,
+and the heavy libraries that ended up loaded are printed.
+
+Usage:
+    benchmark_startup.py -h
+    benchmark_startup.py [--runs N]
+
+Options:
+  -h --help     Show this screen.
+  --runs N      Number of processes to start per case [default: 5].
+
+"""
+# Standard Imports
+from docopt import docopt
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+# Constants
+CASES = [('lazy', ['app']),
+         ('eager', ['app', 'plot_notams', 'lib_notam_geo'])]
+CHILD_CODE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+for module in {modules!r}:
+    __import__(module)
+seconds = time.perf_counter() - start
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{'seconds': seconds,
+                  'peak_rss': peak if sys.platform == 'darwin' else peak * 1024,
+                  'loaded': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+HEAVY_MODULES = ['matplotlib', 'mpl_toolkits.basemap', 'numpy', 'PIL', 'pytz']
+
+
+# Functions
+def main(options):
+    """
+    Time each case and print the results.
+
+    """
+    print('%-6s %12s %12s %14s  %s' % ('case', 'import s', 'process s', 'peak RSS MiB', 'heavy modules loaded'))
+    for name, modules in CASES:
+        runs = [start_process(modules=modules) for ii in range(options['--runs'])]
+        print('%-6s %12.3f %12.3f %14.1f  %s' % (name,
+                                                 statistics.median(run['seconds'] for run in runs),
+                                                 statistics.median(run['process_seconds'] for run in runs),
+                                                 max(run['peak_rss'] for run in runs) / 2 ** 20,
+                                                 ', '.join(runs[-1]['loaded']) or '-'))
+
+
+def start_process(modules):
+    """
+    Import `modules` in a new Python process and return a dictionary of its
+    import 'seconds', total 'process_seconds', 'peak_rss' in bytes, and the
+    HEAVY_MODULES it 'loaded'.
+
+    """
+    start = time.perf_counter()
+    output = subprocess.check_output([sys.executable, '-c', CHILD_CODE.format(modules=modules, heavy=HEAVY_MODULES)],
+                                     cwd=os.path.dirname(os.path.abspath(__file__)))
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    result['process_seconds'] = time.perf_counter() - start
+    return result
+
+
+def build_options():
+    options = docopt(__doc__)
+    options['--runs'] = max(1, int(options['--runs']))
+    return options
+
+
+if __name__ == '__main__':
+    main(options=build_options())
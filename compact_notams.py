@@ -0,0 +1,74 @@
+"""
+NOTAM Compactor
+===============
+This module packs the day files of past months into one zip archive per month,
+so that the data directory does not grow by a file every day.  Archived days
+are still read transparently by `lib_notam_yaml.import_notams`.
+
+Usage:
+    compact_notams.py -h
+    compact_notams.py [--datadir DIR] [--before MONTH]
+
+Options:
+  -h --help           Show this screen.
+  --datadir DIR       Override the default directory of yaml files.
+  --before MONTH      Compact the months before MONTH, formatted as YYYY-MM.
+                      Default is the current UTC month.
+
+"""
+# Standard Imports
+import datetime
+from docopt import docopt
+import glob
+import os
+
+
+# Custom Imports
+import lib_notam_yaml as lny
+
+
+# Constants
+DATADIR = [os.path.dirname(__file__), 'static_notams', 'data']
+
+
+# Functions
+def main(options):
+    """
+    Compact the day files of every month before the --before month.
+
+    """
+    datadir = options['--datadir']
+    for month in months_to_compact(data_dir=datadir, before=options['--before']):
+        print("Compacting", month, "...")
+        compacted = lny.compact_month(data_dir=datadir, month=month)
+        print("    archived %d day files" % len(compacted))
+    return
+
+
+def months_to_compact(data_dir, before):
+    """
+    Return the sorted months (YYYY-MM) before month `before` that have day
+    files in directory `data_dir`.
+
+    """
+    months = set()
+    for name in glob.glob(os.path.join(data_dir, '*_notams.yaml')):
+        match = lny.DAY_FILE_RE.match(os.path.basename(name))
+        if match and match.group('month') < before:
+            months.add(match.group('month'))
+    return sorted(months)
+
+
+def build_options():
+    options = docopt(__doc__)
+    if not options['--datadir']:
+        options['--datadir'] = os.path.join(*DATADIR)
+    if not options['--before']:
+        options['--before'] = datetime.datetime.utcnow().strftime('%Y-%m')
+    else:
+        datetime.datetime.strptime(options['--before'], '%Y-%m')  # validate
+    return options
+
+
+if __name__ == '__main__':
+    main(options=build_options())
@@ -0,0 +1,194 @@
+"""
+NOTAM Outage Heatmap
+====================
+This module counts, for every cell of a global lat/lon grid, the number of days
+in a date range on which at least one GPS NOTAM covered the cell, and plots the
+counts as a heatmap.
+
+Days are split across worker processes.  NOTAM locations are read from the
+history cache (see lib_notam_history.py) when it covers the date range and no
+day in it changed since the cache was built, and from the day files otherwise.
+
+Usage:
+    heatmap_notams.py -h
+    heatmap_notams.py --start DATE --end DATE [--marble|--etopo|--basic] [--resolution DEG] [--processes N] [--outfile FILE] [--grid FILE] [--formats FORMATS]
+
+Options:
+  -h --help           Show this screen.
+  --start DATE        First UTC day (inclusive), formatted as YYYY-MM-DD.
+  --end DATE          Last UTC day (inclusive), formatted as YYYY-MM-DD.
+  --basic             Use minimalist map background instead of the default
+                      shadedrelief.
+  --marble            Use the bluemarble map background instead of the default
+                      shadedrelief.
+  --etopo             Use the etopo relief map background instead of the default
+                      shadedrelief.
+  --resolution DEG    Grid cell size in degrees [default: 0.25].
+  --processes N       Number of worker processes.  Default is one per CPU.
+  --outfile FILE      Save the heatmap as FILE.  If not specified, the file
+                      name is derived from the dates as the file
+                      <START_END_heatmap.png> in the images directory.
+  --grid FILE         Save the raw outage day counts as compressed NumPy FILE.
+                      If not specified, the file name is derived from the
+                      dates as the file <START_END_heatmap.npz> in the data
+                      directory.
+  --formats FORMATS   Comma separated encodings of reduced size variants of
+                      the heatmap, as for plot_notams.py [default: none].
+
+"""
+# Standard Imports
+from docopt import docopt
+import multiprocessing
+import numpy as np
+import os
+
+
+# Custom Imports
+from lib_notam_geo import coverage_grid, save_coverage
+import lib_notam_history
+from lib_notam_yaml import day_file, days_in_range, import_notams, source_file
+import plot_notams
+
+
+# Constants
+DATA_DIR = [os.path.dirname(__file__), 'static_notams', 'data']
+DAYS_PER_TASK = 8
+PLOT_DIR = [os.path.dirname(__file__), 'static_notams', 'images']
+
+
+# Functions
+def main(options):
+    """
+    Count outage days per grid cell over the date range, then save the grid
+    and plot the heatmap.
+
+    """
+    days = days_in_range(start=options['--start'], end=options['--end'])
+    print("Reading NOTAMs for %d days ..." % len(days))
+    day_notams = load_day_notams(days=days)
+    print("Counting outage days ...")
+    count, cell_lats, cell_lons = outage_days(day_notams=day_notams,
+                                              resolution=options['--resolution'],
+                                              processes=options['--processes'])
+    print("Saving grid %s ..." % options['--grid'])
+    save_coverage(filename=options['--grid'], count=count, resolution=options['--resolution'])
+    print("Generating Heatmap %s ..." % options['--outfile'])
+    title = 'GPS NOTAM outage days, %s to %s' % (days[0], days[-1])
+    plot_notams.make_heatmap(coverage=(count, cell_lats, cell_lons),
+                             title=title,
+                             outfile=options['--outfile'],
+                             map_type=options['map-type'],
+                             formats=options['--formats'])
+    print("Success")
+    return
+
+
+def load_day_notams(days, data_dir=os.path.join(*DATA_DIR)):
+    """
+    Return a list of (latitudes, longitudes, radii) arrays, one tuple per day
+    of `days` that has NOTAMs.
+
+    """
+    history = None
+    if os.path.abspath(data_dir) == os.path.abspath(lib_notam_history.DATA_DIR):
+        history = lib_notam_history.load_history()  # the cache is of the default data directory
+    if history is not None and history_covers(history=history, days=days, data_dir=data_dir):
+        day_notams = []
+        for day in days:
+            rows = lib_notam_history.day_rows(history=history, start=day, end=day)
+            if rows.start < rows.stop:
+                day_notams.append((np.array(history['lat'][rows]),
+                                   np.array(history['lon'][rows]),
+                                   np.array(history['rad'][rows])))
+        return day_notams
+    day_notams = []
+    for day in days:
+        notam_list = import_notams(yaml_file=day_file(data_dir=data_dir, day=day))
+        if notam_list:
+            notams = plot_notams.create_plot_dictionary(notam_list=notam_list)
+            day_notams.append((np.array(notams['latitudes']),
+                               np.array(notams['longitudes']),
+                               np.array(notams['radii'])))
+    return day_notams
+
+
+def history_covers(history, days, data_dir):
+    """
+    Return True if the loaded `history` cache has every day of `days`, and
+    none of their day files or archives in directory `data_dir` changed since
+    the cache was built.
+
+    """
+    if not len(history['day']) or str(history['day'][-1]) < days[-1]:
+        return False
+    built = lib_notam_history.build_time(history)
+    if built is None:
+        return False
+    for day in days:
+        try:
+            if os.stat(source_file(day_file(data_dir=data_dir, day=day))).st_mtime_ns >= built:
+                return False
+        except FileNotFoundError:
+            continue
+    return True
+
+
+def outage_days(day_notams, resolution, processes=None):
+    """
+    Return (count, cell_lats, cell_lons) where count[i, j] is the number of
+    days in `day_notams` (see `load_day_notams`) with at least one NOTAM
+    covering the cell.  The days are split across `processes` workers.
+
+    """
+    tasks = [(day_notams[ii:ii + DAYS_PER_TASK], resolution)
+             for ii in range(0, len(day_notams), DAYS_PER_TASK)]
+    count, cell_lats, cell_lons = coverage_grid(latitudes=[], longitudes=[], radii=[], resolution=resolution)
+    count = count.astype(np.uint32)
+    if not tasks:
+        return count, cell_lats, cell_lons
+    with multiprocessing.Pool(processes=processes) as pool:
+        for partial in pool.imap_unordered(count_outage_days, tasks):
+            count += partial
+    return count, cell_lats, cell_lons
+
+
+def count_outage_days(task):
+    """
+    Return the outage day count grid for one (day_notams, resolution) `task`.
+
+    """
+    day_notams, resolution = task
+    count = None
+    for latitudes, longitudes, radii in day_notams:
+        covered = coverage_grid(latitudes=latitudes, longitudes=longitudes, radii=radii,
+                                resolution=resolution)[0] > 0
+        if count is None:
+            count = np.zeros(covered.shape, dtype=np.uint32)
+        count += covered
+    return count
+
+
+def build_options():
+    options = docopt(__doc__)
+    options['--resolution'] = float(options['--resolution'])
+    if options['--processes'] is not None:
+        options['--processes'] = int(options['--processes'])
+    if options['--basic']:
+        options['map-type'] = 'basic'
+    elif options['--marble']:
+        options['map-type'] = 'marble'
+    elif options['--etopo']:
+        options['map-type'] = 'etopo'
+    else:  # default
+        options['map-type'] = plot_notams.DEFAULT_MAP_TYPE
+    plot_notams.variant_encodings(options['--formats'])
+    name = '_'.join([options['--start'], options['--end'], 'heatmap'])
+    if options['--outfile'] is None:
+        options['--outfile'] = os.path.join(*PLOT_DIR, name + '.png')
+    if options['--grid'] is None:
+        options['--grid'] = os.path.join(*DATA_DIR, name + '.npz')
+    return options
+
+
+if __name__ == '__main__':
+    main(options=build_options())
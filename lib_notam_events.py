@@ -0,0 +1,186 @@
+"""
+NOTAM Events
+============
+This library publishes change events for day files and plots, and streams
+them to web clients as server-sent events.
+
+Events published in this process (see `publish`) are delivered right away.
+Day files and plots written by other processes, such as the retriever or the
+render worker, are picked up by a watcher thread that checks their
+modification times every few seconds.
+
+Each stream holds a server thread, so streams end after STREAM_SECONDS (the
+client reconnects after `retry` and resumes from its last event id), and at
+most MAX_STREAMS run at once; past that a client is told to retry later.
+
+"""
+# Standard Imports
+from collections import deque
+import glob
+import json
+import os
+import threading
+import time
+
+
+# Constants
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'static_notams', 'data')
+EVENT_HISTORY_SIZE = 500
+IMAGE_DIR = os.path.join(os.path.dirname(__file__), 'static_notams', 'images')
+BUSY_RETRY_MILLISECONDS = 30000
+KEEPALIVE_SECONDS = 15
+MAX_STREAMS = 8
+RETRY_MILLISECONDS = 3000
+STREAM_SECONDS = 300
+WATCH_PATTERNS = {'notams': os.path.join(DATA_DIR, '*_notams.yaml'),
+                  'plot': os.path.join(IMAGE_DIR, '*_notams.png')}
+WATCH_SECONDS = 2
+
+
+# Setup
+events = deque(maxlen=EVENT_HISTORY_SIZE)  # most recent event dictionaries
+condition = threading.Condition()
+file_mtimes = {}  # watched file -> mtime_ns when last published
+watchers = []
+last_id = 0
+open_streams = 0
+
+
+# Functions
+def publish(event_type, filename=None, **data):
+    """
+    Publish an event of `event_type` ('notams', 'plot', or 'job') with the
+    `data` keyword arguments, and return its id.  When the event is about a
+    day file or plot `filename`, pass it so that the watcher thread does not
+    publish the same change again.
+
+    """
+    global last_id
+    with condition:
+        if filename is not None:
+            try:
+                file_mtimes[filename] = os.stat(filename).st_mtime_ns
+            except FileNotFoundError:
+                file_mtimes.pop(filename, None)
+        last_id += 1
+        event = dict(data, id=last_id, type=event_type, time=time.time())
+        events.append(event)
+        condition.notify_all()
+    return event['id']
+
+
+def publish_file(event_type, filename):
+    """
+    Publish an `event_type` event for the day file or plot `filename`.
+
+    """
+    day = os.path.basename(filename).split('_')[0]
+    return publish(event_type, filename=filename, day=day)
+
+
+def events_since(event_id):
+    """
+    Return the retained events published after `event_id`.
+
+    """
+    with condition:
+        return [event for event in events if event['id'] > event_id]
+
+
+def wait_for_events(event_id, timeout):
+    """
+    Return the events published after `event_id`, waiting up to `timeout`
+    seconds for one if there are none yet.
+
+    """
+    with condition:
+        condition.wait_for(lambda: last_id > event_id, timeout=timeout)
+    return events_since(event_id)
+
+
+def stream(event_id=None):
+    """
+    Generate server-sent event messages for every event published after
+    `event_id` (default: only new events), with keepalive comments in
+    between.  Runs until the client disconnects or STREAM_SECONDS pass; if
+    MAX_STREAMS are already open, only asks the client to retry later.
+
+    """
+    global open_streams
+    with condition:
+        busy = open_streams >= MAX_STREAMS
+        if not busy:
+            open_streams += 1
+    if busy:
+        yield 'retry: %d\n\n' % BUSY_RETRY_MILLISECONDS
+        return
+    try:
+        start_watcher()
+        if event_id is None:
+            event_id = last_id
+        # the id lets a client that saw no events resume from here too
+        yield 'retry: %d\nid: %d\n\n' % (RETRY_MILLISECONDS, event_id)
+        deadline = time.monotonic() + STREAM_SECONDS
+        while time.monotonic() < deadline:
+            timeout = min(KEEPALIVE_SECONDS, deadline - time.monotonic())
+            new_events = wait_for_events(event_id=event_id, timeout=max(timeout, 0))
+            if not new_events:
+                yield ': keepalive\n\n'
+            for event in new_events:
+                event_id = event['id']
+                yield format_event(event)
+    finally:
+        with condition:
+            open_streams -= 1
+
+
+def format_event(event):
+    """
+    Return `event` formatted as a server-sent event message.
+
+    """
+    return 'id: %d\nevent: %s\ndata: %s\n\n' % (event['id'], event['type'], json.dumps(event))
+
+
+def start_watcher():
+    """
+    Start the thread that watches for day files and plots written by other
+    processes, if it is not running yet.
+
+    """
+    with condition:
+        if watchers:
+            return
+        scan_files(publish_changes=False)
+        watcher = threading.Thread(target=run_watcher, name='notam-events', daemon=True)
+        watcher.start()
+        watchers.append(watcher)
+
+
+def run_watcher():
+    """
+    Publish an event for every changed day file or plot, forever.
+
+    """
+    while True:
+        time.sleep(WATCH_SECONDS)
+        scan_files()
+
+
+def scan_files(publish_changes=True):
+    """
+    Check the modification times of the watched files, and publish an event
+    for each one that changed since it was last seen.
+
+    """
+    for event_type, pattern in sorted(WATCH_PATTERNS.items()):
+        for filename in glob.glob(pattern):
+            try:
+                mtime = os.stat(filename).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            with condition:
+                changed = file_mtimes.get(filename) != mtime
+                file_mtimes[filename] = mtime
+            if changed and publish_changes:
+                publish_file(event_type=event_type, filename=filename)
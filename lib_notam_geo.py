@@ -0,0 +1,495 @@
+"""
+NOTAM Geometry Library
+======================
+This library contains the geometry shared by the plots and the APIs: the
+circle around each NOTAM, GeoJSON polygons built from those circles,
+rasterized coverage of all NOTAMs on a global lat/lon grid, and a spatial
+index for finding the NOTAMs that affect a point or a route.
+
+"""
+# Standard Imports
+import math
+import numpy as np
+import os
+import threading
+
+
+# Custom Imports
+import lib_notam_metrics
+from lib_notam_yaml import MAX_LATITUDE, MAX_LONGITUDE, import_notams, notam_tiers, source_file, tier_radius, validate_lat, validate_lon, validate_radius
+
+
+# Constants
+COVERAGE_RESOLUTION = 0.25  # degrees per grid cell
+DAY_CACHE_SIZE = 256
+# Earth's radius in nautical miles - ref http://science.answers.com/Q/What_is_the_radius_of_earth
+EARTH_RADIUS_NM = 3440.07
+GEOJSON_PRECISION = 4  # decimal places, about 11 meters
+INDEX_CELL_SIZE = 1.0  # degrees per spatial index cell
+
+
+# Setup
+day_cache = {}  # (yaml_file, name) -> (mtime, value)
+day_cache_lock = threading.Lock()  # the app's request threads share day_cache
+
+
+# Functions
+def day_geojson(yaml_file, tolerance=0.0):
+    """
+    Return the GeoJSON FeatureCollection for the NOTAMs in YAML dump FILE
+    `yaml_file`.  Results are cached until the file is modified.
+
+    """
+    def build():
+        return notams_geojson(notam_list=import_notams(yaml_file=yaml_file), tolerance=tolerance)
+    return cached_for_file(yaml_file=yaml_file, name=('geojson', tolerance), build=build)
+
+
+def day_index(yaml_file):
+    """
+    Return the spatial index (see `build_index`) for the NOTAMs in YAML dump
+    FILE `yaml_file`.  Results are cached until the file is modified.
+
+    """
+    def build():
+        return build_index(notam_list=import_notams(yaml_file=yaml_file))
+    return cached_for_file(yaml_file=yaml_file, name='index', build=build)
+
+
+def cached_for_file(yaml_file, name, build):
+    """
+    Return the value `build()` computed for `yaml_file`, reusing the value
+    cached under `name` as long as the file's modification time is unchanged.
+
+    """
+    try:
+        mtime = os.stat(source_file(yaml_file)).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    key = (yaml_file, name)
+    with day_cache_lock:
+        cached = day_cache.get(key)
+    hit = cached is not None and cached[0] == mtime
+    kind = name[0] if isinstance(name, tuple) else name
+    lib_notam_metrics.count_cache(cache='day_' + kind, hit=hit)
+    if hit:
+        return cached[1]
+    value = build()  # outside the lock, so other days are served meanwhile
+    with day_cache_lock:
+        day_cache.pop(key, None)
+        day_cache[key] = (mtime, value)
+        while len(day_cache) > DAY_CACHE_SIZE:
+            del day_cache[next(iter(day_cache))]  # oldest entry
+    return value
+
+
+def notams_geojson(notam_list, tolerance=0.0):
+    """
+    Return a GeoJSON FeatureCollection with one Polygon Feature per NOTAM in
+    the validated `notam_list`.
+
+    Polygon rings are simplified so that no vertex is removed that lies more
+    than `tolerance` degrees from the simplified ring.  A `tolerance` of 0
+    keeps every vertex.
+
+    """
+    return {'type': 'FeatureCollection',
+            'features': [notam_feature(notam=notam, tolerance=tolerance) for notam in notam_list]}
+
+
+def notam_feature(notam, tolerance=0.0):
+    """
+    Return a GeoJSON Polygon Feature for the circle around `notam`.
+
+    NOTE: longitudes are continuous across the antimeridian (they may be
+    slightly less than -180 or greater than 180) so the ring stays closed.
+
+    """
+    lat = validate_lat(lat=str(notam['lat']).upper())
+    lon = validate_lon(lon=str(notam['lon']).upper())
+    radius = validate_radius(r=str(notam['rad']).upper())
+    circle_lats, circle_lons = compute_circle(lat, lon, radius)
+    ring = [(round(x, GEOJSON_PRECISION), round(y, GEOJSON_PRECISION))
+            for x, y in zip(circle_lons, circle_lats)]
+    ring.append(ring[0])
+    if tolerance > 0:
+        ring = simplify_ring(points=ring, tolerance=tolerance)
+    return {'type': 'Feature',
+            'geometry': {'type': 'Polygon', 'coordinates': [[list(point) for point in ring]]},
+            'properties': {'ident': notam['ident'],
+                           'lat': notam['lat'],
+                           'lon': notam['lon'],
+                           'rad': notam['rad'],
+                           'center': [lon, lat],
+                           'radius_nm': radius,
+                           'tiers': [{'radius_nm': tier, 'altitude_ft': altitude}
+                                     for tier, altitude in notam_tiers(notam)]}}
+
+
+def simplify_ring(points, tolerance):
+    """
+    Simplify the closed ring `points`, a list of (x, y) tuples, using the
+    Ramer-Douglas-Peucker algorithm.  Always keeps at least four points so the
+    result is still a valid GeoJSON ring.
+
+    """
+    if len(points) <= 4:
+        return points
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        index, distance = farthest_point(points=points, first=first, last=last)
+        if index is not None and distance > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    simplified = [point for point, kept in zip(points, keep) if kept]
+    if len(simplified) < 4:
+        # a ring needs three distinct points; fall back to a coarse polygon
+        step = (len(points) - 1) // 3
+        simplified = [points[0], points[step], points[2 * step], points[-1]]
+    return simplified
+
+
+def farthest_point(points, first, last):
+    """
+    Return (index, distance) of the point strictly between indices `first` and
+    `last` farthest from the segment joining them, or (None, 0) if there are
+    no points between them.
+
+    """
+    x1, y1 = points[first]
+    x2, y2 = points[last]
+    dx = x2 - x1
+    dy = y2 - y1
+    length = math.hypot(dx, dy)
+    index = None
+    max_distance = 0.0
+    for ii in range(first + 1, last):
+        x, y = points[ii]
+        if length == 0:
+            distance = math.hypot(x - x1, y - y1)
+        else:
+            distance = abs(dy * x - dx * y + x2 * y1 - y2 * x1) / length
+        if index is None or distance > max_distance:
+            index = ii
+            max_distance = distance
+    return index, max_distance
+
+
+def compute_circle(lat, lon, radius_nautical_miles):
+    """
+    Returns a tuple containing an array of longitudes and latitudes defining
+    locations at the given radius around the location,
+    lon using the Haversine formula.
+
+    Based on https://stochasticcoder.com/2016/04/06/python-custom-distance-radius-with-basemap/
+    Adapted to use nautical miles instead of miles
+
+    """
+    lats, lons = compute_rings([lat], [lon], [radius_nautical_miles])
+    return list(lats[0]), list(lons[0])
+
+
+def compute_rings(latitudes, longitudes, radii, points=360):
+    """
+    Return (lats, lons), two (N, `points`) arrays with the locations at
+    evenly spaced bearings, starting north, around each of N centers at
+    `latitudes`, `longitudes` (decimal degrees) and `radii` (nautical miles).
+    Every ring is computed in one vectorized pass.
+
+    """
+    phi1 = np.radians(np.asarray(latitudes, dtype=float))[:, np.newaxis]
+    lam1 = np.radians(np.asarray(longitudes, dtype=float))[:, np.newaxis]
+    angle = (np.asarray(radii, dtype=float) / EARTH_RADIUS_NM)[:, np.newaxis]
+    bearing = np.radians(np.arange(points) * 360.0 / points)[np.newaxis, :]
+    phi2 = np.arcsin(np.sin(phi1) * np.cos(angle) + np.cos(phi1) * np.sin(angle) * np.cos(bearing))
+    lam2 = lam1 + np.arctan2(np.sin(bearing) * np.sin(angle) * np.cos(phi1),
+                             np.cos(angle) - np.sin(phi1) * np.sin(phi2))
+    return np.degrees(phi2), np.degrees(lam2)
+
+
+def coverage_grid(latitudes, longitudes, radii, resolution=COVERAGE_RESOLUTION):
+    """
+    Rasterize NOTAM disks onto a global lat/lon grid.  Return (count,
+    cell_lats, cell_lons) where count[i, j] is the number of NOTAMs whose
+    circle contains the center of the cell at cell_lats[i], cell_lons[j].
+
+    `latitudes` and `longitudes` are decimal degrees and `radii` are nautical
+    miles, one entry per NOTAM.
+
+    """
+    cell_lats = -MAX_LATITUDE + resolution * (np.arange(int(round(2 * MAX_LATITUDE / resolution))) + 0.5)
+    cell_lons = -MAX_LONGITUDE + resolution * (np.arange(int(round(2 * MAX_LONGITUDE / resolution))) + 0.5)
+    count = np.zeros((cell_lats.size, cell_lons.size), dtype=np.uint16)
+    lam = np.radians(cell_lons)[np.newaxis, :]
+    for lat, lon, radius in zip(latitudes, longitudes, radii):
+        angle = radius / EARTH_RADIUS_NM
+        # only rows within the circle's latitude band can be inside it
+        band = math.degrees(angle)
+        first, last = np.searchsorted(cell_lats, [lat - band, lat + band])
+        if first == last:
+            continue
+        phi0 = math.radians(lat)
+        phi = np.radians(cell_lats[first:last])[:, np.newaxis]
+        # haversine: inside when hav(distance) <= hav(angle)
+        hav = (np.sin((phi - phi0) / 2) ** 2 +
+               math.cos(phi0) * np.cos(phi) * np.sin((lam - math.radians(lon)) / 2) ** 2)
+        count[first:last] += hav <= math.sin(min(angle, math.pi) / 2) ** 2
+    return count, cell_lats, cell_lons
+
+
+def coverage_area(mask, cell_lats, resolution=COVERAGE_RESOLUTION):
+    """
+    Return the area in square nautical miles of the cells set in the boolean
+    grid `mask` with row center latitudes `cell_lats`.
+
+    """
+    south = np.radians(cell_lats - resolution / 2)
+    north = np.radians(cell_lats + resolution / 2)
+    row_cell_area = EARTH_RADIUS_NM ** 2 * math.radians(resolution) * (np.sin(north) - np.sin(south))
+    return float(np.dot(mask.sum(axis=1), row_cell_area))
+
+
+def save_coverage(filename, count, resolution=COVERAGE_RESOLUTION):
+    """
+    Save a coverage `count` grid to compressed NumPy FILE `filename` as the
+    overlap count (in the smallest unsigned type that fits) and a bit-packed
+    union mask.
+
+    """
+    dtype = np.uint8 if count.max(initial=0) <= np.iinfo(np.uint8).max else np.uint16
+    np.savez_compressed(filename,
+                        count=count.astype(dtype),
+                        union=np.packbits(count > 0),
+                        shape=np.array(count.shape),
+                        resolution=np.array(resolution))
+
+
+def build_index(notam_list, cell_size=INDEX_CELL_SIZE):
+    """
+    Return a spatial index over the validated `notam_list`.
+
+    The index is a dictionary with the 'notams', their decoded 'latitudes',
+    'longitudes', 'radii', and radius/altitude 'tiers' (see
+    `lib_notam_yaml.notam_tiers`), the 'cell_size' in degrees, and 'cells', which
+    maps each (row, column) lat/lon grid cell to the list of indices of the
+    NOTAMs whose circle may reach into that cell.
+
+    """
+    rows = int(round(2 * MAX_LATITUDE / cell_size))
+    columns = int(round(2 * MAX_LONGITUDE / cell_size))
+    index = {'notams': notam_list,
+             'latitudes': [validate_lat(lat=str(notam['lat']).upper()) for notam in notam_list],
+             'longitudes': [validate_lon(lon=str(notam['lon']).upper()) for notam in notam_list],
+             'radii': [validate_radius(r=str(notam['rad']).upper()) for notam in notam_list],
+             'tiers': [notam_tiers(notam) for notam in notam_list],
+             'cell_size': cell_size,
+             'cells': {}}
+    for ii, (lat, lon, tiers) in enumerate(zip(index['latitudes'], index['longitudes'], index['tiers'])):
+        radius = tier_radius(tiers)
+        angle = radius / EARTH_RADIUS_NM
+        band = math.degrees(angle)
+        first_row = max(0, int((lat - band + MAX_LATITUDE) // cell_size))
+        last_row = min(rows - 1, int((lat + band + MAX_LATITUDE) // cell_size))
+        # widest longitude reach of the circle; all longitudes near the poles
+        reach = math.sin(angle) / max(math.cos(math.radians(lat)), 1e-12)
+        if abs(lat) + band >= MAX_LATITUDE or reach >= 1.0:
+            column_range = range(columns)
+        else:
+            half_width = math.degrees(math.asin(reach))
+            first_column = int((lon - half_width + MAX_LONGITUDE) // cell_size)
+            last_column = int((lon + half_width + MAX_LONGITUDE) // cell_size)
+            column_range = [column % columns for column in range(first_column, last_column + 1)]
+        for row in range(first_row, last_row + 1):
+            for column in column_range:
+                index['cells'].setdefault((row, column), []).append(ii)
+    return index
+
+
+def query_point(index, lat, lon, altitude=None):
+    """
+    Return a list of (notam, distance_nm) tuples for every NOTAM in spatial
+    `index` whose circle contains the point `lat`, `lon` (decimal degrees).
+    If `altitude` (feet) is given, each NOTAM's radius at that altitude is
+    used instead of its largest radius.
+
+    """
+    cell_size = index['cell_size']
+    row = min(int((lat + MAX_LATITUDE) // cell_size), int(round(2 * MAX_LATITUDE / cell_size)) - 1)
+    column = int((lon + MAX_LONGITUDE) // cell_size) % int(round(2 * MAX_LONGITUDE / cell_size))
+    results = []
+    for ii in index['cells'].get((row, column), []):
+        distance = distance_nm(lat, lon, index['latitudes'][ii], index['longitudes'][ii])
+        if distance <= tier_radius(index['tiers'][ii], altitude):
+            results.append((index['notams'][ii], distance))
+    return results
+
+
+def route_intersections(index, waypoints, altitude=None):
+    """
+    Return the NOTAMs in spatial `index` whose circle intersects any leg of
+    the route `waypoints`, a list of (lat, lon) points in decimal degrees.
+    If `altitude` (feet) is given, each NOTAM's radius at that altitude is
+    used instead of its largest radius.
+
+    Each result is a dictionary with the 'notam', the list of zero based
+    'legs' it intersects, and the closest 'distance_nm' from its center to the
+    route.  Legs follow great circles.
+
+    """
+    if not index['notams'] or not waypoints:
+        return []
+    # only the NOTAMs indexed in the grid cells along the route can reach it
+    candidates = sorted({ii for cell in route_cells(index=index, waypoints=waypoints)
+                         for ii in index['cells'].get(cell, [])})
+    if not candidates:
+        return []
+    centers = unit_vectors([index['latitudes'][ii] for ii in candidates],
+                           [index['longitudes'][ii] for ii in candidates])  # (N, 3)
+    radii = np.array([tier_radius(index['tiers'][ii], altitude) for ii in candidates], dtype=float) / EARTH_RADIUS_NM
+    points = unit_vectors(*zip(*waypoints))
+    if len(points) == 1:
+        starts = ends = points  # a single waypoint is a zero length leg
+    else:
+        starts = points[:-1]
+        ends = points[1:]
+    # Prefilter: a circle can only reach a leg if its center is within
+    # radius + half the leg length of the leg's midpoint.
+    half_lengths = angle_between(starts, ends) / 2
+    midpoints = starts + ends
+    midpoints /= np.maximum(np.linalg.norm(midpoints, axis=1), 1e-15)[:, np.newaxis]
+    reachable = (angle_between(centers[:, np.newaxis, :], midpoints[np.newaxis, :, :]) <=
+                 radii[:, np.newaxis] + half_lengths[np.newaxis, :] + 1e-9)
+    rows, legs = np.nonzero(reachable)
+    if rows.size == 0:
+        return []
+    distances = segment_distance(centers[rows], starts[legs], ends[legs])
+    hits = distances <= radii[rows]
+    results = {}
+    for row, leg, distance in zip(rows[hits], legs[hits], distances[hits]):
+        row = candidates[row]
+        result = results.setdefault(row, {'notam': index['notams'][row], 'legs': [], 'distance_nm': None})
+        result['legs'].append(int(leg))
+        distance_nm = float(distance * EARTH_RADIUS_NM)
+        if result['distance_nm'] is None or distance_nm < result['distance_nm']:
+            result['distance_nm'] = distance_nm
+    return [results[row] for row in sorted(results)]
+
+
+def route_cells(index, waypoints):
+    """
+    Return the set of (row, column) cells of spatial `index` that the great
+    circle legs of route `waypoints` pass through, plus the cells around them.
+
+    Each leg is sampled every half cell, and the cells spanned by each pair of
+    consecutive samples are included with a margin of one cell, so that a
+    cell is never skipped near the poles, where its columns are narrow.
+
+    """
+    cell_size = index['cell_size']
+    rows = int(round(2 * MAX_LATITUDE / cell_size))
+    columns = int(round(2 * MAX_LONGITUDE / cell_size))
+    points = unit_vectors(*zip(*waypoints))
+    samples = [points[:1]]
+    for start, end in zip(points[:-1], points[1:]):
+        angle = float(angle_between(start, end))
+        if angle < 1e-12 or angle > math.pi - 1e-9:
+            samples.append(end[np.newaxis, :])  # no unique great circle, see `segment_distance`
+            continue
+        fractions = np.linspace(0.0, 1.0, int(math.ceil(math.degrees(angle) / (cell_size / 2))) + 1)[1:]
+        samples.append((np.sin((1 - fractions) * angle)[:, np.newaxis] * start +
+                        np.sin(fractions * angle)[:, np.newaxis] * end) / math.sin(angle))
+    samples = np.concatenate(samples)
+    latitudes = np.degrees(np.arcsin(np.clip(samples[:, 2], -1.0, 1.0)))
+    longitudes = np.degrees(np.arctan2(samples[:, 1], samples[:, 0]))
+    sample_rows = np.clip(((latitudes + MAX_LATITUDE) // cell_size).astype(int), 0, rows - 1)
+    sample_columns = ((longitudes + MAX_LONGITUDE) // cell_size).astype(int) % columns
+    cells = set()
+    previous = (sample_rows[0], sample_columns[0])
+    for row, column in zip(sample_rows, sample_columns):
+        # columns between the samples, going the short way around
+        step = (column - previous[1] + columns // 2) % columns - columns // 2
+        for cell_row in range(max(0, min(row, previous[0]) - 1), min(rows - 1, max(row, previous[0]) + 1) + 1):
+            for offset in range(min(0, step) - 1, max(0, step) + 2):
+                cells.add((cell_row, (previous[1] + offset) % columns))
+        previous = (row, column)
+    return cells
+
+
+def segment_distance(points, starts, ends):
+    """
+    Return the angular distance in radians from each unit vector in `points`
+    to the great circle segment from `starts` to `ends` (matching arrays of
+    unit vectors), using the cross track distance where the closest point of
+    the great circle lies on the segment, and the nearer endpoint otherwise.
+
+    """
+    normals = np.cross(starts, ends)
+    norms = np.linalg.norm(normals, axis=1)
+    degenerate = norms < 1e-12
+    normals = normals / np.where(degenerate, 1.0, norms)[:, np.newaxis]
+    sin_cross_track = np.einsum('ij,ij->i', points, normals)
+    cross_track = np.abs(np.arcsin(np.clip(sin_cross_track, -1.0, 1.0)))
+    # the point's projection onto the great circle lies between the endpoints
+    # when it is on the inner side of both endpoints
+    projected = points - sin_cross_track[:, np.newaxis] * normals
+    within = ((np.einsum('ij,ij->i', np.cross(starts, projected), normals) >= 0) &
+              (np.einsum('ij,ij->i', np.cross(projected, ends), normals) >= 0) &
+              ~degenerate)
+    endpoint = np.minimum(angle_between(points, starts), angle_between(points, ends))
+    return np.where(within, cross_track, endpoint)
+
+
+def unit_vectors(latitudes, longitudes):
+    """
+    Return an (N, 3) array of unit vectors for points in decimal degrees.
+
+    """
+    phi = np.radians(np.asarray(latitudes, dtype=float))
+    lam = np.radians(np.asarray(longitudes, dtype=float))
+    return np.stack([np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)], axis=-1)
+
+
+def angle_between(a, b):
+    """
+    Return the angle in radians between unit vectors `a` and `b` along their
+    last axis.  Uses atan2 to stay accurate for small and large angles.
+
+    """
+    return np.arctan2(np.linalg.norm(np.cross(a, b), axis=-1), np.sum(a * b, axis=-1))
+
+
+def decode_point(lat, lon):
+    """
+    Return the (lat, lon) point in decimal degrees for `lat` and `lon` given
+    either as decimal degrees or in NOTAM DDMMSS[N|S] and [D]DDMMSS[E|W]
+    format, or None if either is invalid.
+
+    """
+    point = []
+    for value, validate, max_degrees in [(lat, validate_lat, MAX_LATITUDE),
+                                         (lon, validate_lon, MAX_LONGITUDE)]:
+        try:
+            degrees = float(value)
+        except (TypeError, ValueError):
+            degrees = validate(str(value).upper())
+        if degrees is None or not math.isfinite(degrees) or abs(degrees) > max_degrees:
+            return
+        point.append(degrees)
+    return tuple(point)
+
+
+def distance_nm(lat1, lon1, lat2, lon2):
+    """
+    Return the great circle distance in nautical miles between two points
+    given in decimal degrees, using the Haversine formula.
+
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    hav = (math.sin((phi2 - phi1) / 2) ** 2 +
+           math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_NM * math.asin(min(1.0, math.sqrt(hav)))
@@ -0,0 +1,183 @@
+"""
+NOTAM History
+=============
+This library keeps a columnar cache of every NOTAM in the day files, already
+decoded, so that analyses across months or years do not parse YAML or DDMMSS
+strings again.
+
+The cache is a directory of NumPy .npy files, one per column, with one row per
+NOTAM sorted by day:
+
+    day.npy           datetime64[D] UTC day
+    lat.npy           float64 decimal degrees latitude
+    lon.npy           float64 decimal degrees longitude
+    rad.npy           int32 radius in nautical miles
+    ident_offset.npy  int64 start of each row's ident in idents.npy, plus one
+                      final entry for the end of the last ident
+    idents.npy        uint8 UTF-8 encoded idents, back to back
+
+`load_history` memory maps the columns, so loading is instant and processes
+that load the same cache share its pages.
+
+Each build is written to its own directory, `history_dir` followed by a
+version number, and `history_dir` is a symbolic link to the latest one that
+is replaced atomically.  The previous build is kept until the next one, so
+readers that resolved the link just before a swap can still open it.
+
+Usage:
+    lib_notam_history.py -h
+    lib_notam_history.py [--datadir DIR] [--outdir DIR]
+
+Options:
+  -h --help           Show this screen.
+  --datadir DIR       Read day files from directory DIR instead of the default
+                      data directory.
+  --outdir DIR        Write the cache to directory DIR instead of the default
+                      static_notams/data/history.
+
+"""
+# Standard Imports
+from docopt import docopt
+import glob
+import numpy as np
+import os
+import shutil
+import time
+
+
+# Custom Imports
+from lib_notam_yaml import (day_file, import_notams, list_days, normalize_notam, validate_lat, validate_lon,
+                            validate_radius)
+
+
+# Constants
+COLUMNS = ['day', 'lat', 'lon', 'rad', 'ident_offset', 'idents']
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'static_notams', 'data')
+HISTORY_DIR = os.path.join(DATA_DIR, 'history')
+KEEP_VERSIONS = 2  # the current build and the one before it
+
+
+# Functions
+def main(options):
+    """
+    Rebuild the history cache from every day file.
+
+    """
+    print("Building NOTAM history from %s ..." % options['--datadir'])
+    history = build_history(data_dir=options['--datadir'], history_dir=options['--outdir'])
+    print("Saved %d NOTAMs from %d days to %s" % (len(history['day']), len(np.unique(history['day'])),
+                                                  options['--outdir']))
+    return
+
+
+def build_history(data_dir=DATA_DIR, history_dir=HISTORY_DIR):
+    """
+    Decode the NOTAMs of every day file, loose or archived, in directory
+    `data_dir` and save them as the columnar cache `history_dir`.  Return
+    the loaded cache (see `load_history`).
+
+    The new cache is written to a new version directory and swapped in, so
+    readers never see a partial cache.  Raises IOError if `history_dir` is
+    not a cache, rather than replace whatever is there.
+
+    """
+    history_dir = history_dir.rstrip(os.sep)
+    if os.path.lexists(history_dir) and not os.path.islink(history_dir):
+        raise IOError('ERROR: %s exists and is not a history cache link' % history_dir)
+    days, latitudes, longitudes, radii, idents = [], [], [], [], []
+    for day in list_days(data_dir=data_dir):
+        for notam in import_notams(yaml_file=day_file(data_dir=data_dir, day=day)):
+            notam = normalize_notam(notam)
+            days.append(day)
+            latitudes.append(validate_lat(notam['lat']))
+            longitudes.append(validate_lon(notam['lon']))
+            radii.append(validate_radius(notam['rad']))
+            idents.append(notam['ident'].encode('utf-8'))
+    ident_offset = np.zeros(len(idents) + 1, dtype=np.int64)
+    ident_offset[1:] = np.cumsum([len(ident) for ident in idents])
+    columns = {'day': np.array(days, dtype='datetime64[D]'),
+               'lat': np.array(latitudes, dtype=np.float64),
+               'lon': np.array(longitudes, dtype=np.float64),
+               'rad': np.array(radii, dtype=np.int32),
+               'ident_offset': ident_offset,
+               'idents': np.frombuffer(b''.join(idents), dtype=np.uint8)}
+
+    version_dir = '%s.%d' % (history_dir, time.time_ns())
+    os.makedirs(version_dir)
+    for name in COLUMNS:
+        np.save(os.path.join(version_dir, name + '.npy'), columns[name])
+    link = history_dir + '.link'
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(version_dir), link)
+    os.replace(link, history_dir)
+    for old_dir in history_versions(history_dir=history_dir)[:-KEEP_VERSIONS]:
+        shutil.rmtree(old_dir, ignore_errors=True)  # open memory maps stay valid
+    return load_history(history_dir=history_dir)
+
+
+def history_versions(history_dir=HISTORY_DIR):
+    """
+    Return the version directories of the cache `history_dir`, oldest first.
+
+    """
+    versions = [name for name in glob.glob(history_dir + '.[0-9]*') if name.rsplit('.', 1)[1].isdigit()]
+    return sorted(versions, key=lambda name: int(name.rsplit('.', 1)[1]))
+
+
+def load_history(history_dir=HISTORY_DIR):
+    """
+    Return a dictionary of read-only memory mapped columns (see COLUMNS) of
+    the cache in `history_dir`, or None if it has not been built.
+
+    """
+    version_dir = os.path.realpath(history_dir)  # every column from the same build
+    if not os.path.exists(os.path.join(version_dir, 'day.npy')):
+        return
+    return {name: np.load(os.path.join(version_dir, name + '.npy'), mmap_mode='r') for name in COLUMNS}
+
+
+def build_time(history):
+    """
+    Return when the build of the loaded `history` started, in nanoseconds
+    since the epoch, or None if it was not built as a version directory.  Day
+    files modified since then may not be in it.
+
+    """
+    suffix = os.path.dirname(history['day'].filename).rsplit('.', 1)[-1]
+    if not suffix.isdigit():
+        return
+    return int(suffix)
+
+
+def day_rows(history, start, end):
+    """
+    Return the slice of `history` rows from ISO formatted day `start` through
+    `end`, inclusive.
+
+    """
+    first = np.searchsorted(history['day'], np.datetime64(start, 'D'), side='left')
+    last = np.searchsorted(history['day'], np.datetime64(end, 'D'), side='right')
+    return slice(int(first), int(last))
+
+
+def ident(history, row):
+    """
+    Return the ident of `history` row `row`.
+
+    """
+    start, stop = history['ident_offset'][row], history['ident_offset'][row + 1]
+    return bytes(history['idents'][start:stop]).decode('utf-8')
+
+
+def build_options():
+    options = docopt(__doc__)
+    if not options['--datadir']:
+        options['--datadir'] = DATA_DIR
+    if not options['--outdir']:
+        options['--outdir'] = HISTORY_DIR
+    return options
+
+
+if __name__ == '__main__':
+    main(options=build_options())
@@ -0,0 +1,255 @@
+"""
+NOTAM Metrics
+=============
+This library records stage timings, request latencies, and cache hit counts,
+and formats them for Prometheus.
+
+Each process keeps its own metrics in memory.  Processes other than the web
+app (the retriever, the render worker, and the plot CLI) save a snapshot with
+`save_snapshot`, and the app merges the snapshots into its own metrics when
+they are scraped, labelled with the process they came from.
+
+Typical use:
+
+    with lib_notam_metrics.timed('yaml_load'):
+        raw_notams = yaml.safe_load(fd)
+
+"""
+# Standard Imports
+from contextlib import contextmanager
+import cProfile
+import datetime
+import glob
+import io
+import json
+import math
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+
+
+# Constants
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0]
+METRICS_DIR = os.path.join(os.path.dirname(__file__), 'metrics')  # outside static_notams, which nginx serves
+METRIC_HELP = {
+    'notams_cache_requests_total': ('counter', 'Cache lookups by cache and result (hit or miss).'),
+    'notams_request_seconds': ('histogram', 'Web request latency by endpoint.'),
+    'notams_stage_seconds': ('histogram', 'Time spent in each processing stage.'),
+}
+PROFILE_TOP_FUNCTIONS = 30
+SNAPSHOT_FILE = '{process}_metrics.json'
+
+
+# Setup
+histograms = {}  # (name, labels) -> {'buckets': [counts], 'sum': seconds, 'count': n}
+counters = {}  # (name, labels) -> count
+lock = threading.Lock()
+stage_log = None  # list of (stage, seconds, peak RSS bytes) while profiling
+
+
+# Functions
+@contextmanager
+def timed(stage):
+    """
+    Record the time spent in the `with` block as `stage` in the
+    notams_stage_seconds histogram.
+
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        observe('notams_stage_seconds', seconds, stage=stage)
+        if stage_log is not None:
+            stage_log.append((stage, seconds, peak_rss()))
+
+
+@contextmanager
+def profiled(process, directory=None):
+    """
+    Profile the `with` block with cProfile and save the stats dump, plus a
+    report of the time and peak memory of each stage, to `directory`.  Do
+    nothing if `directory` is None.
+
+    """
+    global stage_log
+    if directory is None:
+        yield
+        return
+    os.makedirs(directory, exist_ok=True)
+    prefix = os.path.join(directory, '%s_%s' % (process, datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S')))
+    stage_log = []
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        seconds = time.perf_counter() - start
+        profiler.dump_stats(prefix + '.prof')
+        with open(prefix + '_report.txt', 'w') as fd:
+            fd.write(profile_report(process=process, seconds=seconds, stages=stage_log, profiler=profiler))
+        stage_log = None
+        print("Saved profile to %s.prof and %s_report.txt" % (prefix, prefix))
+
+
+def profile_report(process, seconds, stages, profiler):
+    """
+    Return a readable report of the `seconds` a `process` run took, its
+    `stages` (see `stage_log`), and the slowest functions in `profiler`.
+
+    """
+    totals = {}  # stage -> [calls, seconds, longest call, peak RSS]
+    for stage, stage_seconds, rss in stages:
+        total = totals.setdefault(stage, [0, 0.0, 0.0, 0])
+        total[0] += 1
+        total[1] += stage_seconds
+        total[2] = max(total[2], stage_seconds)
+        total[3] = max(total[3], rss)
+    lines = ['%s profile' % process,
+             'total: %.3f s, peak RSS %.1f MiB' % (seconds, peak_rss() / 2 ** 20),
+             '',
+             '%-12s %6s %10s %10s %10s %14s' % ('stage', 'calls', 'total s', 'mean s', 'max s', 'peak RSS MiB')]
+    for stage, (calls, stage_seconds, longest, rss) in sorted(totals.items(), key=lambda item: -item[1][1]):
+        lines.append('%-12s %6d %10.3f %10.3f %10.3f %14.1f' % (stage, calls, stage_seconds, stage_seconds / calls,
+                                                                longest, rss / 2 ** 20))
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+    lines.extend(['', stream.getvalue()])
+    return '\n'.join(lines)
+
+
+def peak_rss():
+    """
+    Return the peak resident set size of this process so far, in bytes.
+
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Linux reports KiB
+
+
+def observe(name, seconds, **labels):
+    """
+    Add an observation of `seconds` to histogram `name` with `labels`.
+
+    """
+    key = (name, tuple(sorted(labels.items())))
+    with lock:
+        histogram = histograms.setdefault(key, {'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0})
+        for ii, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram['buckets'][ii] += 1
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+
+
+def count_cache(cache, hit):
+    """
+    Count one lookup in `cache`, as a hit if `hit` is true or else a miss.
+
+    """
+    increment('notams_cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+
+def increment(name, amount=1, **labels):
+    """
+    Add `amount` to counter `name` with `labels`.
+
+    """
+    key = (name, tuple(sorted(labels.items())))
+    with lock:
+        counters[key] = counters.get(key, 0) + amount
+
+
+def snapshot():
+    """
+    Return this process's metrics as a JSON serializable dictionary.
+
+    """
+    with lock:
+        return {'histograms': [[name, labels, dict(value, buckets=list(value['buckets']))]
+                               for (name, labels), value in histograms.items()],
+                'counters': [[name, labels, value] for (name, labels), value in counters.items()]}
+
+
+def save_snapshot(process, metrics_dir=METRICS_DIR):
+    """
+    Save this process's metrics for the web app to report under `process`.
+
+    """
+    os.makedirs(metrics_dir, exist_ok=True)
+    filename = os.path.join(metrics_dir, SNAPSHOT_FILE.format(process=process))
+    with open(filename + '.tmp', 'w') as fd:
+        json.dump(snapshot(), fd)
+    os.replace(filename + '.tmp', filename)  # never expose a partial snapshot
+
+
+def load_snapshots(metrics_dir=METRICS_DIR):
+    """
+    Return a dictionary of the saved snapshots by process name.
+
+    """
+    snapshots = {}
+    suffix = SNAPSHOT_FILE.format(process='')
+    for filename in sorted(glob.glob(os.path.join(metrics_dir, SNAPSHOT_FILE.format(process='*')))):
+        try:
+            with open(filename) as fd:
+                snapshots[os.path.basename(filename)[:-len(suffix)]] = json.load(fd)
+        except (OSError, ValueError) as err:
+            print("Skipping metrics snapshot", filename, repr(err))
+    return snapshots
+
+
+def exposition(process='app', metrics_dir=METRICS_DIR):
+    """
+    Return the metrics of this process, labelled `process`, and of the saved
+    snapshots in the Prometheus text exposition format.
+
+    """
+    samples = {}  # metric name -> list of lines
+    snapshots = load_snapshots(metrics_dir=metrics_dir)
+    snapshots[process] = snapshot()
+    for process_name, metrics in sorted(snapshots.items()):
+        for name, labels, histogram in metrics['histograms']:
+            labels = [['process', process_name]] + [list(label) for label in labels]
+            lines = samples.setdefault(name, [])
+            for bound, bucket_count in zip(BUCKETS, histogram['buckets']):
+                lines.append('%s_bucket%s %d' % (name, format_labels(labels + [['le', repr(bound)]]), bucket_count))
+            lines.append('%s_bucket%s %d' % (name, format_labels(labels + [['le', '+Inf']]), histogram['count']))
+            lines.append('%s_sum%s %s' % (name, format_labels(labels), format_value(histogram['sum'])))
+            lines.append('%s_count%s %d' % (name, format_labels(labels), histogram['count']))
+        for name, labels, value in metrics['counters']:
+            labels = [['process', process_name]] + [list(label) for label in labels]
+            samples.setdefault(name, []).append('%s%s %d' % (name, format_labels(labels), value))
+    output = []
+    for name, lines in sorted(samples.items()):
+        metric_type, text = METRIC_HELP.get(name, ('untyped', name))
+        output.append('# HELP %s %s' % (name, text))
+        output.append('# TYPE %s %s' % (name, metric_type))
+        output.extend(lines)
+    return '\n'.join(output) + '\n'
+
+
+def format_labels(labels):
+    """
+    Return the list of [name, value] `labels` formatted as {name="value",...}.
+
+    """
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in labels]
+    return '{%s}' % ','.join('%s="%s"' % label for label in escaped)
+
+
+def format_value(value):
+    """
+    Return the sample `value` formatted for the exposition format.
+
+    """
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
@@ -4,18 +4,54 @@ NOTAM YAML Library
 This library contains the logic to extract GPS NOTAMs from a yaml dump file,
 validating a notam, and write notams to a yaml dump file.
 
+Day files of past months may be compacted into one zip archive per month (see
+compact_notams.py).  A day file that is not on disk is read from its month's
+archive instead, and a day file on disk always takes precedence over the
+archived copy.
+
+Every change to a day file reads, changes and writes it back while holding
+the day file's lock (see `locked_day_file`), so edits from the web app's
+threads and from the retriever never lose one another's changes.  Day files
+are replaced in one step, so readers never see a partly written file.
+
 """
 # Standard Imports
+import base64
+import contextlib
+import datetime
+import fcntl
+import glob
+import hashlib
 import math
+import os
 import re
+import threading
 import yaml
+import zipfile
+
+
+# Custom Imports
+import lib_notam_metrics
 
 
 # Constants
+ARCHIVE_FILE = '{month}_notams.zip'
+DAY_FILE_RE = re.compile(r'^(?P<month>[0-9]{4}-[0-9]{2})-[0-9]{2}_notams\.yaml$')
+DAY_LOCK_SUFFIX = '.lock'
+DEFAULT_MAP_TYPE = 'shaded'
+INVALID_BBOX = "ERROR: bbox must be west,south,east,north in decimal degrees, not {bbox}."
+INVALID_CURSOR = "ERROR: invalid cursor {cursor}."
+INVALID_DAY = "ERROR: invalid day {day}, expected YYYY-MM-DD."
 INVALID_IDENT = "ERROR: {i_th} notam has invalid ident {ident}."
 INVALID_LATITUDE = "ERROR: {i_th} notam has invalid latitude {latitude}."
 INVALID_LONGITUDE = "ERROR: {i_th} notam has invalid longitude {longitude}."
+INVALID_NOTAM = "ERROR: invalid notam {notam}."
+INVALID_OPERATION = "ERROR: invalid operation {operation}."
 INVALID_RADIUS = "ERROR: {i_th} notam has invalid radius {radius}."
+INVALID_TIERS = "ERROR: {i_th} notam has invalid tiers {tiers}."
+# Altitude floor of a tier: a flight level or feet, optionally followed by a
+# ceiling (e.g. FL400-UNL), which is ignored.
+IS_ALTITUDE = re.compile("^(FL(?P<flight_level>[0-9]{2,3})|(?P<feet>[0-9]{1,6}) ?FT( ?(AGL|MSL))?)(-.*)?$")
 IS_IDENT = re.compile("^.{1,20}$")
 # IS_LAT Regular expression explaination:
 # Direction {N, S} ------------------------------------------------------------------\
@@ -38,44 +74,78 @@ IS_LAT = re.compile("^(?P<degrees>[0-9]{2})(?P<minutes>[0-9]{2})(?P<seconds>[0-9
 #                     v                      v                    v                    v
 IS_LON = re.compile("^(?P<degrees>[0-9]{2,3})(?P<minutes>[0-9]{2})(?P<seconds>[0-9]{2})(?P<direction>[EW])$")
 IS_RADIUS = re.compile("^(?P<radius>\d+)(NM)?$")
+MAP_TYPES = ['basic', 'etopo', 'marble', 'shaded']
 MAX_LATITUDE = 90.0
 MAX_LONGITUDE = 180.0
+MAX_QUERY_DAYS = 366
+MAX_QUERY_LIMIT = 5000
 MINUTES_IN_ONE_DEGREE = 60
+MISSING_OPERATION_KEY = "ERROR: operation missing required key(s) {key}."
 MISSING_REQUIRED_KEY = "ERROR: {i_th} notam missing required key {key}."
 NOTAM_KEYS = ['ident', 'lat', 'lon', 'rad']
+NOTAM_NOT_FOUND = "ERROR: notam not found on {day}."
+OPERATION_KEYS = {'add': NOTAM_KEYS,
+                  'del': NOTAM_KEYS,
+                  'upd': ['orig_' + key for key in NOTAM_KEYS] + NOTAM_KEYS}
+QUERY_LIMIT = 500
 SECONDS_IN_ONE_DEGREE = 3600
 
 
 # Functions
-def add_notam(yaml_file, ident, lat, lon, rad):
+def add_notam(yaml_file, ident, lat, lon, rad, tiers=None):
     """
-    Add a notam to a YAML dump file.
+    Add a notam to a YAML dump file.  `tiers` is an optional list of
+    radius/altitude dictionaries (see `validate_tiers`).
 
     """
     new_notam = {'ident': ident, 'lat': lat, 'lon': lon, 'rad': rad}
-    notam_list = import_notams(yaml_file=yaml_file)
-
-    # only add unique notams
-    if is_unique(notam=new_notam, notam_list=notam_list):
-        notam_list.append(new_notam)
-        success = export_notams(yaml_file=yaml_file, notam_list=notam_list)
-    else:
-        success = True
+    if tiers:
+        new_notam['tiers'] = tiers
+    with locked_day_file(yaml_file=yaml_file):
+        notam_list = import_notams(yaml_file=yaml_file)
+
+        # only add unique notams
+        if insert_notam(notam=new_notam, notam_list=notam_list):
+            success = export_notams(yaml_file=yaml_file, notam_list=notam_list)
+        else:
+            success = True
     return success
 
 
+def insert_notam(notam, notam_list):
+    """
+    Add `notam` to `notam_list` unless it is already there, and return True
+    if the list changed.
+
+    A notam stored without tiers, as retrievers did before tiers were kept,
+    is the same notam as one with the same ident, lat, lon, and rad that has
+    tiers: adding the tiered notam replaces it, and adding the notam without
+    tiers when the tiered one is stored changes nothing.
+
+    """
+    if not is_unique(notam=notam, notam_list=notam_list):
+        return False
+    match = {key: notam[key] for key in NOTAM_KEYS}
+    if notam.get('tiers'):
+        position = find_notam(notam_list=notam_list, tiers=[], **match)
+        if position is not None:
+            notam_list[position] = notam
+            return True
+    elif find_notam(notam_list=notam_list, **match) is not None:
+        return False
+    notam_list.append(notam)
+    return True
+
+
 def is_unique(notam, notam_list):
     """
-    Determine if a notam is unique, or already exists in notam_list.
+    Determine if a notam is unique, or already exists in notam_list with the
+    same tiers.
 
     """
     unique = True
     for notam_from_list in notam_list:
-        same = True
-        for key in NOTAM_KEYS:
-            if notam[key] != notam_from_list[key]:
-                same = False
-        if same:
+        if notam_key(notam) == notam_key(notam_from_list):
             unique = False
             break
     return unique
@@ -87,58 +157,250 @@ def delete_notam(yaml_file, ident, lat, lon, rad):
 
     """
     success = False
-    notam_list = import_notams(yaml_file=yaml_file)
-    for ii, notam in enumerate(notam_list):
-        if (notam['ident'] == ident and
-                notam['lat'] == lat and
-                notam['lon'] == lon and
-                notam['rad'] == rad):
-            success = True
-            break
-    if success:
-        notam_list.pop(ii)
-        success = success and export_notams(yaml_file=yaml_file, notam_list=notam_list)
+    with locked_day_file(yaml_file=yaml_file):
+        notam_list = import_notams(yaml_file=yaml_file)
+        ii = find_notam(notam_list=notam_list, ident=ident, lat=lat, lon=lon, rad=rad)
+        if ii is not None:
+            notam_list.pop(ii)
+            success = export_notams(yaml_file=yaml_file, notam_list=notam_list)
     return success
 
 
-def modify_notam(yaml_file, orig_ident, orig_lat, orig_lon, orig_rad, ident, lat, lon, rad):
+def modify_notam(yaml_file, orig_ident, orig_lat, orig_lon, orig_rad, ident, lat, lon, rad, tiers=None):
     """
-    Modify a notam in a YAML dump file.
+    Modify a notam in a YAML dump file.  `tiers` optionally replaces its
+    radius/altitude tiers (see `edit_notam`).
 
     """
     success = False
-    notam_list = import_notams(yaml_file=yaml_file)
-    for ii, notam in enumerate(notam_list):
-        if (notam['ident'] == orig_ident and
-                notam['lat'] == orig_lat and
-                notam['lon'] == orig_lon and
-                notam['rad'] == orig_rad):
-            success = True
-            notam['ident'] = ident
-            notam['lat'] = lat
-            notam['lon'] = lon
-            notam['rad'] = rad
-            break
-    if success:
-        success = success and export_notams(yaml_file=yaml_file, notam_list=notam_list)
+    new_notam = {'ident': ident, 'lat': lat, 'lon': lon, 'rad': rad}
+    if tiers:
+        new_notam['tiers'] = tiers
+    with locked_day_file(yaml_file=yaml_file):
+        notam_list = import_notams(yaml_file=yaml_file)
+        ii = find_notam(notam_list=notam_list, ident=orig_ident, lat=orig_lat, lon=orig_lon, rad=orig_rad)
+        if ii is not None:
+            notam_list[ii] = edit_notam(notam=notam_list[ii], new_notam=new_notam)
+            success = export_notams(yaml_file=yaml_file, notam_list=notam_list)
     return success
 
 
+def edit_notam(notam, new_notam):
+    """
+    Return a copy of `notam` with the ident, lat, lon, and rad of
+    `new_notam`, and its tiers if it has any.  Otherwise the old tiers are
+    kept, unless the radius changed: they would still be plotted and queried
+    in place of the new radius.
+
+    """
+    edited = dict(notam, **{key: new_notam[key] for key in NOTAM_KEYS})
+    if new_notam.get('tiers'):
+        edited['tiers'] = new_notam['tiers']
+    elif validate_radius(r=str(new_notam['rad']).upper()) != validate_radius(r=str(notam['rad']).upper()):
+        edited.pop('tiers', None)
+    return edited
+
+
+def find_notam(notam_list, ident, lat, lon, rad, tiers=None):
+    """
+    Return the index of the first notam in `notam_list` matching `ident`,
+    `lat`, `lon`, and `rad`, or None if there is none.  If `tiers` is given
+    the notam's tiers must match too, and [] matches only a notam without
+    tiers.
+
+    """
+    match = notam_key({'ident': ident, 'lat': lat, 'lon': lon, 'rad': rad, 'tiers': tiers or []})
+    for ii, notam in enumerate(notam_list):
+        key = notam_key(notam)
+        if key == match or (tiers is None and key[:-1] == match[:-1]):
+            return ii
+
+
+def notam_key(notam):
+    """
+    Return the normalized ident, lat, lon, and rad of `notam`, and its
+    validated tiers, as a tuple, so that equal notams compare equal however
+    their values were typed.
+
+    """
+    normalized = normalize_notam(notam)
+    tiers = validate_tiers(tiers=normalized['tiers']) if 'tiers' in normalized else None
+    return tuple(normalized[key] for key in NOTAM_KEYS) + (tuple(tiers or []),)
+
+
+def normalize_notam(notam):
+    """
+    Return a copy of the previously validated `notam` with its values as the
+    strings that are stored: the ident as is, and lat, lon, rad, and any
+    tiers in upper case.
+
+    """
+    normalized = {'ident': str(notam['ident']),
+                  'lat': str(notam['lat']).upper(),
+                  'lon': str(notam['lon']).upper(),
+                  'rad': str(notam['rad']).upper()}
+    if notam.get('tiers'):
+        normalized['tiers'] = [{'rad': str(tier['rad']).upper(), 'alt': str(tier['alt']).upper()}
+                               for tier in notam['tiers']]
+    return normalized
+
+
+def apply_operations(data_dir, operations):
+    """
+    Apply a batch of `operations` to the day files in directory `data_dir`.
+    Each day file is read once and written at most once, however many
+    operations touch it.  Return (results, changed_days), where results has
+    one {'success': bool, 'error': message or None} dictionary per operation,
+    in order, and changed_days is the sorted list of days whose file was
+    written.
+
+    Each operation is a dictionary with an 'op' and a 'day' (YYYY-MM-DD), and:
+        'add' - 'ident', 'lat', 'lon', 'rad', and optional 'tiers' of the
+                notam to add (see `insert_notam`)
+        'del' - 'ident', 'lat', 'lon', 'rad', and optional 'tiers' of the
+                notam to delete
+        'upd' - 'orig_ident', 'orig_lat', 'orig_lon', 'orig_rad', and
+                optional 'orig_tiers' of the notam to modify, and its new
+                'ident', 'lat', 'lon', 'rad', and optional 'tiers' (see
+                `edit_notam`)
+
+    Without tiers to match, 'del' and 'upd' apply to the first notam that
+    matches the other keys, whatever its tiers.
+
+    """
+    results = [{'success': False, 'error': None} for _ in operations]
+    by_day = {}
+    for ii, operation in enumerate(operations):
+        error = check_operation(operation)
+        if error:
+            results[ii]['error'] = error
+            continue
+        by_day.setdefault(normalize_day(operation['day']), []).append(ii)
+
+    changed_days = []
+    for day, indices in sorted(by_day.items()):
+        yaml_file = day_file(data_dir=data_dir, day=day)
+        with locked_day_file(yaml_file=yaml_file):
+            notam_list = import_notams(yaml_file=yaml_file)
+            changed = False
+            for ii in indices:
+                operation = operations[ii]
+                if operation['op'] != 'del':
+                    notam = normalize_notam(operation_notam(operation))
+                if operation['op'] == 'add':
+                    success = True  # adding an existing notam is a no-op
+                    if insert_notam(notam=notam, notam_list=notam_list):
+                        changed = True
+                else:
+                    prefix = 'orig_' if operation['op'] == 'upd' else ''
+                    match = {key: operation[prefix + key] for key in NOTAM_KEYS}
+                    position = find_notam(notam_list=notam_list, tiers=operation.get(prefix + 'tiers'), **match)
+                    success = position is not None
+                    if not success:
+                        results[ii]['error'] = NOTAM_NOT_FOUND.format(day=day)
+                    elif operation['op'] == 'del':
+                        notam_list.pop(position)
+                        changed = True
+                    else:
+                        notam_list[position] = edit_notam(notam=notam_list[position], new_notam=notam)
+                        changed = True
+                results[ii]['success'] = success
+            if changed:
+                export_notams(yaml_file=yaml_file, notam_list=notam_list)
+                changed_days.append(day)
+    return results, changed_days
+
+
+def check_operation(operation):
+    """
+    Return an error message if batch `operation` (see `apply_operations`) is
+    malformed or would store an invalid notam, or None if it is valid.
+
+    """
+    if not isinstance(operation, dict) or operation.get('op') not in OPERATION_KEYS:
+        return INVALID_OPERATION.format(operation=operation)
+    missing = [key for key in ['day'] + OPERATION_KEYS[operation['op']] if key not in operation]
+    if missing:
+        return MISSING_OPERATION_KEY.format(key=', '.join(missing))
+    if normalize_day(operation['day']) is None:
+        return INVALID_DAY.format(day=operation['day'])
+    if operation['op'] != 'del':
+        notam = operation_notam(operation)
+        if not validate_notams(raw_notams=[notam]):
+            return INVALID_NOTAM.format(notam=notam)
+    match_tiers = operation.get('orig_tiers' if operation['op'] == 'upd' else 'tiers')
+    if operation['op'] != 'add' and match_tiers and validate_tiers(tiers=match_tiers) is None:
+        return INVALID_NOTAM.format(notam=operation)
+
+
+def operation_notam(operation):
+    """
+    Return the new notam of batch `operation`, with its optional 'tiers'.
+
+    """
+    notam = {key: operation[key] for key in NOTAM_KEYS}
+    if operation.get('tiers'):
+        notam['tiers'] = operation['tiers']
+    return notam
+
+
+def normalize_day(day):
+    """
+    Return `day` formatted as YYYY-MM-DD, so that e.g. 2024-1-5 names the
+    same day file as 2024-01-05, or None if it is not a valid day.
+
+    """
+    try:
+        return datetime.datetime.strptime(str(day), '%Y-%m-%d').date().isoformat()
+    except ValueError:
+        return
+
+
+def day_file(data_dir, day):
+    """
+    Return the name of the YAML dump file for `day` in directory `data_dir`.
+
+    """
+    return os.path.join(data_dir, '_'.join([day, 'notams.yaml']))
+
+
 def export_notams(yaml_file, notam_list):
     """
-    Export the `notam_list` to FILE `yaml_file` as a YAML dump.
+    Export the `notam_list` to FILE `yaml_file` as a YAML dump.  The dump is
+    written to a temporary file next to `yaml_file` and moved over it, so
+    readers see either the old or the new file, never a partial one.
+    Callers changing an existing day file should hold its lock (see
+    `locked_day_file`).
 
     """
-    success = False
-    notams_yaml = yaml.dump(notam_list)
-    # TODO: Add try/except here?
-    # try:
-    fdout = open(yaml_file, 'w')
-    print(notams_yaml, file=fdout)
-    success = True
-    # except PermissionError:
-    # pass???  or raise error???
-    return success
+    with lib_notam_metrics.timed('yaml_dump'):
+        notams_yaml = yaml.dump(notam_list)
+    partial_file = '%s.%d.%d.tmp' % (yaml_file, os.getpid(), threading.get_ident())
+    try:
+        with open(partial_file, 'w') as fdout:
+            print(notams_yaml, file=fdout)
+        os.replace(partial_file, yaml_file)
+    except BaseException:
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+        raise
+    return True
+
+
+@contextlib.contextmanager
+def locked_day_file(yaml_file):
+    """
+    Hold the lock of day FILE `yaml_file` for the duration of the with block.
+    The lock is an exclusive flock on `yaml_file` + DAY_LOCK_SUFFIX, which excludes
+    other threads as well as other processes.
+
+    """
+    with open(yaml_file + DAY_LOCK_SUFFIX, 'a') as fd:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
 
 
 def import_notams(yaml_file):
@@ -163,15 +425,132 @@ def import_notams(yaml_file):
               [D][D][D][D]D - one to five digit integer (1-99999) Nautical Miles
               [NM] - Optional unit label
 
-    """
-    errors = []
-    notam_list = []
+    and may have the optional key:
+        tiers - list of the radii of the notam at different altitudes, each a
+                dictionary with keys 'rad', formatted as above, and 'alt', the
+                altitude floor formatted as FL[D]DD or [D]DDDDDFT, optionally
+                followed by AGL|MSL and/or a ceiling such as -UNL.  'rad'
+                above is then the largest of these radii.
 
+    """
     # get raw_notams
     try:
-        raw_notams = yaml.load(open(yaml_file, 'r'))
+        with open(yaml_file, 'r') as fd, lib_notam_metrics.timed('yaml_load'):
+            raw_notams = yaml.safe_load(fd)
     except FileNotFoundError:
-        return notam_list  # no notams
+        archived = read_archived(yaml_file=yaml_file)
+        if archived is None:
+            return []  # no notams
+        with lib_notam_metrics.timed('yaml_load'):
+            raw_notams = yaml.safe_load(archived)
+    return validate_notams(raw_notams=raw_notams)
+
+
+def archive_file(yaml_file):
+    """
+    Return the name of the monthly archive that day FILE `yaml_file` is
+    compacted into, or None if `yaml_file` is not named like a day file.
+
+    """
+    match = DAY_FILE_RE.match(os.path.basename(yaml_file))
+    if not match:
+        return
+    return os.path.join(os.path.dirname(yaml_file), ARCHIVE_FILE.format(month=match.group('month')))
+
+
+def read_archived(yaml_file):
+    """
+    Return the text of day FILE `yaml_file` from its monthly archive, or None
+    if it is not archived.
+
+    """
+    archive = archive_file(yaml_file)
+    if archive is None:
+        return
+    try:
+        with zipfile.ZipFile(archive) as zf:
+            return zf.read(os.path.basename(yaml_file)).decode('utf-8')
+    except (FileNotFoundError, KeyError):
+        return
+
+
+def source_file(yaml_file):
+    """
+    Return the file that day FILE `yaml_file` is read from: `yaml_file`
+    itself, or its monthly archive when only that exists.  Use this to check
+    whether a day has changed.
+
+    """
+    archive = archive_file(yaml_file)
+    if os.path.exists(yaml_file) or archive is None or not os.path.exists(archive):
+        return yaml_file
+    return archive
+
+
+def list_days(data_dir):
+    """
+    Return the sorted ISO formatted days that have a day file, loose or
+    archived, in directory `data_dir`.
+
+    """
+    names = [os.path.basename(name) for name in glob.glob(os.path.join(data_dir, '*_notams.yaml'))]
+    for archive in glob.glob(os.path.join(data_dir, ARCHIVE_FILE.format(month='*'))):
+        with zipfile.ZipFile(archive) as zf:
+            names.extend(zf.namelist())
+    return sorted({name.split('_')[0] for name in names if DAY_FILE_RE.match(name)})
+
+
+def compact_month(data_dir, month):
+    """
+    Move the day files of `month` (YYYY-MM) in directory `data_dir` into the
+    month's archive, merging them with any days already archived.  Return
+    the names of the day files compacted.
+
+    A day file that changes while the archive is written is left in place,
+    and is compacted again next time.
+
+    """
+    pattern = os.path.join(data_dir, '%s-[0-9][0-9]_notams.yaml' % month)
+    day_files = sorted(name for name in glob.glob(pattern) if archive_file(name))
+    if not day_files:
+        return []
+    archive = os.path.join(data_dir, ARCHIVE_FILE.format(month=month))
+    members = {}
+    if os.path.exists(archive):
+        with zipfile.ZipFile(archive) as zf:
+            members = {name: zf.read(name) for name in zf.namelist()}
+    mtimes = {}
+    for day_file_name in day_files:
+        mtimes[day_file_name] = os.stat(day_file_name).st_mtime_ns
+        with open(day_file_name, 'rb') as fd:
+            members[os.path.basename(day_file_name)] = fd.read()
+    with zipfile.ZipFile(archive + '.tmp', 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, data in sorted(members.items()):
+            zf.writestr(name, data)
+    with zipfile.ZipFile(archive + '.tmp') as zf:
+        bad_member = zf.testzip()
+    if bad_member is not None:
+        os.remove(archive + '.tmp')
+        raise IOError('ERROR: failed to verify %s in archive %s' % (bad_member, archive))
+    os.replace(archive + '.tmp', archive)
+    compacted = []
+    for day_file_name, mtime in mtimes.items():
+        with locked_day_file(yaml_file=day_file_name):
+            if os.stat(day_file_name).st_mtime_ns == mtime:
+                os.remove(day_file_name)
+                compacted.append(day_file_name)
+    return compacted
+
+
+def validate_notams(raw_notams):
+    """
+    Return the list of valid NOTAMs from `raw_notams`, a list of notam
+    dictionaries as described in `import_notams`.  Invalid NOTAMs are reported
+    and dropped.
+
+    """
+    errors = []
+    notam_list = []
     if not raw_notams:
         return notam_list  # no notams in file
     # validate raw_notams and populate notams dictionary
@@ -182,18 +561,20 @@ def import_notams(yaml_file):
             if key not in notam:
                 errors.append(MISSING_REQUIRED_KEY.format(i_th=add_number_suffix(ii), key=key))
                 valid_notam = False
+        if not valid_notam:
+            continue
         # validate ident
-        ident = validate_ident(notam['ident'])
+        ident = validate_ident(str(notam['ident']))
         if ident is None:
             errors.append(INVALID_IDENT.format(i_th=add_number_suffix(ii), ident=notam['ident']))
             valid_notam = False
         # validate latitude
-        latitude = validate_lat(lat=notam['lat'].upper())
+        latitude = validate_lat(lat=str(notam['lat']).upper())
         if latitude is None:
             errors.append(INVALID_LATITUDE.format(i_th=add_number_suffix(ii), latitude=notam['lat']))
             valid_notam = False
         # validate longitude
-        longitude = validate_lon(lon=notam['lon'].upper())
+        longitude = validate_lon(lon=str(notam['lon']).upper())
         if longitude is None:
             errors.append(INVALID_LONGITUDE.format(i_th=add_number_suffix(ii), longitude=notam['lon']))
             valid_notam = False
@@ -202,6 +583,10 @@ def import_notams(yaml_file):
         if radius is None:
             errors.append(INVALID_RADIUS.format(i_th=add_number_suffix(ii), radius=notam['rad']))
             valid_notam = False
+        # validate optional radius/altitude tiers
+        if 'tiers' in notam and validate_tiers(tiers=notam['tiers']) is None:
+            errors.append(INVALID_TIERS.format(i_th=add_number_suffix(ii), tiers=notam['tiers']))
+            valid_notam = False
         if valid_notam:
             notam_list.append(notam)
 
@@ -213,6 +598,129 @@ def import_notams(yaml_file):
     return notam_list
 
 
+def query_notams(data_dir, start, end, bbox=None, cursor=None, limit=QUERY_LIMIT):
+    """
+    Return (results, next_cursor) for the NOTAMs of every day from `start`
+    through `end` in the day files in directory `data_dir`.
+
+    Each result is a NOTAM dictionary with an added 'day' key.  `bbox` is an
+    optional (west, south, east, north) tuple in decimal degrees; only NOTAMs
+    centered inside it are returned.  A `bbox` with west greater than east
+    crosses the antimeridian.
+
+    At most `limit` results are returned.  If there are more, `next_cursor`
+    is an opaque string to pass as `cursor` to get the next page, otherwise
+    it is None.
+
+    """
+    days = days_in_range(start=start, end=end, limit=MAX_QUERY_DAYS)
+    limit = max(1, min(int(limit), MAX_QUERY_LIMIT))
+    first_day, first_position = decode_cursor(cursor) if cursor else (days[0], 0)
+    results = []
+    for day in days:
+        if day < first_day:
+            continue
+        yaml_file = day_file(data_dir=data_dir, day=day)
+        for position, notam in enumerate(import_notams(yaml_file=yaml_file)):
+            if day == first_day and position < first_position:
+                continue
+            if bbox is not None and not in_bbox(notam=notam, bbox=bbox):
+                continue
+            if len(results) == limit:
+                return results, encode_cursor(day=day, position=position)
+            results.append(dict(notam, day=day))
+    return results, None
+
+
+def in_bbox(notam, bbox):
+    """
+    Return True if the center of validated `notam` lies inside `bbox`, a
+    (west, south, east, north) tuple in decimal degrees.
+
+    """
+    west, south, east, north = bbox
+    lat = validate_lat(lat=str(notam['lat']).upper())
+    lon = validate_lon(lon=str(notam['lon']).upper())
+    if not south <= lat <= north:
+        return False
+    if west <= east:
+        return west <= lon <= east
+    return lon >= west or lon <= east  # crosses the antimeridian
+
+
+def parse_bbox(bbox):
+    """
+    Return the (west, south, east, north) tuple for the comma separated
+    string `bbox`.  Raises ValueError if it is invalid.
+
+    """
+    try:
+        west, south, east, north = [float(value) for value in bbox.split(',')]
+    except ValueError:
+        raise ValueError(INVALID_BBOX.format(bbox=bbox))
+    if (not -MAX_LATITUDE <= south <= north <= MAX_LATITUDE or
+            not -MAX_LONGITUDE <= west <= MAX_LONGITUDE or
+            not -MAX_LONGITUDE <= east <= MAX_LONGITUDE):
+        raise ValueError(INVALID_BBOX.format(bbox=bbox))
+    return west, south, east, north
+
+
+def encode_cursor(day, position):
+    """
+    Return the opaque cursor string for NOTAM number `position` of `day`.
+
+    """
+    return base64.urlsafe_b64encode(('%s:%d' % (day, position)).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Return the (day, position) tuple encoded in `cursor`.  Raises ValueError
+    if it is invalid.
+
+    """
+    try:
+        day, position = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        datetime.datetime.strptime(day, '%Y-%m-%d')
+        return day, int(position)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError(INVALID_CURSOR.format(cursor=cursor))
+
+
+def utc_today():
+    """
+    Return ISO formatted date for this day in UTC timezone.
+
+    """
+    return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+
+
+def days_in_range(start, end, limit=None):
+    """
+    Return the list of ISO formatted days from `start` through `end`.  Raise
+    ValueError if the range is invalid, or longer than `limit` days when a
+    limit is given.
+
+    """
+    start_day = datetime.datetime.strptime(start, '%Y-%m-%d').date()
+    end_day = datetime.datetime.strptime(end, '%Y-%m-%d').date()
+    if end_day < start_day:
+        raise ValueError('ERROR: end day %s is before start day %s' % (end, start))
+    if limit is not None and (end_day - start_day).days >= limit:
+        raise ValueError('ERROR: at most %d days can be queried at once.' % limit)
+    return [(start_day + datetime.timedelta(days=ii)).isoformat()
+            for ii in range((end_day - start_day).days + 1)]
+
+
+def fingerprint_notams(notam_list):
+    """
+    Return a hex digest identifying the content of `notam_list`.  Equal lists
+    of NOTAMs always have the same fingerprint.
+
+    """
+    return hashlib.sha1(yaml.dump(notam_list).encode()).hexdigest()
+
+
 def validate_ident(ident):
     """
     Returns valid ident, or None if ident is invalid.
@@ -341,6 +849,74 @@ def validate_radius(r):
     return radius
 
 
+def validate_altitude(alt):
+    """
+    Returns the validated altitude floor in feet, or None if altitude is
+    invalid.  For example: 'FL250' -> 25000, '4000FT AGL' -> 4000,
+    'FL400-UNL' -> 40000.
+
+    """
+    m = re.match(IS_ALTITUDE, alt)
+    if m is None:
+        # input does not match format
+        return
+    if m.group('flight_level'):
+        return int(m.group('flight_level')) * 100
+    return int(m.group('feet'))
+
+
+def validate_tiers(tiers):
+    """
+    Returns the validated list of (radius, altitude) tuples, sorted by
+    altitude, for a notam's `tiers`, or None if tiers are invalid.
+
+    `tiers` is a list of dictionaries with keys 'rad', a radius as for
+    `validate_radius`, and 'alt', the altitude the radius applies at, as for
+    `validate_altitude`.
+
+    """
+    if not isinstance(tiers, list) or not tiers:
+        return
+    validated = []
+    for tier in tiers:
+        if not isinstance(tier, dict) or 'rad' not in tier or 'alt' not in tier:
+            return
+        radius = validate_radius(r=str(tier['rad']).upper())
+        altitude = validate_altitude(alt=str(tier['alt']).upper())
+        if radius is None or altitude is None:
+            return
+        validated.append((radius, altitude))
+    return sorted(validated, key=lambda tier: tier[1])
+
+
+def notam_tiers(notam):
+    """
+    Returns the validated (radius, altitude) tiers of a previously validated
+    `notam`.  A notam without tiers has the one tier (radius, None).
+
+    """
+    if 'tiers' in notam:
+        return validate_tiers(tiers=notam['tiers'])
+    return [(validate_radius(r=str(notam['rad']).upper()), None)]
+
+
+def tier_radius(tiers, altitude=None):
+    """
+    Returns the radius in nautical miles that applies at `altitude` feet for
+    validated `tiers` (see `notam_tiers`).  That is the radius of the lowest
+    tier at or above `altitude`, which never understates the outage between
+    tiers, or the largest radius if `altitude` is None or above every tier.
+
+    """
+    largest = max(radius for radius, _ in tiers)
+    if altitude is None:
+        return largest
+    for radius, tier_altitude in tiers:
+        if tier_altitude is not None and tier_altitude >= altitude:
+            return radius
+    return largest
+
+
 def add_number_suffix(n):
     """
     Convert integer to place.  For example: 1 -> 1st, 2-> 2nd, 3 -> 3rd, ...
@@ -0,0 +1,172 @@
+"""
+Plot Job Queue
+==============
+This library queues plot jobs and renders them on background threads so that
+web requests never wait for a plot.  Each job gets an id that can be polled
+for its status, and a plot requested again while an identical job is still
+waiting reuses that job.
+
+Edits schedule a re-plot with `schedule`, which waits for a quiet period so
+that a burst of edits to one day is plotted only once.
+
+Different plots render in parallel, but two jobs for the same plot never do:
+a job requested while another renders the same plot waits for it, so the
+last render to finish is always the one that read the newest NOTAMs.
+
+"""
+# Standard Imports
+from collections import OrderedDict
+import queue
+import threading
+import time
+import uuid
+
+
+# Custom Imports
+import lib_notam_events
+import lib_notam_yaml as lny
+import render_worker
+
+
+# Constants
+JOB_HISTORY_SIZE = 200
+REPLOT_DELAY = 3.0  # seconds without edits before a scheduled plot is queued
+WORKER_THREADS = 2  # each render draws on its own figure
+
+
+# Setup
+jobs = OrderedDict()  # job id -> job dictionary
+pending = {}  # (day, map_type) -> id of the queued job
+render_locks = {}  # (day, map_type) -> threading.Lock held while it renders
+job_queue = queue.Queue()
+lock = threading.Lock()
+timers = {}  # (day, map_type) -> threading.Timer of the scheduled plot
+workers = []
+
+
+# Functions
+def submit(day, map_type=lny.DEFAULT_MAP_TYPE):
+    """
+    Queue a plot of `day` on `map_type` and return a copy of the job
+    dictionary.  If an identical job is already waiting, return that job
+    instead of queueing another.
+
+    """
+    key = (day, map_type)
+    with lock:
+        if key in pending:
+            return dict(jobs[pending[key]])
+        job = {'id': uuid.uuid4().hex,
+               'day': day,
+               'map_type': map_type,
+               'status': 'queued',
+               'submitted': time.time(),
+               'started': None,
+               'finished': None,
+               'error': None}
+        jobs[job['id']] = job
+        pending[key] = job['id']
+        while len(jobs) > JOB_HISTORY_SIZE:
+            oldest = next(iter(jobs))
+            if jobs[oldest]['status'] in ['queued', 'running']:
+                break
+            del jobs[oldest]
+        start_workers()
+    job_queue.put(job['id'])
+    lib_notam_events.publish('job', day=job['day'], job=dict(job))
+    return dict(job)
+
+
+def schedule(day, map_type=lny.DEFAULT_MAP_TYPE, delay=REPLOT_DELAY):
+    """
+    Queue a plot of `day` on `map_type` once `delay` seconds pass without
+    another call for the same plot.  Each call restarts the wait.
+
+    """
+    key = (day, map_type)
+    with lock:
+        if key in timers:
+            timers[key].cancel()
+        timer = threading.Timer(delay, run_scheduled)
+        timer.args = (day, map_type, timer)
+        timer.daemon = True
+        timers[key] = timer
+        timer.start()
+
+
+def run_scheduled(day, map_type, timer):
+    """
+    Queue the plot scheduled by `timer`, unless it has been rescheduled.
+
+    """
+    with lock:
+        if timers.get((day, map_type)) is not timer:
+            return  # cancelled just as it fired
+        del timers[(day, map_type)]
+    submit(day=day, map_type=map_type)
+
+
+def status(job_id):
+    """
+    Return a copy of the job dictionary for `job_id`, or None if it is
+    unknown.
+
+    """
+    with lock:
+        if job_id not in jobs:
+            return
+        return dict(jobs[job_id])
+
+
+def start_workers():
+    """
+    Start the worker threads, if they are not running yet.  Threads are started
+    on first use so that they are created in the process that serves requests.
+
+    """
+    while len(workers) < WORKER_THREADS:
+        worker = threading.Thread(target=run_worker, name='plot-queue-%d' % len(workers), daemon=True)
+        worker.start()
+        workers.append(worker)
+
+
+def run_worker():
+    """
+    Render queued jobs forever.
+
+    """
+    while True:
+        job_id = job_queue.get()
+        with lock:
+            job = jobs[job_id]
+            # from now on, new requests for this plot need a new job
+            pending.pop((job['day'], job['map_type']), None)
+            job['status'] = 'running'
+            job['started'] = time.time()
+            lib_notam_events.publish('job', day=job['day'], job=dict(job))
+            render_lock = render_locks.setdefault((job['day'], job['map_type']), threading.Lock())
+        try:
+            with render_lock:
+                outfile = render_day(day=job['day'], map_type=job['map_type'])
+        except Exception as err:
+            print("Plot job %s failed:" % job_id, repr(err))
+            error = repr(err)
+        else:
+            error = None
+            lib_notam_events.publish_file(event_type='plot', filename=outfile)
+        with lock:
+            job['status'] = 'failed' if error else 'done'
+            job['error'] = error
+            job['finished'] = time.time()
+            lib_notam_events.publish('job', day=job['day'], job=dict(job))
+        job_queue.task_done()
+
+
+def render_day(day, map_type):
+    """
+    Plot `day` on `map_type` to its default output file, and return the file
+    name.
+
+    """
+    print("Plotting", day)
+    return render_worker.submit_days(days=[day], map_type=map_type)[0]
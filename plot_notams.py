@@ -4,7 +4,8 @@ plot_notams.py
 Plot NOTAMS on a map.
 
 Usage:
-    plot_notams.py [--date DATE] [--init] [--marble|--etopo|--basic] [--infile FILE] [--outfile FILE] [-h]
+    plot_notams.py [--date DATE] [--init] [--marble|--etopo|--basic] [--coverage] [--infile FILE] [--outfile FILE] [--formats FORMATS] [--altitude FEET] [--profile DIR] [-h]
+    plot_notams.py --start DATE --end DATE [--init] [--marble|--etopo|--basic] [--coverage] [--formats FORMATS] [--animate FILE] [--contact-sheet FILE] [--profile DIR]
 
 Options:
   -h --help           Show this screen.
@@ -17,66 +18,167 @@ Options:
                       shadedrelief.
   --etopo             Use the etopo relief map background instead of the default
                       shadedrelief.
+  --coverage          Draw the combined area covered by the NOTAMs as a filled
+                      layer shaded by overlap count, instead of one outline
+                      per NOTAM.  The coverage grid is also saved, as
+                      the file <YYYY-MM-DD_coverage.npz>.
   --infile FILE       Read NOTAMs from YAML formatted file FILE.  If not
                       specified, the input file name will be derrived from
                       the --date option as <YYYY-MM-DD_notams.yaml>.
   --outfile FILE      Save the output plot as FILE.  If not specified, the
                       output file name will be derrived from the --date option
                       as <YYYY-MM-DD_notams.png>.
+  --formats FORMATS   Comma separated encodings to save reduced size variants
+                      of the plot in, next to the full size png, as files
+                      named <YYYY-MM-DD_notams_WIDTHw.EXT>.  Any of jpeg,
+                      png, png8 (256 color png), and webp; jpeg and webp are
+                      also saved at full size.  Use 'none' for no variants.
+                      Variants of an earlier plot that are not saved again
+                      are deleted [default: png8,webp].
+  --altitude FEET     Draw each NOTAM's radius at altitude FEET only, instead
+                      of a ring for each of its radius/altitude tiers.
+  --start DATE        Plot every UTC day from DATE through the --end DATE,
+                      reusing one map background.  Each day is read from and
+                      saved to its default file.
+  --end DATE          Last UTC day (inclusive) of a --start date range.
+  --animate FILE      Also save the date range as an animation FILE.  The
+                      format is chosen by extension: .gif or .mp4 (needs
+                      ffmpeg).
+  --contact-sheet FILE
+                      Also save a grid of every plot in the date range as
+                      FILE.
+  --profile DIR       Save a cProfile dump and a report of the time and peak
+                      memory of each stage to directory DIR.
 
 """
 # Standard Imports
-import datetime
 from docopt import docopt
+import glob
+import io
 import math
-import matplotlib
-matplotlib.use('Agg')
+import matplotlib.animation as animation
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import matplotlib.patheffects as PathEffects
-import matplotlib.pyplot as plt
 from mpl_toolkits.basemap import Basemap
 import numpy as np
 import os
-import pytz
-import gc
+from PIL import Image
+import re
+import threading
 
 
 # Custom Imports
-from lib_notam_yaml import import_notams, validate_ident, validate_lat, validate_lon, validate_radius
+import lib_notam_metrics
+from lib_notam_geo import compute_rings, coverage_area, coverage_grid, save_coverage
+from lib_notam_yaml import DEFAULT_MAP_TYPE, days_in_range, import_notams, notam_tiers, tier_radius, utc_today, validate_ident, validate_lat, validate_lon, validate_radius
 
 
 # Constants
-NOTAM_PLOT_KEYS = ['idents', 'latitudes', 'longitudes', 'radii']
+ANIMATION_DPI = 100
+ANIMATION_FPS = 2
+ANIMATION_WRITERS = {'.gif': ['pillow', 'imagemagick'], '.mp4': ['ffmpeg']}
+CONTACT_SHEET_TILE_WIDTH = 480
+COVERAGE_ALPHA = 0.6
+COVERAGE_CMAP = 'autumn_r'
+COVERAGE_PIXELS = 1000
+DEFAULT_VARIANT_FORMATS = 'png8,webp'
+NOTAM_PLOT_KEYS = ['idents', 'latitudes', 'longitudes', 'radii', 'tiers']
+PLOT_DPI = 300
+VARIANT_EXTENSIONS = {'jpeg': 'jpeg', 'png': 'png', 'png8': 'png', 'webp': 'webp'}
+VARIANT_QUALITY = 80  # jpeg and webp
+VARIANT_RE = re.compile(r'_[0-9]+w\.(png|webp|jpeg)$')
+VARIANT_WIDTHS = [480, 960]
 DATA_DIR = [os.path.dirname(__file__), 'static_notams', 'data']
 PLOT_DIR = [os.path.dirname(__file__), 'static_notams', 'images']
 
 
 # Functions
-def main(options):
+def main(options, background=None):
     """
     Opens a yaml dump, validates the notams within the file, and generates a
     plot of the notams.
 
+    `background` is an optional (fig, map) tuple from `build_background` to
+    draw on instead of warping a new map background.
+
     """
+    if options['--init']:
+        prepare_background(map_type=options['map-type'])
+
+    if options.get('--start'):
+        render_days(days=days_in_range(start=options['--start'], end=options['--end']),
+                    map_type=options['map-type'],
+                    background=background,
+                    coverage=options['--coverage'],
+                    formats=options['--formats'],
+                    animation_file=options['--animate'],
+                    contact_sheet=options['--contact-sheet'])
+        print("Success")
+        return
+
     print("Opening %s ..." % options['--infile'])
+    altitude = options.get('--altitude')
+    notams = load_notams(yaml_file=options['--infile'], altitude=None if altitude is None else int(altitude))
+    if options['--coverage']:
+        add_coverage(notams=notams, day=options['--date'])
+
+    print("Generating Plot %s ..." % options['--outfile'])
+    make_plot(notams=notams,
+              day=options['--date'],
+              outfile=options['--outfile'],
+              map_type=options['map-type'],
+              background=background,
+              formats=options['--formats'])
+    print("Success")
+    return
 
+
+def load_notams(yaml_file, altitude=None):
+    """
+    Return the plot dictionary, including circles, for the notams in YAML dump
+    FILE `yaml_file`, optionally at `altitude` (see `build_notams`).
+
+    """
     print("Collecting notams...")
-    notam_list = import_notams(yaml_file=options['--infile'])
+    return build_notams(notam_list=import_notams(yaml_file=yaml_file), altitude=altitude)
+
+
+def build_notams(notam_list, altitude=None):
+    """
+    Return the plot dictionary, including circles, for a previously validated
+    `notam_list`.
+
+    If `altitude` (feet) is given, the radii are the NOTAMs' radii at that
+    altitude and only those circles are drawn.  Otherwise every radius/altitude
+    tier gets a circle.
+
+    """
     notams = create_plot_dictionary(notam_list=notam_list)
+    if altitude is not None:
+        notams['altitude'] = altitude
+        notams['radii'] = [tier_radius(tiers, altitude) for tiers in notams['tiers']]
     print(notams)
 
     print("Computing Circles ...")
     notams['circles'] = compute_circles(notams)
+    return notams
 
-    if options['--init']:
-        prepare_background(map_type=options['map-type'])
 
-    print("Generating Plot %s ..." % options['--outfile'])
-    make_plot(notams=notams,
-              day=options['--date'],
-              outfile=options['--outfile'],
-              map_type=options['map-type'])
-    print("Success")
-    return
+def add_coverage(notams, day):
+    """
+    Rasterize the NOTAMs in plot dictionary `notams` into notams['coverage'],
+    save the grid for `day`, and report the affected area.
+
+    """
+    print("Computing Coverage ...")
+    count, cell_lats, cell_lons = coverage_grid(latitudes=notams['latitudes'],
+                                                longitudes=notams['longitudes'],
+                                                radii=notams['radii'])
+    notams['coverage'] = (count, cell_lats, cell_lons)
+    save_coverage(filename=os.path.join(*DATA_DIR, '_'.join([day, 'coverage.npz'])), count=count)
+    area = coverage_area(mask=count > 0, cell_lats=cell_lats)
+    print("    Affected area: %.0f square NM, at most %d overlapping NOTAMs" % (area, count.max(initial=0)))
 
 
 def create_plot_dictionary(notam_list):
@@ -89,10 +191,11 @@ def create_plot_dictionary(notam_list):
     for key in NOTAM_PLOT_KEYS:
         notams[key] = []
     for notam in notam_list:
-        notams['idents'].append(validate_ident(notam['ident']))
-        notams['latitudes'].append(validate_lat(lat=notam['lat'].upper()))
-        notams['longitudes'].append(validate_lon(lon=notam['lon'].upper()))
-        notams['radii'].append(validate_radius(r=notam['rad'].upper()))
+        notams['idents'].append(validate_ident(str(notam['ident'])))
+        notams['latitudes'].append(validate_lat(lat=str(notam['lat']).upper()))
+        notams['longitudes'].append(validate_lon(lon=str(notam['lon']).upper()))
+        notams['radii'].append(validate_radius(r=str(notam['rad']).upper()))
+        notams['tiers'].append(notam_tiers(notam))
     return notams
 
 
@@ -105,7 +208,7 @@ def prepare_background(map_type):
     outfile = os.path.join(*PLOT_DIR, '%s_map.png' % map_type)
 
     print("Generating Background Map %s ..." % outfile)
-    fig = plt.figure(1)
+    fig = new_figure()
     left = 0.0
     bottom = 0.0
     width = 1.0
@@ -133,10 +236,11 @@ def prepare_background(map_type):
         map.shadedrelief()
     print('    Saving...')
     ax.axis('off')
-    fig.savefig(outfile, frameon=False, bbox_inches='tight', pad_inches=0, dpi=600)
-    plt.clf()
-    plt.close()
-    gc.collect()
+    # another thread or process may be warping the current image meanwhile
+    partial_file = temporary_file(outfile)
+    fig.savefig(partial_file, format='png', frameon=False, bbox_inches='tight', pad_inches=0, dpi=600)
+    os.replace(partial_file, outfile)
+    fig.clear()
 
 
 def warp_map_image(map_type):
@@ -146,133 +250,423 @@ def warp_map_image(map_type):
 
     """
     infile = os.path.join(*PLOT_DIR, '%s_map.png' % map_type)
-    fig = plt.figure(2, frameon=False)
+    fig = new_figure(frameon=False)
     left = 0.0
     bottom = 0.05
     width = 1.0
     height = 0.9
     ax = fig.add_axes([left, bottom, width, height])
     print('    Creating Basemap...')
-    map = Basemap(projection='ortho', lat_0=45, lon_0=-100, resolution='l', ax=ax)
-    try:
-        map.warpimage(infile)
-    except FileNotFoundError:
-        prepare_background(map_type)
-        map.warpimage(infile)
+    with lib_notam_metrics.timed('warp'):
+        map = Basemap(projection='ortho', lat_0=45, lon_0=-100, resolution='l', ax=ax)
+        try:
+            map.warpimage(infile)
+        except FileNotFoundError:
+            prepare_background(map_type)
+            map.warpimage(infile)
     return fig, map
 
 
-def make_plot(notams, day, outfile, map_type):
+def build_background(map_type):
     """
-    Plot NOTAMs.
+    Return a (fig, map) tuple with the warped map background and lat/lon grid
+    drawn, ready for `make_plot` to add NOTAMs to.
 
     """
     fig, map = warp_map_image(map_type=map_type)
     print('    Adding features - 30 degree lat/lon grid...')
     map.drawmeridians(np.arange(0, 360, 30), zorder=2)
     map.drawparallels(np.arange(-90, 90, 30), zorder=2)
+    return fig, map
+
+
+def render_days(days, map_type, background=None, coverage=False, formats=DEFAULT_VARIANT_FORMATS,
+                animation_file=None, contact_sheet=None):
+    """
+    Plot each of the ISO formatted `days` to its default output file, drawing
+    every day on the same map background.  Optionally draw each day's
+    coverage, and also save the days as an animation and/or a contact sheet.
+    Return the list of output files.
+
+    `formats` selects the reduced size variants saved with each plot, as for
+    `save_plot`.
+
+    """
+    if background is None:
+        fig, map = build_background(map_type=map_type)
+    else:
+        fig, map = background
+    writer = None
+    if animation_file:
+        writer = animation_writer(filename=animation_file)
+        writer.setup(fig, animation_file, dpi=ANIMATION_DPI)
+    outfiles = []
+    for day in days:
+        infile = os.path.join(*DATA_DIR, '_'.join([day, 'notams.yaml']))
+        outfile = os.path.join(*PLOT_DIR, '_'.join([day, 'notams.png']))
+        notams = load_notams(yaml_file=infile)
+        if coverage:
+            add_coverage(notams=notams, day=day)
+        print("Generating Plot %s ..." % outfile)
+        artists = []
+        try:
+            with lib_notam_metrics.timed('draw'):
+                draw_notams(map=map, notams=notams, day=day, artists=artists)
+            save_plot(fig=fig, outfile=outfile, formats=formats)
+            if writer is not None:
+                writer.grab_frame()
+        finally:
+            # never carry a failed day's NOTAMs into later days or frames
+            clear_notams(map=map, artists=artists)
+        outfiles.append(outfile)
+    if writer is not None:
+        print("Saving Animation %s ..." % animation_file)
+        writer.finish()
+    if background is None:
+        close_background((fig, map))
+    if contact_sheet:
+        make_contact_sheet(infiles=outfiles, outfile=contact_sheet)
+    return outfiles
+
+
+def animation_writer(filename):
+    """
+    Return a matplotlib animation writer for the format of `filename`.
+
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    for name in ANIMATION_WRITERS.get(extension, []):
+        if animation.writers.is_available(name):
+            return animation.writers[name](fps=ANIMATION_FPS)
+    raise ValueError('ERROR: No animation writer available for %s' % filename)
+
+
+def make_contact_sheet(infiles, outfile):
+    """
+    Save a grid of thumbnails of the images `infiles` as `outfile`.
+
+    """
+    print("Saving Contact Sheet %s ..." % outfile)
+    columns = math.ceil(math.sqrt(len(infiles)))
+    rows = math.ceil(len(infiles) / columns)
+    sheet = None
+    for ii, infile in enumerate(infiles):
+        with Image.open(infile) as image:
+            tile = image.convert('RGB')
+        tile.thumbnail((CONTACT_SHEET_TILE_WIDTH, CONTACT_SHEET_TILE_WIDTH * tile.height // tile.width))
+        if sheet is None:
+            sheet = Image.new('RGB', (columns * tile.width, rows * tile.height), 'white')
+        sheet.paste(tile, ((ii % columns) * tile.width, (ii // columns) * tile.height))
+    if sheet is not None:
+        sheet.save(outfile)
+
+
+def render_png(notam_list, day, map_type, background=None):
+    """
+    Plot the NOTAMs in `notam_list` for `day` and return the PNG image as
+    bytes, without writing it to disk.
+
+    """
+    buf = io.BytesIO()
+    make_plot(notams=build_notams(notam_list=notam_list),
+              day=day,
+              outfile=buf,
+              map_type=map_type,
+              background=background)
+    return buf.getvalue()
+
+
+def new_figure(**kwargs):
+    """
+    Return a new matplotlib Figure, created with `kwargs`, that draws on its
+    own Agg canvas.
+
+    Figures are never registered with pyplot, so each render owns its figure
+    and renders may run in several threads at once.  A background from
+    `build_background` must still be used by one thread at a time.
+
+    """
+    fig = Figure(**kwargs)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def close_background(background):
+    """
+    Release a (fig, map) tuple returned by `build_background`.  Clearing the
+    figure frees the warped image right away, without waiting for a garbage
+    collection.
+
+    """
+    fig, _ = background
+    fig.clear()
+
+
+def make_plot(notams, day, outfile, map_type, background=None, formats=None):
+    """
+    Plot NOTAMs.
+
+    If `background` is given, the NOTAMs are drawn on that (fig, map) tuple and
+    removed again after saving, or after a failure, so the background can be
+    reused.  Otherwise a new background is built and closed after saving.
+
+    `formats` selects the reduced size variants saved with the plot, as for
+    `save_plot`.
+
+    """
+    if background is None:
+        fig, map = build_background(map_type=map_type)
+    else:
+        fig, map = background
+    artists = []
+    try:
+        with lib_notam_metrics.timed('draw'):
+            draw_notams(map=map, notams=notams, day=day, artists=artists)
+        print('    Saving...')
+        save_plot(fig=fig, outfile=outfile, formats=formats)
+    finally:
+        # a failed plot must not leave its NOTAMs on a reused background
+        if background is None:
+            close_background((fig, map))
+        else:
+            clear_notams(map=map, artists=artists)
+
+
+def save_plot(fig, outfile, formats=None):
+    """
+    Save `fig` as the full size PNG `outfile` (a file name or file object).
+
+    `formats` is a comma separated string of encodings (see
+    VARIANT_EXTENSIONS) for reduced size variants of a file name `outfile`.
+    The figure is rasterized only once; the variants are resampled from the
+    full size image.  Files are replaced whole (see `replace_file`).
+
+    """
+    encodings = variant_encodings(formats)
+    if not isinstance(outfile, str):
+        with lib_notam_metrics.timed('savefig'):
+            fig.savefig(outfile, format='png', dpi=PLOT_DPI)
+        return
+    # without variants, the format follows the extension of `outfile`
+    image_format = 'png' if encodings else os.path.splitext(outfile)[1][1:].lower() or 'png'
+    buf = io.BytesIO()
+    with lib_notam_metrics.timed('savefig'):
+        fig.savefig(buf, format=image_format, dpi=PLOT_DPI)
+    replace_file(filename=outfile, data=buf.getvalue())
+    variants = []
+    if encodings:
+        buf.seek(0)
+        with Image.open(buf) as image, lib_notam_metrics.timed('variants'):
+            variants = save_variants(image=image.convert('RGB'), outfile=outfile, encodings=encodings)
+    remove_stale_variants(outfile=outfile, variants=variants)
+
+
+def variant_encodings(formats):
+    """
+    Return the list of encodings in the comma separated string `formats`
+    (see `save_plot`).  None, '' and 'none' mean no variants.  Raise
+    ValueError for an unknown encoding.
+
+    """
+    if not formats or formats == 'none':
+        return []
+    encodings = formats.split(',')
+    unknown = [encoding for encoding in encodings if encoding not in VARIANT_EXTENSIONS]
+    if unknown:
+        raise ValueError('ERROR: unknown variant format(s) %s, expected any of %s or none' %
+                         (', '.join(unknown), ', '.join(sorted(VARIANT_EXTENSIONS))))
+    return encodings
+
+
+def remove_stale_variants(outfile, variants):
+    """
+    Delete the reduced size variants of an earlier `outfile` plot that are
+    not among the just saved `variants`, so that they are not served with
+    the new plot.
+
+    """
+    base = os.path.splitext(outfile)[0]
+    for filename in glob.glob(glob.escape(base) + '_*w.*'):
+        if VARIANT_RE.match(filename[len(base):]) and filename not in variants:
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass  # removed by a concurrent plot
+
+
+def save_variants(image, outfile, encodings):
+    """
+    Save reduced size copies of the RGB `image` for each of `encodings` as
+    <outfile base>_<width>w.<extension>.  Encodings other than png and png8
+    are also saved at full size.  Return the list of files saved.
+
+    """
+    base = os.path.splitext(outfile)[0]
+    variants = []
+    for width in VARIANT_WIDTHS + [image.width]:
+        if width > image.width:
+            continue
+        if width == image.width:
+            resized = image
+        else:
+            resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        for encoding in encodings:
+            if width == image.width and encoding in ['png', 'png8']:
+                continue  # the full size png is outfile itself
+            if encoding == 'png' and 'png8' in encodings:
+                continue  # quantized png takes the place of the truecolor png
+            variant = '%s_%dw.%s' % (base, width, VARIANT_EXTENSIONS[encoding])
+            buf = io.BytesIO()
+            if encoding == 'png8':
+                resized.quantize(colors=256).save(buf, format='png', optimize=True)
+            elif encoding == 'png':
+                resized.save(buf, format='png', optimize=True)
+            else:
+                resized.save(buf, format=VARIANT_EXTENSIONS[encoding], quality=VARIANT_QUALITY)
+            replace_file(filename=variant, data=buf.getvalue())
+            variants.append(variant)
+    return variants
+
+
+def replace_file(filename, data):
+    """
+    Write the bytes `data` to `filename` through a temporary file, so that
+    readers, and renders of the same plot in other threads, never see a
+    partly written file.
+
+    """
+    partial_file = temporary_file(filename)
+    with open(partial_file, 'wb') as fd:
+        fd.write(data)
+    os.replace(partial_file, filename)
+
+
+def temporary_file(filename):
+    """
+    Return a temporary file name next to `filename` that is unique to this
+    process and thread.
+
+    """
+    return '%s.%d.%d.tmp' % (filename, os.getpid(), threading.get_ident())
+
+
+def make_heatmap(coverage, title, outfile, map_type, formats=None):
+    """
+    Plot the (count, cell_lats, cell_lons) `coverage` grid as a heatmap with
+    a colorbar and `title`, and save it as for `save_plot`.
+
+    """
+    fig, map = build_background(map_type=map_type)
+    with lib_notam_metrics.timed('draw'):
+        image = draw_coverage(map=map, coverage=coverage)
+        fig.colorbar(image, ax=map.ax, shrink=0.6, label='outage days')
+        map.ax.set_title(title)
+    print('    Saving...')
+    save_plot(fig=fig, outfile=outfile, formats=formats)
+    close_background((fig, map))
+
+
+def draw_notams(map, notams, day, artists=None):
+    """
+    Draw the NOTAM circles, labels, and title for `day` on `map`.  Return the
+    list of artists added.
+
+    If list `artists` is given, each artist is appended to it as soon as it
+    is drawn, so that the caller can remove them even if drawing fails.
+
+    """
     print('    Adding Notams...')
+    ax = map.ax
     idents = notams['idents']
     latitudes = notams['latitudes']
     longitudes = notams['longitudes']
     # radii = notams['radii']
-    # Add Circles
-    for ii in range(len(idents)):
-        circle_lats, circle_lons = notams['circles'][ii]
-        x, y = map(circle_lons, circle_lats)
-        map.plot(x, y, marker=None, color='red', linewidth=1, zorder=15)
+    if artists is None:
+        artists = []
+    if 'coverage' in notams:
+        # Add filled coverage instead of overlapping circles
+        artists.append(draw_coverage(map=map, coverage=notams['coverage']))
+    else:
+        # Add Circles, the largest solid and the lower altitude tiers dotted
+        for ii in range(len(idents)):
+            for jj, (circle_lats, circle_lons) in enumerate(notams['circles'][ii]):
+                x, y = map(circle_lons, circle_lats)
+                style = {'linewidth': 1} if jj == 0 else {'linewidth': 0.5, 'linestyle': ':'}
+                artists.extend(map.plot(x, y, marker=None, color='red', zorder=15, **style))
     # Add labels
     for ii in range(len(idents)):
         x, y = map(longitudes[ii], latitudes[ii])
-        plt.text(
+        artists.append(ax.text(
             x, y, idents[ii], fontsize=2, fontweight='bold', ha='center',
             va='center', color='white',
             path_effects=[PathEffects.withStroke(
                 linewidth=3, foreground="black")],
-            zorder=20)
-    plt.title(day + ' NOTAMs')
-    print('    Saving...')
-    fig.savefig(outfile, dpi=300)
-    plt.clf()
-    plt.close()
-    gc.collect()
+            zorder=20))
+    if notams.get('altitude') is None:
+        ax.set_title(day + ' NOTAMs')
+    else:
+        ax.set_title('%s NOTAMs at %d ft' % (day, notams['altitude']))
+    return artists
 
 
-def compute_circles(notams):
+def draw_coverage(map, coverage):
     """
-    Returns `circles`, a list of tuples - each tuple contains an array of
-    latitudes and an array of longitudes defining one circle.
-
-    `notams` is a dictionary containing keys 'idents', 'latitudes',
-    'longitudes', and 'radii'.
+    Draw the (count, cell_lats, cell_lons) `coverage` grid on `map` as a
+    filled layer shaded by overlap count.  Return the image artist.
 
     """
-    circles = []
-    idents = notams['idents']
-    latitudes = notams['latitudes']
-    longitudes = notams['longitudes']
-    radii = notams['radii']
-    for ii in range(len(idents)):
-        circle_lats, circle_lons = compute_circle(latitudes[ii], longitudes[ii], radii[ii])
-        circles.append((circle_lats, circle_lons))
-    return circles
+    count, cell_lats, cell_lons = coverage
+    # resample the lat/lon grid into map projection coordinates
+    data = map.transform_scalar(count.astype(float), cell_lons, cell_lats,
+                                COVERAGE_PIXELS, COVERAGE_PIXELS, order=0, masked=True)
+    data = np.ma.masked_less(data, 1)
+    return map.imshow(data, cmap=COVERAGE_CMAP, alpha=COVERAGE_ALPHA,
+                      vmin=1, vmax=max(2, count.max(initial=0)), zorder=10)
 
 
-def compute_circle(lat, lon, radius_nautical_miles):
+def clear_notams(map, artists):
     """
-    Returns a tuple containing an array of longitudes and latitudes defining
-    locations at the given radius around the location,
-    lon using the Haversine formula.
-
-    Based on https://stochasticcoder.com/2016/04/06/python-custom-distance-radius-with-basemap/
-    Adapted to use nautical miles instead of miles
+    Remove the NOTAM `artists` and the title added by `draw_notams` from
+    `map`.
 
     """
-    lats = []
-    lons = []
-    for bearing in range(0, 360):
-        lat2, lon2 = get_location(lat, lon, bearing, radius_nautical_miles)
-        lats.append(lat2)
-        lons.append(lon2)
-    return lats, lons
+    for artist in artists:
+        artist.remove()
+    del artists[:]
+    map.ax.set_title('')
 
 
-def get_location(lat1, lon1, bearing, distance_nautical_miles):
-    """
-    Return the lat and lon of a location that has specified bearing and distance
-    from lat1, lon1.
-
-    Based on https://stochasticcoder.com/2016/04/06/python-custom-distance-radius-with-basemap/
-    Adapted to use distances in nautical miles
-
+def compute_circles(notams):
     """
-    lat1 = lat1 * math.pi / 180.0
-    lon1 = lon1 * math.pi / 180.0
-    # Earth's radius in nautical miles - ref http://science.answers.com/Q/What_is_the_radius_of_earth
-    R = 3440.07
-    distance_nautical_miles = distance_nautical_miles / R
-    bearing = (bearing / 90.0) * math.pi / 2.0
+    Returns `circles`, one list per NOTAM of (latitudes, longitudes) array
+    tuples, each defining one circle, largest first.
 
-    lat2 = math.asin(
-        math.sin(lat1) * math.cos(distance_nautical_miles) +
-        math.cos(lat1) * math.sin(distance_nautical_miles) * math.cos(bearing))
-
-    lon2 = lon1 + math.atan2(
-        math.sin(bearing) * math.sin(distance_nautical_miles) * math.cos(lat1),
-        math.cos(distance_nautical_miles) - math.sin(lat1) * math.sin(lat2))
-
-    lon2 = 180.0 * lon2 / math.pi
-    lat2 = 180.0 * lat2 / math.pi
-    return lat2, lon2
-
-
-def utc_today():
-    """
-    Return ISO formatted date for this day in UTC timezone.
+    `notams` is a dictionary containing keys 'idents', 'latitudes',
+    'longitudes', 'radii', and 'tiers', and optionally 'altitude'.  Without an
+    altitude, each NOTAM gets one circle per radius/altitude tier, otherwise
+    only the circle of its radius.  All circles are computed in one batch.
 
     """
-    UTC = pytz.timezone('UTC')
-    return datetime.datetime.now(UTC).date().isoformat()
+    owners = []
+    ring_lats = []
+    ring_lons = []
+    ring_radii = []
+    for ii in range(len(notams['idents'])):
+        if notams.get('altitude') is None:
+            radii = sorted({radius for radius, _ in notams['tiers'][ii]}, reverse=True)
+        else:
+            radii = [notams['radii'][ii]]
+        for radius in radii:
+            owners.append(ii)
+            ring_lats.append(notams['latitudes'][ii])
+            ring_lons.append(notams['longitudes'][ii])
+            ring_radii.append(radius)
+    circles = [[] for _ in notams['idents']]
+    with lib_notam_metrics.timed('circles'):
+        lats, lons = compute_rings(ring_lats, ring_lons, ring_radii)
+        for ii, circle_lats, circle_lons in zip(owners, lats, lons):
+            circles[ii].append((circle_lats, circle_lons))
+    return circles
 
 
 def build_options(day=False):
@@ -298,14 +692,18 @@ def build_options(day=False):
     elif options['--etopo']:
         options['map-type'] = 'etopo'
     else:  # default
-        options['map-type'] = 'shaded'
+        options['map-type'] = DEFAULT_MAP_TYPE
     # build infile name based on date
     if options['--infile'] is None:
         options['--infile'] = os.path.join(*DATA_DIR, '_'.join([options['--date'], 'notams.yaml']))
     if options['--outfile'] is None:
         options['--outfile'] = os.path.join(*PLOT_DIR, '_'.join([options['--date'], 'notams.png']))
+    variant_encodings(options['--formats'])
     return options
 
 
 if __name__ == '__main__':
-    main(options=build_options())
+    options = build_options()
+    with lib_notam_metrics.profiled(process='plot_notams', directory=options['--profile']):
+        main(options=options)
+    lib_notam_metrics.save_snapshot(process='plot_notams')
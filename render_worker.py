@@ -0,0 +1,230 @@
+"""
+Render Worker
+=============
+A long-lived process that keeps matplotlib, Basemap, and the warped map
+backgrounds loaded, and renders NOTAM plots on request.  Jobs are received
+over a local unix socket so that the Flask app and the retriever only pay for
+drawing the NOTAMs, not for imports and map setup.
+
+Clients import this module without loading the plotting stack;
+`plot_notams` is only imported by the worker itself, or by a client that
+has to plot in process because no worker is running.
+
+Usage:
+    render_worker.py -h
+    render_worker.py [--socket FILE] [--preload TYPES]
+
+Options:
+  -h --help           Show this screen.
+  --socket FILE       Listen for render jobs on unix socket FILE.  The default
+                      is <static_notams/data/render_worker.sock>.
+  --preload TYPES     Comma separated list of map types to warm up before
+                      accepting jobs [default: shaded].
+
+"""
+# Standard Imports
+from collections import OrderedDict
+from docopt import docopt
+from multiprocessing.connection import Client, Listener
+import os
+import threading
+import time
+
+
+# Custom Imports
+import lib_notam_metrics
+import lib_notam_yaml as lny
+
+
+# Constants
+PNG_CACHE_SIZE = 32
+SOCKET_FILE = os.path.join(os.path.dirname(__file__), 'static_notams', 'data', 'render_worker.sock')
+SOCKET_UMASK = 0o177  # jobs are pickled, so only the owning user may connect
+
+
+# Setup
+png_cache = OrderedDict()  # (day, map_type, fingerprint) -> PNG bytes
+png_cache_lock = threading.Lock()  # the app's request threads share png_cache
+
+
+# Functions
+def main(options):
+    """
+    Warm up the requested map backgrounds, then serve render jobs forever.
+
+    """
+    address = options['--socket']
+    backgrounds = {}
+    for map_type in options['--preload'].split(','):
+        print("Warming up %s background..." % map_type)
+        get_background(backgrounds=backgrounds, map_type=map_type)
+
+    if os.path.exists(address):
+        os.remove(address)
+    # create the socket owner-only, rather than chmod it after it is bound
+    umask = os.umask(SOCKET_UMASK)
+    try:
+        listener = Listener(address, family='AF_UNIX')
+    finally:
+        os.umask(umask)
+    with listener:
+        print("Listening on %s ..." % address)
+        while True:
+            with listener.accept() as conn:
+                try:
+                    options = conn.recv()
+                except EOFError:
+                    continue
+                conn.send(render_job(backgrounds=backgrounds, options=options))
+                lib_notam_metrics.save_snapshot(process='render_worker')
+
+
+def get_background(backgrounds, map_type):
+    """
+    Return the cached (fig, map) background for `map_type` from `backgrounds`,
+    building it first if needed.
+
+    """
+    import plot_notams
+    if map_type not in backgrounds:
+        backgrounds[map_type] = plot_notams.build_background(map_type=map_type)
+    return backgrounds[map_type]
+
+
+def render_job(backgrounds, options):
+    """
+    Render the job described by `options` on a cached background.
+
+    `options` is either a plot_notams options dictionary (see
+    `plot_notams.build_options`), a dictionary with keys 'days' and 'map-type'
+    for a batch of days, or a dictionary with keys 'notam_list', 'day' and
+    'map-type' for an in-memory render.  Return a dictionary with the
+    'outfile' (or 'outfiles', or 'png' bytes) and elapsed 'seconds', or with
+    an 'error' message.
+
+    """
+    import plot_notams
+    start = time.time()
+    map_type = options['map-type']
+    result = {}
+    try:
+        if options.get('--init'):
+            # regenerate the background image and forget the stale warp
+            plot_notams.prepare_background(map_type=map_type)
+            if map_type in backgrounds:
+                plot_notams.close_background(backgrounds.pop(map_type))
+            options = dict(options, **{'--init': False})
+        background = get_background(backgrounds=backgrounds, map_type=map_type)
+        if 'days' in options:
+            result['outfiles'] = plot_notams.render_days(days=options['days'],
+                                                         map_type=map_type,
+                                                         background=background)
+        elif 'notam_list' in options:
+            result['png'] = plot_notams.render_png(notam_list=options['notam_list'],
+                                                   day=options['day'],
+                                                   map_type=map_type,
+                                                   background=background)
+        else:
+            plot_notams.main(options=options, background=background)
+            result['outfile'] = options['--outfile']
+    except Exception as err:
+        print("Render failed:", repr(err))
+        return {'error': repr(err)}
+    result['seconds'] = time.time() - start
+    return result
+
+
+def submit(options, address=SOCKET_FILE):
+    """
+    Render the plot described by `options` (see `plot_notams.build_options`)
+    and return the output file name.
+
+    The job is sent to the render worker listening on `address`.  When no
+    worker is running, the plot is rendered in this process instead.
+
+    """
+    result = send_job(job=dict(options), address=address)
+    if result is None:
+        print("Render worker not available, plotting in process...")
+        import plot_notams
+        plot_notams.main(options=options)
+        return options['--outfile']
+    return result['outfile']
+
+
+def submit_days(days, map_type, address=SOCKET_FILE):
+    """
+    Plot each of the ISO formatted `days` to its default output file on one
+    map background, and return the list of output files.
+
+    The job is sent to the render worker listening on `address`.  When no
+    worker is running, the days are plotted in this process instead.
+
+    """
+    result = send_job(job={'days': list(days), 'map-type': map_type}, address=address)
+    if result is None:
+        print("Render worker not available, plotting in process...")
+        import plot_notams
+        return plot_notams.render_days(days=days, map_type=map_type)
+    return result['outfiles']
+
+
+def render_png(notam_list, day, map_type, address=SOCKET_FILE):
+    """
+    Return the PNG plot of the validated `notam_list` for `day` as bytes,
+    without writing it to disk.
+
+    Images are cached in memory by day, map type, and the fingerprint of
+    `notam_list`, so repeated requests for unchanged NOTAMs are not rendered
+    again.
+
+    """
+    key = (day, map_type, lny.fingerprint_notams(notam_list))
+    with png_cache_lock:
+        png = png_cache.get(key)
+        if png is not None:
+            png_cache.move_to_end(key)
+    lib_notam_metrics.count_cache(cache='png', hit=png is not None)
+    if png is not None:
+        return png
+    job = {'notam_list': notam_list, 'day': day, 'map-type': map_type}
+    result = send_job(job=job, address=address)
+    if result is None:
+        import plot_notams
+        png = plot_notams.render_png(notam_list=notam_list, day=day, map_type=map_type)
+    else:
+        png = result['png']
+    with png_cache_lock:
+        png_cache[key] = png
+        while len(png_cache) > PNG_CACHE_SIZE:
+            png_cache.popitem(last=False)
+    return png
+
+
+def send_job(job, address=SOCKET_FILE):
+    """
+    Send `job` to the render worker listening on `address` and return its
+    result dictionary, or None if no worker is running.
+
+    """
+    try:
+        conn = Client(address, family='AF_UNIX')
+    except (FileNotFoundError, ConnectionRefusedError):
+        return
+    with conn:
+        conn.send(job)
+        result = conn.recv()
+    if 'error' in result:
+        raise RuntimeError('ERROR: render worker failed: %s' % result['error'])
+    return result
+
+
+def build_options():
+    options = docopt(__doc__)
+    if not options['--socket']:
+        options['--socket'] = SOCKET_FILE
+    return options
+
+
+if __name__ == '__main__':
+    main(options=build_options())
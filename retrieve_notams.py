@@ -4,9 +4,16 @@ NOTAM Retriever
 This module contains the logic to retrieve GPS NOTAMs from a website, save them,
 and generate their plots.
 
+Each run is compared with the NOTAMs retrieved by the previous run, saved as
+the snapshot file <ingest_snapshot.yaml> in the data directory.  Only the NOTAMs
+that were added, removed or changed since then are written to the day files,
+only the days they affect are plotted again, and the change set is logged to
+<ingest_changes.log>.  NOTAMs that disappear from the website are only removed
+from future days; on past days and today they have simply expired.
+
 Usage:
     retrieve_notams.py -h
-    retrieve_notams.py [--url URL | --use-file FILE] [--plotdir DIR] [--datadir DIR] [--debug]
+    retrieve_notams.py [--url URL | --use-file FILE] [--plotdir DIR] [--datadir DIR] [--debug] [--profile DIR]
 
 Options:
   -h --help           Show this screen.
@@ -17,31 +24,44 @@ Options:
                       behavior is to read from a url.
   --plotdir DIR       Override the default output dir for plots.
   --datadir DIR       Override the default output dir for yaml files.
+  --profile DIR       Save a cProfile dump and a report of the time and peak
+                      memory of each stage to directory DIR.  Plots are drawn
+                      in this process, not by the render worker, so that
+                      they are included.
 
 """
 # Standard Imports
 from docopt import docopt
 import datetime
 from itertools import groupby
+import json
 from operator import itemgetter
 import os
 import re
 import requests
+import yaml
 
 
 # Custom Imports
+import lib_notam_metrics
 import lib_notam_yaml as lyn
 import plot_notams
+import render_worker
 
 
 # Constants
 DATADIR = [os.path.dirname(__file__), 'static_notams', 'data']
 DATAURL = 'https://pilotweb.nas.faa.gov/PilotWeb/noticesAction.do?queryType=ALLGPS&formatType=DOMESTIC'
+CHANGES_LOG = 'ingest_changes.log'
 IDENT_SUBSTRING_RE = re.compile('!GPS <b>(?P<ident>[0-9/].*)</b>')
 LATLON_SUBSTRING_RE = re.compile('(?P<latlon>[0-9]{6}[NS][0-9]{6,7}[EW])')
 PLOTDIR = ['static_notams', 'images']
+SNAPSHOT_FILE = 'ingest_snapshot.yaml'
 RADIUS_SUBSTRING_RE = re.compile('(?P<radius>[0-9]{1,4}) ?NM')
 TIMESPAN_DATE_FORMAT = "%y%m%d%H%M"
+# one radius/altitude tier, e.g. '270NM RADIUS CENTERED AT 352119N1163405W (HEC339034) FL400-UNL'
+TIER_SUBSTRING_RE = re.compile('(?P<radius>[0-9]{1,4}) ?NM RADIUS[^,]*?'
+                               '(?P<altitude>FL[0-9]{2,3}(-UNL|-FL[0-9]{2,3})?|[0-9]{1,6} ?FT( AGL| MSL)?)')
 TIMESPAN_SUBSTRING_RE = re.compile('(?P<timespan>(?P<start>[0-9]{10})-(?P<stop>[0-9]{10}))')
 
 
@@ -59,20 +79,131 @@ def main(options):
 
     # get data from file
     # ==================
-    # data: key = unique radius/latlon/timespan
-    #       value = list of notams idents with radius, latlon, and timespan
-    #                matching key.
+    with lib_notam_metrics.timed('fetch'):
+        if use_file:
+            with open(use_file, 'r') as fd:
+                lines = fd.readlines()
+        else:  # download url
+            r = requests.get(url)
+            lines = r.text.split('\n')
+    with lib_notam_metrics.timed('parse'):
+        data = parse_lines(lines=lines, debug=options['--debug'])
+        notam_dict = process_html_data(data)
+    data_dir = os.path.join(*datadir)
+    snapshot_file = os.path.join(data_dir, SNAPSHOT_FILE)
+    today = datetime.datetime.utcnow().date().isoformat()
+    change_set = diff_notams(old=load_snapshot(snapshot_file), new=notam_dict, today=today)
+    log_change_set(change_set=change_set, logfile=os.path.join(data_dir, CHANGES_LOG))
+    print("Exporting to yaml...")
+    results, changed_days = lyn.apply_operations(data_dir=data_dir, operations=change_operations(change_set))
+    for result in results:
+        if result['error']:
+            print('   ', result['error'])
+    save_snapshot(filename=snapshot_file, notam_dict=notam_dict)
+    if not changed_days:
+        print("No day files changed, plots are up to date.")
+        return
+    print("Updating plots...")
+    if options['--profile']:
+        plot_notams.render_days(days=changed_days, map_type=plot_notams.DEFAULT_MAP_TYPE)
+    else:
+        render_worker.submit_days(days=changed_days, map_type=plot_notams.DEFAULT_MAP_TYPE)
+    return
+
+
+def diff_notams(old, new, today):
+    """
+    Return the change set from the `old` to the `new` notam dictionaries (see
+    `process_html_data`): a dictionary with one entry per changed day, where
+    each entry has the lists 'added' and 'removed' of notams, and 'changed' of
+    [old_notam, new_notam] pairs with the same ident.
+
+    NOTAMs missing from `new` are only removed from days after `today`.
+
+    """
+    change_set = {}
+    for day in sorted(set(old) | set(new)):
+        old_notams = {notam['ident']: notam for notam in old.get(day, [])}
+        new_notams = {notam['ident']: notam for notam in new.get(day, [])}
+        changes = {'added': [notam for ident, notam in new_notams.items() if ident not in old_notams],
+                   'removed': [],
+                   'changed': [[old_notams[ident], notam] for ident, notam in new_notams.items()
+                               if ident in old_notams and notam != old_notams[ident]]}
+        if day > today:
+            changes['removed'] = [notam for ident, notam in old_notams.items() if ident not in new_notams]
+        if any(changes.values()):
+            change_set[day] = changes
+    return change_set
+
+
+def change_operations(change_set):
+    """
+    Return the `lib_notam_yaml.apply_operations` operations that apply
+    `change_set` (see `diff_notams`) to the day files.  A changed notam is
+    deleted and added again, so it is updated even if its stored copy was
+    edited or removed by hand.
+
+    """
+    operations = []
+    for day, changes in sorted(change_set.items()):
+        removed = changes['removed'] + [old_notam for old_notam, _ in changes['changed']]
+        added = changes['added'] + [new_notam for _, new_notam in changes['changed']]
+        operations.extend(dict(notam, op='del', day=day) for notam in removed)
+        operations.extend(dict(notam, op='add', day=day) for notam in added)
+    return operations
+
+
+def log_change_set(change_set, logfile):
+    """
+    Print a summary of `change_set` (see `diff_notams`) and append it to
+    FILE `logfile` as one JSON line.
+
+    """
+    if not change_set:
+        print("No NOTAMs changed since the last run.")
+    for day, changes in sorted(change_set.items()):
+        print('%s: %d added, %d removed, %d changed' % (day, len(changes['added']), len(changes['removed']),
+                                                        len(changes['changed'])))
+    entry = {'time': datetime.datetime.utcnow().isoformat(), 'changes': change_set}
+    with open(logfile, 'a') as fd:
+        print(json.dumps(entry, sort_keys=True), file=fd)
+
+
+def load_snapshot(filename):
+    """
+    Return the notam dictionary saved by the previous run, or an empty
+    dictionary if there is none.
+
+    """
+    try:
+        with open(filename, 'r') as fd:
+            return yaml.safe_load(fd) or {}
+    except FileNotFoundError:
+        return {}
+
+
+def save_snapshot(filename, notam_dict):
+    """
+    Save `notam_dict` as the snapshot for the next run to compare with.
+
+    """
+    with open(filename + '.tmp', 'w') as fd:
+        yaml.dump(notam_dict, fd)
+    os.replace(filename + '.tmp', filename)
+
+
+def parse_lines(lines, debug=False):
+    """
+    Return a dictionary of the NOTAMs found in the HTML `lines`, where
+        keys are unique (radius, latlon, timespan, tiers) tuples, and
+        values are lists of the notam idents matching the key.
+
+    """
     data = {}
-    if use_file:
-        with open(use_file, 'r') as fd:
-            lines = fd.readlines()
-    else:  # download url
-        r = requests.get(url)
-        lines = r.text.split('\n')
     for line in lines:
         if line.find('!GPS') < 0:
             continue
-        if options['--debug']:
+        if debug:
             print('parsing line:', line)
         key, value = process_html_line(line)
         if not key and not value:
@@ -80,7 +211,7 @@ def main(options):
             # e.g. "<span> !GPS <b>11/153</b> (KNMH A0027/18)  GPS NAV PRN 18 OUT OF SERVICE 1811191400-1902162359</span>"
             continue
 
-        if options['--debug']:
+        if debug:
             print('found key:', key, 'with value', value)
         if key not in data:
             data[key] = []
@@ -88,18 +219,7 @@ def main(options):
 
     for key in data:
         print('Read\n', data[key], *key)
-
-    notam_dict = process_html_data(data)
-    print("Exporting to yaml...")
-    for day, notam_list in notam_dict.items():
-        print(day, '\n', notam_list, '\n\n')
-        for notam in notam_list:
-            yaml_file = os.path.join(*datadir, '_'.join([day, 'notams.yaml']))
-            lyn.add_notam(yaml_file=yaml_file, **notam)
-    print("Updating plots...")
-    for day in notam_dict:
-        plot_notams.main(options=plot_notams.build_options(day=day))
-    return
+    return data
 
 
 def process_html_data(data):
@@ -116,12 +236,15 @@ def process_html_data(data):
                          'lon': '1174702W',
                          'rad': '400NM'}]}
 
+    NOTAMs that give radii at several altitudes also have the key 'tiers',
+    e.g. [{'rad': '270NM', 'alt': 'FL400-UNL'}, {'rad': '221NM', 'alt': 'FL250'}].
+
     """
     # Determine abbreviated idents, lats, lons, and dates.
     # ====================================================
     notam_dict = {}
     for key, idents in data.items():
-        radius, latlon, timespan = key
+        radius, latlon, timespan, tiers = key
         ident = abbreviate_idents(idents)
         lat, lon = split_latlon(latlon)
         notam = {
@@ -130,6 +253,8 @@ def process_html_data(data):
             'lon': lon,
             'rad': radius,
         }
+        if tiers:
+            notam['tiers'] = [{'rad': tier_radius, 'alt': altitude} for tier_radius, altitude in tiers]
         days = days_from_timespan(timespan)
         for day in days:
             if day not in notam_dict:
@@ -145,7 +270,9 @@ def process_html_line(line):
     RAW_NOTAM = "															<span> !GPS <b>10/155</b> (KZOA A0758/18)  ZOA NAV GPS (NTC GPS 18-38H) (INCLUDING WAAS, GBAS, AND ADS-B) MAY NOT BE AVBL WI A 270NM RADIUS CENTERED AT 352119N1163405W (HEC339034) FL400-UNL, 221NM RADIUS AT FL250, 148NM RADIUS AT 10000FT, 111NM RADIUS AT 4000FT AGL, 87NM RADIUS AT 50FT AGL. 1810271830-1810272030</span>"
 
     Returns the list [key, value],
-        where key is the tuple (max_radius, first_latlon, first_timespan)
+        where key is the tuple (max_radius, first_latlon, first_timespan, tiers),
+        tiers is a tuple of (radius, altitude) tuples, one for each radius
+        given at an altitude, e.g. (('270NM', 'FL400-UNL'), ('221NM', 'FL250'), ...),
         and value is the first ident found.
     """
     idents_found = [m.group('ident') for m in IDENT_SUBSTRING_RE.finditer(line)]
@@ -172,7 +299,10 @@ def process_html_line(line):
     except IndexError:
         return None, None
 
-    key = (max_radius, first_latlon, first_timespan)
+    tiers = tuple((''.join([m.group('radius'), 'NM']), m.group('altitude'))
+                  for m in TIER_SUBSTRING_RE.finditer(line))
+
+    key = (max_radius, first_latlon, first_timespan, tiers)
     value = first_ident
     return key, value
 
@@ -265,8 +395,13 @@ def build_options():
         options['--plotdir'] = PLOTDIR
     if not options['--datadir']:
         options['--datadir'] = DATADIR
+    else:
+        options['--datadir'] = [options['--datadir']]
     return options
 
 
 if __name__ == '__main__':
-    main(options=build_options())
+    options = build_options()
+    with lib_notam_metrics.profiled(process='retrieve_notams', directory=options['--profile']):
+        main(options=options)
+    lib_notam_metrics.save_snapshot(process='retrieve_notams')
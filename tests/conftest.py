@@ -0,0 +1,12 @@
+"""
+Shared test setup: make the top level modules importable when pytest is run
+from any directory.
+
+"""
+# Standard Imports
+import os
+import sys
+
+
+# Setup
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,233 @@
+"""
+Tests for the Flask app.
+
+"""
+# Standard Imports
+import os
+import pytest
+import re
+
+
+# Custom Imports
+import app
+import lib_notam_metrics
+import lib_notam_yaml as lny
+
+
+# Constants
+LABEL_RE = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+NOTAM = {'ident': '10/155', 'lat': '352119N', 'lon': '1163405W', 'rad': '270NM'}
+SAMPLE_RE = re.compile(r'^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)\{(?P<labels>.*)\} (?P<value>\S+)$')
+
+
+# Functions
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'DATA_DIR', [str(tmp_path)])
+    return app.app.test_client()
+
+
+def test_route_finds_notam(client, tmp_path):
+    lny.export_notams(yaml_file=str(tmp_path / '2018-10-10_notams.yaml'), notam_list=[NOTAM])
+    response = client.post('/notams/api/route', json={'start': '2018-10-10', 'routes': [
+        {'id': 'a', 'waypoints': [[34.0, -118.0], [36.0, -115.0]]}]})
+    assert response.status_code == 200
+    assert [hit['ident'] for hit in response.get_json()['routes'][0]['results']] == ['10/155']
+
+
+@pytest.mark.parametrize('body', [
+    {'start': '0001-01-01', 'end': '9999-12-31'},
+    {'start': '2018-01-01', 'end': '2019-01-02'},
+    {'start': 5},
+    {'start': '2018-10-10', 'end': ['2018-10-11']},
+])
+def test_route_rejects_bad_ranges(client, body):
+    body['routes'] = [{'id': 'a', 'waypoints': [[34.0, -118.0], [36.0, -115.0]]}]
+    assert client.post('/notams/api/route', json=body).status_code == 400
+
+
+def test_conditional_get_for_a_dated_day(client, tmp_path):
+    lny.export_notams(yaml_file=str(tmp_path / '2018-10-10_notams.yaml'), notam_list=[NOTAM])
+    response = client.get('/notams/api/?day=2018-10-10')
+    assert response.status_code == 200
+    assert response.headers['Last-Modified']
+    assert client.get('/notams/api/?day=2018-10-10',
+                      headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get('/notams/api/?day=2018-10-10',
+                      headers={'If-Modified-Since': response.headers['Last-Modified']}).status_code == 304
+    lny.export_notams(yaml_file=str(tmp_path / '2018-10-10_notams.yaml'), notam_list=[])
+    assert client.get('/notams/api/?day=2018-10-10',
+                      headers={'If-None-Match': response.headers['ETag']}).status_code == 200
+
+
+def test_conditional_get_across_utc_midnight(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(lny, 'utc_today', lambda: '2018-10-10')
+    lny.export_notams(yaml_file=str(tmp_path / '2018-10-10_notams.yaml'), notam_list=[NOTAM])
+    lny.export_notams(yaml_file=str(tmp_path / '2018-10-11_notams.yaml'), notam_list=[])
+    yesterday = client.get('/notams/api/')
+    assert 'Last-Modified' not in yesterday.headers
+    monkeypatch.setattr(lny, 'utc_today', lambda: '2018-10-11')
+    headers = {'If-None-Match': yesterday.headers['ETag'],
+               'If-Modified-Since': 'Fri, 31 Dec 9999 23:59:59 GMT'}
+    today = client.get('/notams/api/', headers=headers)
+    assert today.status_code == 200
+    assert today.get_json() == {'day': '2018-10-11', 'results': []}
+    assert client.get('/notams/api/', headers={'If-Modified-Since': 'Fri, 31 Dec 9999 23:59:59 GMT'}).status_code == 200
+
+
+def test_range_query_is_capped_before_reading_files(client, monkeypatch):
+    def no_stat(filenames, dated=True):
+        raise AssertionError('day files were read for a rejected range')
+    monkeypatch.setattr(app, 'file_validators', no_stat)
+    response = client.get('/notams/api/?start=0001-01-01&end=9999-12-31')
+    assert response.status_code == 400
+    assert 'at most 366 days' in response.get_json()['error']
+
+
+def test_range_query_at_the_cap(client, tmp_path):
+    lny.export_notams(yaml_file=str(tmp_path / '2018-12-31_notams.yaml'), notam_list=[NOTAM])
+    response = client.get('/notams/api/?start=2018-01-01&end=2018-12-31')
+    assert response.status_code == 200
+    assert [notam['day'] for notam in response.get_json()['results']] == ['2018-12-31']
+    assert client.get('/notams/api/?start=2018-01-01&end=2019-01-02').status_code == 400
+
+
+def test_days_in_range_limit():
+    assert len(lny.days_in_range('2018-01-01', '2018-01-10', limit=10)) == 10
+    with pytest.raises(ValueError):
+        lny.days_in_range('2018-01-01', '2018-01-11', limit=10)
+
+
+def test_only_the_current_image_version_is_immutable(client):
+    version = app.image_version(os.path.join(*app.IMAGE_DIR, 'map.png'))
+    current = client.get('/notams/static_notams/images/map.png?v=%s' % version)
+    assert current.status_code == 200
+    assert 'immutable' in current.headers['Cache-Control']
+    for url in ['/notams/static_notams/images/map.png?v=x', '/notams/static_notams/images/map.png']:
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.headers['Cache-Control'] == 'no-cache'
+
+
+def test_image_sources_list_jpeg_variants(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'IMAGE_DIR', [str(tmp_path)])
+    for name in ['2018-10-10_notams_960w.jpeg', '2018-10-10_notams_480w.jpeg', '2018-10-10_notams_480w.gif']:
+        (tmp_path / name).write_bytes(name.encode())
+    sources = app.image_sources('2018-10-10')
+    assert list(sources) == ['jpeg']
+    assert [source.split()[1] for source in sources['jpeg'].split(', ')] == ['480w', '960w']
+
+
+def test_batch_publishes_changed_days(client, tmp_path, monkeypatch):
+    published, scheduled = [], []
+    monkeypatch.setattr(app.lib_notam_events, 'publish_file',
+                        lambda event_type, filename: published.append((event_type, filename)))
+    monkeypatch.setattr(app.lib_plot_queue, 'schedule', lambda day: scheduled.append(day))
+    response = client.post('/notams/api/batch', json={'operations': [dict(NOTAM, op='add', day='2018-10-10')]})
+    assert response.status_code == 200
+    assert published == [('notams', str(tmp_path / '2018-10-10_notams.yaml'))]
+    assert scheduled == ['2018-10-10']
+
+
+def test_radius_edit_drops_old_tiers(client, tmp_path, monkeypatch):
+    import plot_notams
+    monkeypatch.setattr(app, 'notams_changed', lambda day: None)
+    yaml_file = str(tmp_path / '2018-10-10_notams.yaml')
+    lny.export_notams(yaml_file=yaml_file, notam_list=[dict(NOTAM, tiers=[{'rad': '270NM', 'alt': 'FL400'},
+                                                                          {'rad': '100NM', 'alt': '4000FT'}])])
+    response = client.post('/notams/api/batch', json={'operations': [
+        dict(NOTAM, op='upd', day='2018-10-10', rad='150NM', **{'orig_' + key: NOTAM[key] for key in NOTAM})]})
+    assert response.get_json()['results'] == [{'success': True, 'error': None}]
+    assert plot_notams.create_plot_dictionary(lny.import_notams(yaml_file=yaml_file))['tiers'] == [[(150, None)]]
+    # 200 NM north of the NOTAM is outside its new radius, 120 NM north is inside
+    for lat, idents in [(35.355278 + 200 / 60, []), (35.355278 + 120 / 60, ['10/155'])]:
+        response = client.get('/notams/api/point?day=2018-10-10&lat=%f&lon=-116.568056' % lat)
+        assert [hit['ident'] for hit in response.get_json()['results']] == idents
+
+
+@pytest.mark.parametrize('body', [{'day': '../../../tmp/evil'}, {'day': ['x']}, {'day': '2018-13-01'},
+                                  {'day': '2018-10-10', 'map': ['x']}])
+def test_plot_rejects_bad_days(client, monkeypatch, body):
+    submitted = []
+    monkeypatch.setattr(app.lib_plot_queue, 'submit', lambda **job: submitted.append(job))
+    assert client.post('/notams/api/plot', json=body).status_code == 400
+    assert client.post('/notams/', data={'btn': 'plot', 'day': '../../../tmp/evil'}).status_code == 400
+    assert submitted == []
+
+
+def test_plot_queues_a_normalized_day(client, monkeypatch):
+    monkeypatch.setattr(app.lib_plot_queue, 'submit', lambda **job: dict(job, id='x'))
+    response = client.post('/notams/api/plot', json={'day': '2018-1-5'})
+    assert response.status_code == 202
+    assert response.get_json() == {'id': 'x', 'day': '2018-01-05', 'map_type': lny.DEFAULT_MAP_TYPE}
+
+
+def test_range_validators_follow_archived_days(client, tmp_path):
+    yaml_file = str(tmp_path / '2018-10-10_notams.yaml')
+    lny.export_notams(yaml_file=yaml_file, notam_list=[NOTAM])
+    lny.compact_month(data_dir=str(tmp_path), month='2018-10')
+    url = '/notams/api/?start=2018-10-10&end=2018-10-11'
+    etag = client.get(url).headers['ETag']
+    lny.add_notam(yaml_file=yaml_file, **dict(NOTAM, ident='10/156'))
+    lny.compact_month(data_dir=str(tmp_path), month='2018-10')
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert [notam['ident'] for notam in response.get_json()['results']] == ['10/155', '10/156']
+
+
+@pytest.mark.parametrize('simplify', ['nan', 'inf', '-inf', '-0.1', 'x'])
+def test_geojson_rejects_bad_tolerances(client, simplify):
+    assert client.get('/notams/api/geojson?day=2018-10-10&simplify=' + simplify).status_code == 400
+
+
+def parse_exposition(text):
+    """
+    Return the metric types by family, and the samples as a list of
+    (name, labels, value), from Prometheus exposition `text`.
+
+    """
+    types, samples = {}, []
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            family, metric_type = line[len('# TYPE '):].split(' ')
+            types[family] = metric_type
+        elif line and not line.startswith('#'):
+            match = SAMPLE_RE.match(line)
+            assert match, line
+            samples.append((match.group('name'), dict(LABEL_RE.findall(match.group('labels'))),
+                            float(match.group('value'))))
+    return types, samples
+
+
+def test_metrics_exposition(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(lib_notam_metrics, 'histograms', {})
+    monkeypatch.setattr(lib_notam_metrics, 'counters', {})
+    worker = {'histograms': [], 'counters': [['notams_cache_requests_total', [['cache', 'png'], ['result', 'hit']], 3]]}
+    monkeypatch.setattr(lib_notam_metrics, 'load_snapshots', lambda metrics_dir: {'render_worker': worker})
+    lny.export_notams(yaml_file=str(tmp_path / '2018-10-10_notams.yaml'), notam_list=[NOTAM])
+    assert client.get('/notams/api/?day=2018-10-10').status_code == 200
+    app.image_version(os.path.join(*app.IMAGE_DIR, 'map.png'))
+    response = client.get('/notams/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    types, samples = parse_exposition(response.get_data(as_text=True))
+    assert types == {'notams_cache_requests_total': 'counter',
+                     'notams_request_seconds': 'histogram',
+                     'notams_stage_seconds': 'histogram'}
+    for name, labels, value in samples:
+        assert any(name == family or name in [family + '_bucket', family + '_sum', family + '_count']
+                   for family in types), name
+    cache = {(labels['process'], labels['cache'], labels['result']): value
+             for name, labels, value in samples if name == 'notams_cache_requests_total'}
+    assert cache[('render_worker', 'png', 'hit')] == 3
+    assert sum(value for (process, name, result), value in cache.items() if name == 'image_version') >= 1
+    for family, labels in [('notams_request_seconds', {'process': 'app', 'endpoint': 'get_api'}),
+                           ('notams_stage_seconds', {'process': 'app', 'stage': 'yaml_load'})]:
+        buckets = [(sample_labels['le'], value) for name, sample_labels, value in samples
+                   if name == family + '_bucket' and labels.items() <= sample_labels.items()]
+        counts = [value for name, sample_labels, value in samples
+                  if name == family + '_count' and sample_labels == labels]
+        assert buckets[-1][0] == '+Inf'
+        assert [float(bound) for bound, _ in buckets] == sorted(float(bound) for bound, _ in buckets)
+        assert [value for _, value in buckets] == sorted(value for _, value in buckets)  # cumulative
+        assert counts == [buckets[-1][1]] and counts[0] >= 1
@@ -0,0 +1,74 @@
+"""
+Tests for the outage heatmap.
+
+"""
+# Standard Imports
+import numpy as np
+import os
+import pytest
+import shutil
+
+
+# Custom Imports
+import heatmap_notams
+import lib_notam_history
+import lib_notam_yaml as lny
+
+
+# Constants
+DAYS = ['2018-10-09', '2018-10-10']
+
+
+# Functions
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """
+    A data directory with one day of NOTAMs, as the default directory of a
+    freshly built history cache.  Returns the directory and the list of day
+    files the heatmap reads instead of the cache.
+
+    """
+    data_dir = str(tmp_path / 'data')
+    os.makedirs(data_dir)
+    lny.export_notams(yaml_file=lny.day_file(data_dir, '2018-10-10'),
+                      notam_list=[{'ident': 10155, 'lat': '352119n', 'lon': '1163405w', 'rad': '270nm'},
+                                  {'ident': '10/156', 'lat': '000000S', 'lon': '0000000E', 'rad': '5'}])
+    history = lib_notam_history.build_history(data_dir=data_dir, history_dir=str(tmp_path / 'history'))
+    monkeypatch.setattr(lib_notam_history, 'DATA_DIR', data_dir)
+    monkeypatch.setattr(lib_notam_history, 'load_history', lambda: history)
+    reads = []
+
+    def import_notams(yaml_file):
+        reads.append(os.path.basename(yaml_file))
+        return lny.import_notams(yaml_file=yaml_file)
+    monkeypatch.setattr(heatmap_notams, 'import_notams', import_notams)
+    return data_dir, reads
+
+
+def test_day_file_and_history_loaders_agree(data_dir, monkeypatch):
+    data_dir, reads = data_dir
+    from_history = heatmap_notams.load_day_notams(days=DAYS, data_dir=data_dir)
+    assert reads == []
+    monkeypatch.setattr(lib_notam_history, 'load_history', lambda: None)
+    from_files = heatmap_notams.load_day_notams(days=DAYS, data_dir=data_dir)
+    assert reads == ['2018-10-09_notams.yaml', '2018-10-10_notams.yaml']
+    assert len(from_files) == len(from_history) == 1
+    for file_column, history_column in zip(from_files[0], from_history[0]):
+        np.testing.assert_allclose(file_column, history_column)
+    assert list(from_files[0][2]) == [270, 5]
+
+
+def test_history_is_not_used_once_a_day_changes(data_dir):
+    data_dir, reads = data_dir
+    lny.add_notam(yaml_file=lny.day_file(data_dir, '2018-10-10'), ident='10/157', lat='010000N',
+                  lon='0010000E', rad='1')
+    day_notams = heatmap_notams.load_day_notams(days=DAYS, data_dir=data_dir)
+    assert reads and list(day_notams[0][2]) == [270, 5, 1]
+
+
+def test_history_is_only_used_for_its_data_directory(data_dir, tmp_path):
+    data_dir, reads = data_dir
+    other_dir = str(tmp_path / 'other')
+    shutil.copytree(data_dir, other_dir)
+    heatmap_notams.load_day_notams(days=DAYS, data_dir=other_dir)
+    assert reads == ['2018-10-09_notams.yaml', '2018-10-10_notams.yaml']
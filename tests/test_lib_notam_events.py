@@ -0,0 +1,48 @@
+"""
+Tests for the server-sent event streams.
+
+"""
+# Standard Imports
+import pytest
+
+
+# Custom Imports
+import lib_notam_events
+
+
+# Functions
+@pytest.fixture
+def events(monkeypatch):
+    monkeypatch.setattr(lib_notam_events, 'start_watcher', lambda: None)
+    monkeypatch.setattr(lib_notam_events, 'open_streams', 0)
+    return lib_notam_events
+
+
+def test_stream_ends_after_its_lifetime(events, monkeypatch):
+    monkeypatch.setattr(events, 'STREAM_SECONDS', 0.2)
+    monkeypatch.setattr(events, 'KEEPALIVE_SECONDS', 0.05)
+    messages = list(events.stream())
+    assert messages[0].startswith('retry: %d\nid: ' % events.RETRY_MILLISECONDS)
+    assert messages[1:] and set(messages[1:]) == {': keepalive\n\n'}
+    assert events.open_streams == 0
+
+
+def test_stream_resumes_after_event_id(events, monkeypatch):
+    monkeypatch.setattr(events, 'STREAM_SECONDS', 0.1)
+    event_id = events.publish('job', day='2018-10-10')
+    events.publish('job', day='2018-10-11')
+    messages = list(events.stream(event_id=event_id))
+    assert 'id: %d\nevent: job\n' % (event_id + 1) in ''.join(messages)
+    assert 'id: %d\nevent: job\n' % event_id not in ''.join(messages)
+
+
+def test_streams_are_capped(events, monkeypatch):
+    monkeypatch.setattr(events, 'MAX_STREAMS', 1)
+    first = events.stream()
+    next(first)
+    assert list(events.stream()) == ['retry: %d\n\n' % events.BUSY_RETRY_MILLISECONDS]
+    first.close()
+    assert events.open_streams == 0
+    second = events.stream()
+    assert next(second).startswith('retry: %d\n' % events.RETRY_MILLISECONDS)
+    second.close()
@@ -0,0 +1,150 @@
+"""
+Tests for lib_notam_geo.
+
+"""
+# Standard Imports
+import math
+import numpy as np
+import random
+import threading
+
+
+# Custom Imports
+import lib_notam_geo as lng
+
+
+# Functions
+def dms(value, positive, negative, degree_digits):
+    seconds = int(round(abs(value) * 3600))
+    degrees, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return '%0*d%02d%02d%s' % (degree_digits, degrees, minutes, seconds, positive if value >= 0 else negative)
+
+
+def random_notams(generator, count):
+    return [{'ident': str(ii),
+             'lat': dms(generator.uniform(-89, 89), 'N', 'S', 2),
+             'lon': dms(generator.uniform(-179, 179), 'E', 'W', 3),
+             'rad': '%dNM' % generator.randint(1, 400)} for ii in range(count)]
+
+
+class EveryCell(dict):
+    """
+    Cells that hold every NOTAM, to test routes without the spatial
+    prefilter.
+
+    """
+    def __init__(self, count):
+        super().__init__()
+        self.count = count
+
+    def get(self, cell, default=None):
+        return list(range(self.count))
+
+
+def test_route_intersections_match_unfiltered():
+    generator = random.Random(46)
+    index = lng.build_index(random_notams(generator, count=300))
+    unfiltered = dict(index, cells=EveryCell(len(index['notams'])))
+    routes = [[(89.5, -100.0), (89.5, 80.0)],  # over the pole
+              [(10.0, 179.5), (-10.0, -179.5)],  # across the date line
+              [(35.0, -117.0)],  # a single waypoint
+              [(0.0, 0.0), (0.0, 180.0)]]  # antipodal, no unique great circle
+    routes += [[(generator.uniform(-89, 89), generator.uniform(-180, 180)) for _ in range(generator.randint(2, 5))]
+               for _ in range(40)]
+    for waypoints in routes:
+        expected = lng.route_intersections(index=unfiltered, waypoints=waypoints)
+        assert lng.route_intersections(index=index, waypoints=waypoints) == expected
+
+
+def test_route_cells_are_fewer_than_the_grid():
+    index = lng.build_index([])
+    cells = lng.route_cells(index=index, waypoints=[(35.0, -117.0), (40.0, -100.0)])
+    assert (125, 63) in cells  # 35N 117W
+    assert (130, 80) in cells  # 40N 100W
+    assert len(cells) < 200
+
+
+def test_day_cache_from_threads(tmp_path, monkeypatch):
+    monkeypatch.setattr(lng, 'day_cache', {})
+    monkeypatch.setattr(lng, 'DAY_CACHE_SIZE', 8)
+    errors = []
+
+    def lookup(thread):
+        try:
+            for ii in range(300):
+                yaml_file = str(tmp_path / ('%d_notams.yaml' % ((thread + ii) % 16)))
+                assert lng.cached_for_file(yaml_file=yaml_file, name='test', build=lambda: yaml_file) == yaml_file
+        except Exception as err:
+            errors.append(err)
+    threads = [threading.Thread(target=lookup, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(lng.day_cache) <= lng.DAY_CACHE_SIZE
+
+
+def test_coverage_grid_counts_overlaps():
+    count, cell_lats, cell_lons = lng.coverage_grid(latitudes=[0.0, 0.0, 40.0], longitudes=[0.0, 1.0, 179.9],
+                                                    radii=[120, 120, 60], resolution=0.5)
+    assert count.shape == (cell_lats.size, cell_lons.size) == (360, 720)
+
+    def cell(lat, lon):
+        return count[int((lat + 90) / 0.5), int((lon + 180) / 0.5)]
+    assert cell(0.1, 0.6) == 2  # inside both equatorial circles
+    assert cell(0.1, -1.4) == 1
+    assert cell(0.1, 3.6) == 0
+    assert cell(40.1, -179.9) == 1  # across the date line
+
+
+def test_coverage_area_of_a_circle():
+    count, cell_lats, cell_lons = lng.coverage_grid(latitudes=[45.0], longitudes=[10.0], radii=[300], resolution=0.1)
+    area = lng.coverage_area(mask=count > 0, cell_lats=cell_lats, resolution=0.1)
+    assert abs(area - math.pi * 300 ** 2) < 0.02 * math.pi * 300 ** 2
+
+
+def test_save_coverage(tmp_path):
+    count, cell_lats, cell_lons = lng.coverage_grid(latitudes=[10.0], longitudes=[20.0], radii=[300], resolution=1.0)
+    filename = str(tmp_path / 'coverage.npz')
+    lng.save_coverage(filename=filename, count=count, resolution=1.0)
+    with np.load(filename) as data:
+        assert data['count'].dtype == np.uint8
+        assert (data['count'] == count).all()
+        shape = tuple(data['shape'])
+        union = np.unpackbits(data['union'])[:shape[0] * shape[1]].reshape(shape)
+        assert (union == (count > 0)).all()
+        assert float(data['resolution']) == 1.0
+
+
+def test_simplify_ring_drops_points_within_tolerance():
+    # a closed square with points along its sides, slightly off the line
+    square = [(0, 0), (1, 0.01), (2, 0), (2, 1), (2, 2), (1, 2), (0, 2), (0, 1), (0, 0)]
+    assert lng.simplify_ring(points=square, tolerance=0.1) == [(0, 0), (2, 0), (2, 2), (0, 2), (0, 0)]
+    assert lng.simplify_ring(points=square, tolerance=0.001) == [(0, 0), (1, 0.01), (2, 0), (2, 2), (0, 2), (0, 0)]
+
+
+def test_simplify_ring_keeps_a_valid_ring():
+    ring = [(float(x), 0.0) for x in range(10)] + [(0.0, 0.0)]  # collapses to a line
+    simplified = lng.simplify_ring(points=ring, tolerance=100)
+    assert len(simplified) == 4
+    assert simplified[0] == simplified[-1]
+
+
+def test_notam_feature():
+    notam = {'ident': '10/155', 'lat': '352119N', 'lon': '1163405W', 'rad': '270NM',
+             'tiers': [{'rad': '270NM', 'alt': 'FL400'}, {'rad': '100NM', 'alt': '5000FT AGL'}]}
+    feature = lng.notam_feature(notam=notam)
+    ring = feature['geometry']['coordinates'][0]
+    assert feature['type'] == 'Feature' and feature['geometry']['type'] == 'Polygon'
+    assert len(ring) == 361 and ring[0] == ring[-1]
+    center = feature['properties']['center']
+    assert center == [-(116 + 34 / 60 + 5 / 3600), 35 + 21 / 60 + 19 / 3600]
+    for lon, lat in ring:
+        assert abs(lng.distance_nm(lat, lon, center[1], center[0]) - 270) < 0.5
+    assert feature['properties']['radius_nm'] == 270
+    assert feature['properties']['tiers'] == [{'radius_nm': 100, 'altitude_ft': 5000},
+                                              {'radius_nm': 270, 'altitude_ft': 40000}]
+    simplified = lng.notams_geojson(notam_list=[notam], tolerance=0.05)['features'][0]
+    assert 4 <= len(simplified['geometry']['coordinates'][0]) < len(ring)
@@ -0,0 +1,50 @@
+"""
+Tests for the NOTAM history cache.
+
+"""
+# Standard Imports
+import numpy as np
+import os
+import pytest
+
+
+# Custom Imports
+import lib_notam_history
+import lib_notam_yaml as lny
+
+
+# Functions
+def test_history_round_trip(tmp_path):
+    data_dir, history_dir = str(tmp_path / 'data'), str(tmp_path / 'history')
+    os.makedirs(data_dir)
+    lny.export_notams(yaml_file=lny.day_file(data_dir, '2018-10-10'),
+                      notam_list=[{'ident': 10155, 'lat': '352119n', 'lon': '1163405w', 'rad': '270nm'}])
+    lny.export_notams(yaml_file=lny.day_file(data_dir, '2018-10-11'),
+                      notam_list=[{'ident': '10/156', 'lat': '352119N', 'lon': '1163405W', 'rad': '30NM'},
+                                  {'ident': '10/157', 'lat': '000000S', 'lon': '0000000E', 'rad': '5'}])
+    history = lib_notam_history.build_history(data_dir=data_dir, history_dir=history_dir)
+    assert [str(day) for day in history['day']] == ['2018-10-10', '2018-10-11', '2018-10-11']
+    assert [lib_notam_history.ident(history, row) for row in range(3)] == ['10155', '10/156', '10/157']
+    np.testing.assert_allclose(history['lat'], [35.355278, 35.355278, 0.0], atol=1e-6)
+    np.testing.assert_allclose(history['lon'], [-116.568056, -116.568056, 0.0], atol=1e-6)
+    assert list(history['rad']) == [270, 30, 5]
+    assert lib_notam_history.day_rows(history, '2018-10-11', '2018-10-11') == slice(1, 3)
+
+    # later builds swap in a new version and keep only the one before it
+    first_dir = os.path.realpath(history_dir)
+    lib_notam_history.build_history(data_dir=data_dir, history_dir=history_dir)
+    rebuilt = lib_notam_history.build_history(data_dir=data_dir, history_dir=history_dir)
+    assert len(lib_notam_history.history_versions(history_dir=history_dir)) == lib_notam_history.KEEP_VERSIONS
+    assert not os.path.exists(first_dir)
+    assert list(history['rad']) == list(rebuilt['rad']) == [270, 30, 5]
+
+
+def test_history_refuses_to_replace_a_directory(tmp_path):
+    data_dir = str(tmp_path / 'data')
+    os.makedirs(data_dir)
+    lny.export_notams(yaml_file=lny.day_file(data_dir, '2018-10-10'),
+                      notam_list=[{'ident': '10/155', 'lat': '352119N', 'lon': '1163405W', 'rad': '270NM'}])
+    with pytest.raises(IOError):
+        lib_notam_history.build_history(data_dir=data_dir, history_dir=data_dir)
+    assert os.listdir(data_dir) == ['2018-10-10_notams.yaml']
+    assert os.listdir(str(tmp_path)) == ['data']
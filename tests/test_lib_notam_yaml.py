@@ -0,0 +1,121 @@
+"""
+Tests for lib_notam_yaml.
+
+"""
+# Standard Imports
+import pytest
+import threading
+import yaml
+
+
+# Custom Imports
+import lib_notam_yaml as lny
+
+
+# Constants
+NOTAM = {'ident': '10/155', 'lat': '352119N', 'lon': '1163405W', 'rad': '270NM'}
+
+
+# Functions
+def test_batch_operations(tmp_path):
+    data_dir = str(tmp_path)
+    operations = [dict(NOTAM, op='add', day='2024-1-5'),
+                  {'op': 'add', 'day': '2024-01-05', 'ident': 7, 'lat': '393835n', 'lon': '1174702w', 'rad': 400},
+                  dict(NOTAM, op='add', day='2024-01-05'),  # already added, a no-op
+                  {'op': 'del', 'day': '2024-01-06', 'ident': 'x', 'lat': '000000N', 'lon': '0000000E', 'rad': '1'},
+                  {'op': 'add', 'day': '2024-13-01', 'ident': 'x', 'lat': '000000N', 'lon': '0000000E', 'rad': '1'},
+                  {'op': 'add', 'day': '2024-01-05', 'ident': 'x', 'lat': 'north', 'lon': '0000000E', 'rad': '1'},
+                  {'op': 'nop', 'day': '2024-01-05'}]
+    results, changed_days = lny.apply_operations(data_dir=data_dir, operations=operations)
+    assert [result['success'] for result in results] == [True, True, True, False, False, False, False]
+    assert results[3]['error'] == lny.NOTAM_NOT_FOUND.format(day='2024-01-06')
+    assert results[4]['error'] == lny.INVALID_DAY.format(day='2024-13-01')
+    assert changed_days == ['2024-01-05']
+    assert sorted(path.name for path in tmp_path.glob('*_notams.yaml')) == ['2024-01-05_notams.yaml']
+    stored = lny.import_notams(yaml_file=lny.day_file(data_dir=data_dir, day='2024-01-05'))
+    assert stored == [NOTAM, {'ident': '7', 'lat': '393835N', 'lon': '1174702W', 'rad': '400'}]
+
+
+def test_batch_edits_match_normalized_values(tmp_path):
+    data_dir = str(tmp_path)
+    lny.apply_operations(data_dir=data_dir, operations=[
+        {'op': 'add', 'day': '2024-01-05', 'ident': 7, 'lat': '393835n', 'lon': '1174702w', 'rad': 400}])
+    results, _ = lny.apply_operations(data_dir=data_dir, operations=[
+        {'op': 'upd', 'day': '2024-1-5', 'orig_ident': '7', 'orig_lat': '393835N', 'orig_lon': '1174702W',
+         'orig_rad': '400', 'ident': '7', 'lat': '393835N', 'lon': '1174702W', 'rad': '300NM'},
+        {'op': 'del', 'day': '2024-01-05', 'ident': 7, 'lat': '393835n', 'lon': '1174702w', 'rad': '300nm'}])
+    assert [result['success'] for result in results] == [True, True]
+    assert lny.import_notams(yaml_file=lny.day_file(data_dir=data_dir, day='2024-01-05')) == []
+
+
+def test_normalize_day():
+    assert lny.normalize_day('2024-1-5') == '2024-01-05'
+    assert lny.normalize_day(20240105) is None
+    assert lny.normalize_day('2024-02-30') is None
+
+
+def test_import_archived_day(tmp_path):
+    yaml_file = lny.day_file(str(tmp_path), '2018-10-10')
+    lny.export_notams(yaml_file=yaml_file, notam_list=[NOTAM])
+    assert lny.compact_month(data_dir=str(tmp_path), month='2018-10') == [yaml_file]
+    assert [notam['ident'] for notam in lny.import_notams(yaml_file=yaml_file)] == ['10/155']
+
+
+def test_import_refuses_python_tags(tmp_path):
+    yaml_file = lny.day_file(str(tmp_path), '2018-10-10')
+    with open(yaml_file, 'w') as fd:
+        print('- !!python/object/apply:os.system ["true"]', file=fd)
+    with pytest.raises(yaml.YAMLError):
+        lny.import_notams(yaml_file=yaml_file)
+
+
+def test_tiers_on_edit(tmp_path):
+    yaml_file = lny.day_file(str(tmp_path), '2018-10-10')
+    tiers = [{'rad': '270NM', 'alt': 'FL400'}, {'rad': '100NM', 'alt': '4000FT'}]
+    notam_list = [NOTAM, dict(NOTAM, tiers=tiers)]  # differs in tiers only
+    assert lny.find_notam(notam_list=notam_list, tiers=tiers, **NOTAM) == 1
+    assert lny.find_notam(notam_list=notam_list, tiers=[], **NOTAM) == 0
+    assert lny.find_notam(notam_list=notam_list, **NOTAM) == 0
+
+    lny.export_notams(yaml_file=yaml_file, notam_list=[dict(NOTAM, tiers=tiers)])
+    lny.modify_notam(yaml_file=yaml_file, ident='10/156', lat=NOTAM['lat'], lon=NOTAM['lon'], rad='270',
+                     **{'orig_' + key: NOTAM[key] for key in NOTAM})
+    assert lny.import_notams(yaml_file=yaml_file)[0]['tiers'] == tiers  # same radius, tiers kept
+    new_tiers = [{'rad': '50NM', 'alt': '10000FT'}]
+    lny.modify_notam(yaml_file=yaml_file, orig_ident='10/156', orig_lat=NOTAM['lat'], orig_lon=NOTAM['lon'],
+                     orig_rad='270', ident='10/156', lat=NOTAM['lat'], lon=NOTAM['lon'], rad='50', tiers=new_tiers)
+    assert lny.import_notams(yaml_file=yaml_file)[0]['tiers'] == new_tiers
+    lny.modify_notam(yaml_file=yaml_file, orig_ident='10/156', orig_lat=NOTAM['lat'], orig_lon=NOTAM['lon'],
+                     orig_rad='50', ident='10/156', lat=NOTAM['lat'], lon=NOTAM['lon'], rad='60')
+    assert 'tiers' not in lny.import_notams(yaml_file=yaml_file)[0]
+
+
+def test_concurrent_edits_keep_every_change(tmp_path):
+    yaml_file = lny.day_file(str(tmp_path), '2018-10-10')
+    threads = [threading.Thread(target=lny.add_notam, kwargs=dict(NOTAM, yaml_file=yaml_file, ident='10/%d' % ii))
+               for ii in range(20)]
+    threads.append(threading.Thread(target=lny.apply_operations, kwargs={
+        'data_dir': str(tmp_path), 'operations': [dict(NOTAM, op='add', day='2018-10-10', ident='11/1')]}))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(lny.import_notams(yaml_file=yaml_file)) == 21
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['2018-10-10_notams.yaml',
+                                                                '2018-10-10_notams.yaml' + lny.DAY_LOCK_SUFFIX]
+
+
+def test_tiered_notam_replaces_its_untiered_copy(tmp_path):
+    yaml_file = lny.day_file(str(tmp_path), '2018-10-10')
+    tiered = dict(NOTAM, tiers=[{'rad': '270NM', 'alt': 'FL400'}, {'rad': '100NM', 'alt': '4000FT'}])
+    lny.export_notams(yaml_file=yaml_file, notam_list=[NOTAM])  # stored before tiers were kept
+    results, changed_days = lny.apply_operations(data_dir=str(tmp_path),
+                                                 operations=[dict(tiered, op='add', day='2018-10-10')])
+    assert results[0]['success'] and changed_days == ['2018-10-10']
+    assert lny.import_notams(yaml_file=yaml_file) == [tiered]
+    lny.add_notam(yaml_file=yaml_file, **NOTAM)  # the untiered copy adds nothing
+    lny.add_notam(yaml_file=yaml_file, **tiered)
+    assert lny.import_notams(yaml_file=yaml_file) == [tiered]
+    other_tiers = [{'rad': '270NM', 'alt': 'FL250'}]
+    lny.add_notam(yaml_file=yaml_file, tiers=other_tiers, **NOTAM)
+    assert lny.import_notams(yaml_file=yaml_file) == [tiered, dict(NOTAM, tiers=other_tiers)]
@@ -0,0 +1,89 @@
+"""
+Tests for the plot job queue.
+
+"""
+# Standard Imports
+from collections import OrderedDict
+import queue
+import threading
+import time
+
+
+# Custom Imports
+import lib_notam_yaml as lny
+import lib_plot_queue
+
+
+# Functions
+def wait_for(job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while lib_plot_queue.status(job_id)['status'] not in ['done', 'failed']:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return lib_plot_queue.status(job_id)
+
+
+def test_jobs_for_one_plot_never_render_together(monkeypatch):
+    rendering, overlaps, started = [], [], threading.Event()
+
+    def render_day(day, map_type):
+        overlaps.append((day, map_type) in rendering)
+        rendering.append((day, map_type))
+        started.set()
+        time.sleep(0.2)
+        rendering.remove((day, map_type))
+        return '%s_notams.png' % day
+    monkeypatch.setattr(lib_plot_queue, 'render_day', render_day)
+    first = lib_plot_queue.submit(day='2018-10-10')
+    assert started.wait(timeout=10)
+    second = lib_plot_queue.submit(day='2018-10-10')  # the first job is no longer pending
+    other = lib_plot_queue.submit(day='2018-10-11')
+    assert second['id'] != first['id']
+    assert [wait_for(job['id'])['status'] for job in [first, second, other]] == ['done'] * 3
+    assert overlaps == [False, False, False]
+
+
+def test_burst_of_schedules_renders_once(monkeypatch):
+    rendered = []
+
+    def render_day(day, map_type):
+        rendered.append((day, map_type))
+        return '%s_notams.png' % day
+    monkeypatch.setattr(lib_plot_queue, 'render_day', render_day)
+    for _ in range(10):
+        lib_plot_queue.schedule(day='2018-10-12', delay=0.2)
+        time.sleep(0.01)
+    deadline = time.monotonic() + 10
+    while ('2018-10-12', lny.DEFAULT_MAP_TYPE) in lib_plot_queue.timers:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    lib_plot_queue.job_queue.join()
+    assert rendered == [('2018-10-12', lny.DEFAULT_MAP_TYPE)]
+
+
+def test_rescheduled_timer_does_not_submit(monkeypatch):
+    submitted = []
+    monkeypatch.setattr(lib_plot_queue, 'submit', lambda day, map_type: submitted.append((day, map_type)))
+    lib_plot_queue.schedule(day='2018-10-13', delay=60)
+    key = ('2018-10-13', lny.DEFAULT_MAP_TYPE)
+    current = lib_plot_queue.timers[key]
+    stale = threading.Timer(60, lib_plot_queue.run_scheduled)
+    lib_plot_queue.run_scheduled(*key, timer=stale)  # fired just as it was replaced
+    assert submitted == []
+    assert lib_plot_queue.timers[key] is current
+    lib_plot_queue.run_scheduled(*key, timer=current)
+    assert submitted == [key]
+    assert key not in lib_plot_queue.timers
+    current.cancel()
+
+
+def test_queued_job_is_shared(monkeypatch):
+    monkeypatch.setattr(lib_plot_queue, 'job_queue', queue.Queue())  # no worker takes the jobs
+    monkeypatch.setattr(lib_plot_queue, 'jobs', OrderedDict())
+    monkeypatch.setattr(lib_plot_queue, 'pending', {})
+    first = lib_plot_queue.submit(day='2018-10-14')
+    again = lib_plot_queue.submit(day='2018-10-14')
+    other = lib_plot_queue.submit(day='2018-10-14', map_type='etopo')
+    assert again == first and first['status'] == 'queued'
+    assert other['id'] != first['id']
+    assert lib_plot_queue.job_queue.qsize() == 2
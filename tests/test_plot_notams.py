@@ -0,0 +1,117 @@
+"""
+Tests for plot_notams.
+
+"""
+# Standard Imports
+import io
+from mpl_toolkits.basemap import Basemap
+from PIL import Image
+import pytest
+
+
+# Custom Imports
+import plot_notams
+
+
+# Constants
+NOTAM_LIST = [{'ident': '10/155', 'lat': '352119N', 'lon': '1163405W', 'rad': '270NM'},
+              {'ident': '10/200', 'lat': '393835N', 'lon': '1174702W', 'rad': '400NM',
+               'tiers': [{'rad': '400NM', 'alt': 'FL400'}, {'rad': '300NM', 'alt': 'FL250'}]}]
+
+
+# Functions
+@pytest.fixture
+def background():
+    """
+    A light (fig, map) background, without coastlines or a warped image.
+
+    """
+    fig = plot_notams.new_figure()
+    ax = fig.add_axes([0.0, 0.05, 1.0, 0.9])
+    map = Basemap(projection='ortho', lat_0=45, lon_0=-100, resolution=None, ax=ax)
+    yield fig, map
+    plot_notams.close_background((fig, map))
+
+
+def overlay(map):
+    """
+    Return the (lines, texts, title) drawn on `map`.
+
+    """
+    return len(map.ax.lines), len(map.ax.texts), map.ax.get_title()
+
+
+def fail_to_save(*args, **kwargs):
+    raise OSError('disk full')
+
+
+def test_make_plot_clears_background(background):
+    fig, map = background
+    before = overlay(map)
+    buf = io.BytesIO()
+    plot_notams.make_plot(notams=plot_notams.build_notams(NOTAM_LIST), day='2018-10-10', outfile=buf,
+                          map_type='basic', background=background)
+    assert buf.getvalue().startswith(b'\x89PNG')
+    assert overlay(map) == before
+
+
+def test_make_plot_clears_background_after_failure(background, monkeypatch):
+    fig, map = background
+    before = overlay(map)
+    monkeypatch.setattr(plot_notams, 'save_plot', fail_to_save)
+    with pytest.raises(OSError):
+        plot_notams.make_plot(notams=plot_notams.build_notams(NOTAM_LIST), day='2018-10-10', outfile=io.BytesIO(),
+                              map_type='basic', background=background)
+    assert overlay(map) == before
+
+
+def test_make_plot_clears_partial_drawing(background, monkeypatch):
+    fig, map = background
+    before = overlay(map)
+    notams = plot_notams.build_notams(NOTAM_LIST)
+    notams['idents'].append('missing circles')  # fails after the first circles are drawn
+    with pytest.raises(IndexError):
+        plot_notams.make_plot(notams=notams, day='2018-10-10', outfile=io.BytesIO(), map_type='basic',
+                              background=background)
+    assert overlay(map) == before
+
+
+def test_render_days_clears_background_after_failure(background, monkeypatch):
+    fig, map = background
+    before = overlay(map)
+    monkeypatch.setattr(plot_notams, 'load_notams', lambda yaml_file: plot_notams.build_notams(NOTAM_LIST))
+    monkeypatch.setattr(plot_notams, 'save_plot', fail_to_save)
+    with pytest.raises(OSError):
+        plot_notams.render_days(days=['2018-10-10', '2018-10-11'], map_type='basic', background=background)
+    assert overlay(map) == before
+
+
+def test_save_plot_replaces_variants(tmp_path):
+    fig = plot_notams.new_figure(figsize=(2, 1))
+    outfile = str(tmp_path / '2018-10-10_notams.png')
+    plot_notams.save_plot(fig=fig, outfile=outfile, formats='png8,webp')
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        '2018-10-10_notams.png', '2018-10-10_notams_480w.png', '2018-10-10_notams_480w.webp',
+        '2018-10-10_notams_600w.webp']
+    plot_notams.save_plot(fig=fig, outfile=outfile, formats='png8')
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        '2018-10-10_notams.png', '2018-10-10_notams_480w.png']
+    plot_notams.save_plot(fig=fig, outfile=outfile, formats='none')
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['2018-10-10_notams.png']
+
+
+def test_save_plot_jpeg_variants(tmp_path):
+    fig = plot_notams.new_figure(figsize=(2, 1))
+    outfile = str(tmp_path / '2018-10-10_notams.png')
+    plot_notams.save_plot(fig=fig, outfile=outfile, formats='jpeg')
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        '2018-10-10_notams.png', '2018-10-10_notams_480w.jpeg', '2018-10-10_notams_600w.jpeg']
+    with Image.open(str(tmp_path / '2018-10-10_notams_480w.jpeg')) as image:
+        assert image.format == 'JPEG'
+        assert image.size == (480, 240)
+
+
+@pytest.mark.parametrize('formats', ['gif', 'png8,jpg', 'webp,'])
+def test_unknown_formats_are_rejected(formats):
+    with pytest.raises(ValueError):
+        plot_notams.variant_encodings(formats)
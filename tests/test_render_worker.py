@@ -0,0 +1,39 @@
+"""
+Tests for render_worker.
+
+"""
+# Standard Imports
+import threading
+
+
+# Custom Imports
+import render_worker
+
+
+# Functions
+def fake_job(job, address=None):
+    return {'png': ('%s %s' % (job['day'], job['notam_list'][0]['ident'])).encode()}
+
+
+def test_render_png_cache_from_threads(monkeypatch):
+    monkeypatch.setattr(render_worker, 'send_job', fake_job)
+    monkeypatch.setattr(render_worker, 'png_cache', render_worker.OrderedDict())
+    errors = []
+
+    def render(thread):
+        try:
+            for ii in range(200):
+                ident = str((thread + ii) % (render_worker.PNG_CACHE_SIZE * 2))
+                notam_list = [{'ident': ident, 'lat': '352119N', 'lon': '1163405W', 'rad': '270NM'}]
+                png = render_worker.render_png(notam_list=notam_list, day='2018-10-10', map_type='basic')
+                assert png == ('2018-10-10 %s' % ident).encode()
+        except Exception as err:
+            errors.append(err)
+
+    threads = [threading.Thread(target=render, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(render_worker.png_cache) == render_worker.PNG_CACHE_SIZE
@@ -0,0 +1,52 @@
+"""
+Tests for the incremental ingest of retrieve_notams.
+
+"""
+# Custom Imports
+import lib_notam_yaml as lny
+import retrieve_notams
+
+
+# Constants
+KEPT = {'ident': '10/155', 'lat': '352119N', 'lon': '1163405W', 'rad': '270NM'}
+GONE = {'ident': '10/156', 'lat': '393835N', 'lon': '1174702W', 'rad': '400NM'}
+MOVED = {'ident': '10/157', 'lat': '000000N', 'lon': '0000000E', 'rad': '5NM'}
+TIERED = dict(MOVED, lat='010000N', tiers=[{'rad': '5NM', 'alt': 'FL250'}, {'rad': '2NM', 'alt': '4000FT'}])
+
+
+# Functions
+def test_diff_notams():
+    old = {'2018-10-10': [KEPT, GONE], '2018-10-11': [KEPT, GONE, MOVED]}
+    new = {'2018-10-10': [KEPT], '2018-10-11': [KEPT, TIERED], '2018-10-12': [KEPT]}
+    change_set = retrieve_notams.diff_notams(old=old, new=new, today='2018-10-10')
+    # a notam that disappears has only expired on today and past days
+    assert sorted(change_set) == ['2018-10-11', '2018-10-12']
+    assert change_set['2018-10-11'] == {'added': [], 'removed': [GONE], 'changed': [[MOVED, TIERED]]}
+    assert change_set['2018-10-12'] == {'added': [KEPT], 'removed': [], 'changed': []}
+    assert retrieve_notams.diff_notams(old=new, new=new, today='2018-10-10') == {}
+
+
+def test_change_operations_update_day_files(tmp_path):
+    data_dir = str(tmp_path)
+    old = {'2018-10-11': [KEPT, GONE, MOVED]}
+    new = {'2018-10-11': [KEPT, TIERED]}
+    lny.apply_operations(data_dir=data_dir, operations=retrieve_notams.change_operations(
+        retrieve_notams.diff_notams(old={}, new=old, today='2018-10-10')))
+    change_set = retrieve_notams.diff_notams(old=old, new=new, today='2018-10-10')
+    results, changed_days = lny.apply_operations(data_dir=data_dir,
+                                                 operations=retrieve_notams.change_operations(change_set))
+    assert all(result['success'] for result in results)
+    assert changed_days == ['2018-10-11']
+    assert lny.import_notams(yaml_file=lny.day_file(data_dir, '2018-10-11')) == [KEPT, TIERED]
+
+
+def test_snapshot_round_trip(tmp_path):
+    snapshot_file = str(tmp_path / retrieve_notams.SNAPSHOT_FILE)
+    assert retrieve_notams.load_snapshot(snapshot_file) == {}
+    # days share notam dictionaries, which are dumped as YAML aliases
+    notam_dict = {'2018-10-10': [KEPT, TIERED], '2018-10-11': [KEPT, TIERED]}
+    retrieve_notams.save_snapshot(filename=snapshot_file, notam_dict=notam_dict)
+    assert retrieve_notams.load_snapshot(snapshot_file) == notam_dict
+    assert sorted(path.name for path in tmp_path.iterdir()) == [retrieve_notams.SNAPSHOT_FILE]
+    open(snapshot_file, 'w').close()
+    assert retrieve_notams.load_snapshot(snapshot_file) == {}